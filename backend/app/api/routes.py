@@ -1,26 +1,183 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from typing import Annotated
-import tempfile
+from fastapi import (
+    APIRouter,
+    UploadFile,
+    HTTPException,
+    Depends,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import Annotated, AsyncIterator, List, Literal, Optional, Union
+import asyncio
+import json
 import os
 import logging
 
 from ..models.detection import (
+    BatchDicomDetectionItem,
+    BatchDicomMetadataItem,
+    BatchDicomMetadataResponse,
     DetectionResponse,
     DicomDetectionResponse,
+    DicomMetadata,
     ErrorResponse,
+    MultiFrameDicomDetectionResponse,
     DiagnosticReportResponse,
     DiagnosticReportRequest,
+    ReportJob,
 )
 from ..services.inference_service import InferenceService, get_inference_service
 from ..services.diagnostic_service import (
     DiagnosticReportService,
     get_diagnostic_report_service,
 )
+from ..core.admission import get_admission_controller
 from ..core.config import get_settings, Settings
+from ..core.metrics import PROMETHEUS_CONTENT_TYPE, get_metrics_registry
+from ..core.startup import get_startup_report
+from ..core.timing import TimedRoute
+from ..core.executors import get_worker_pools
+from ..dependencies.admin import verify_admin_key
+from ..dependencies.uploads import (
+    BATCH_UPLOAD_REQUEST_BODY,
+    UPLOAD_REQUEST_BODY,
+    StreamedUpload,
+    read_upload,
+    read_uploads,
+)
+from ..services.cache_service import get_detection_cache, get_report_cache
+from ..services.inference_backends import get_inference_backends
+from ..services.single_flight import get_detection_flights
+from ..services.batching import get_inference_batcher
+from ..services.report_jobs import ReportJobQueue, get_report_job_queue
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/api/v1", tags=["detection"])
+router = APIRouter(prefix="/api/v1", tags=["detection"], route_class=TimedRoute)
+
+ALLOWED_DICOM_EXTENSIONS = [".dcm", ".dicom", ".DCM", ".DICOM"]
+
+# Admission lane of each expensive endpoint; other endpoints are not queued
+ENDPOINT_CLASSES = {
+    f"{router.prefix}/detect": "detect",
+    f"{router.prefix}/detect-dicom": "dicom",
+    f"{router.prefix}/detect-dicom/frames": "dicom",
+    f"{router.prefix}/detect-dicom/batch": "dicom",
+    f"{router.prefix}/generate-diagnostic-report": "report",
+    f"{router.prefix}/generate-diagnostic-report/stream": "report",
+    f"{router.prefix}/dicom-metadata": "metadata",
+    f"{router.prefix}/dicom-metadata/batch": "metadata",
+}
+
+
+def _validate_image_file(
+    file: Union[UploadFile, StreamedUpload], settings: Settings
+) -> None:
+    """Reject uploads that are not an allowed image content type"""
+    if file.content_type not in settings.allowed_file_types:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File must be one of: {', '.join(settings.allowed_file_types)}",
+        )
+
+
+def _validate_dicom_file(
+    file: Union[UploadFile, StreamedUpload], settings: Settings
+) -> None:
+    """Reject uploads that are neither a DICOM content type nor extension"""
+    file_extension = os.path.splitext(file.filename or "")[1] if file.filename else ""
+
+    if (
+        file.content_type not in settings.allowed_dicom_file_types
+        and file_extension not in ALLOWED_DICOM_EXTENSIONS
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"File must be a DICOM file (.dcm, .dicom) or have content type: {', '.join(settings.allowed_dicom_file_types)}",
+        )
+
+
+async def image_upload(
+    request: Request, settings: Annotated[Settings, Depends(get_settings)]
+) -> AsyncIterator[StreamedUpload]:
+    """Stream an uploaded image, rejecting it as soon as it is invalid"""
+    upload = await read_upload(
+        request, settings, validate=lambda file: _validate_image_file(file, settings)
+    )
+    try:
+        yield upload
+    finally:
+        upload.close()
+
+
+async def dicom_upload(
+    request: Request, settings: Annotated[Settings, Depends(get_settings)]
+) -> AsyncIterator[StreamedUpload]:
+    """Stream an uploaded DICOM file, rejecting it as soon as it is invalid"""
+    upload = await read_upload(
+        request,
+        settings,
+        validate=lambda file: _validate_dicom_file(file, settings),
+        require_dicom=True,
+        suffix=".dcm",
+    )
+    try:
+        yield upload
+    finally:
+        upload.close()
+
+
+async def dicom_file_upload(
+    request: Request, settings: Annotated[Settings, Depends(get_settings)]
+) -> AsyncIterator[StreamedUpload]:
+    """Stream an uploaded DICOM file into a temporary file"""
+    upload = await read_upload(
+        request,
+        settings,
+        validate=lambda file: _validate_dicom_file(file, settings),
+        require_dicom=True,
+        in_memory=False,
+        suffix=".dcm",
+    )
+    try:
+        yield upload
+    finally:
+        upload.close()
+
+
+async def _detect_dicom(
+    source: Union[bytes, str],
+    content_hash: Optional[str],
+    inference_service: InferenceService,
+    settings: Settings,
+) -> DicomDetectionResponse:
+    """Run the DICOM detection pipeline on an uploaded file or its bytes"""
+    try:
+        # Process DICOM file: extract metadata, convert to image, and run inference
+        inference_results, metadata, image_info = (
+            await inference_service.detect_dental_conditions_from_dicom(
+                source, settings.default_model_id, content_hash=content_hash
+            )
+        )
+
+        return DicomDetectionResponse(
+            predictions=inference_results.get("predictions", []),
+            metadata=metadata,
+            image_info=image_info,
+        )
+
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
+    except Exception as e:
+        logger.error(
+            f"Unexpected error in DICOM detection endpoint: {str(e)}", exc_info=True
+        )
+        raise HTTPException(
+            status_code=500,
+            detail="An unexpected error occurred during DICOM processing",
+        )
 
 
 @router.post(
@@ -31,9 +188,10 @@ router = APIRouter(prefix="/api/v1", tags=["detection"])
         413: {"model": ErrorResponse, "description": "File too large"},
         500: {"model": ErrorResponse, "description": "Inference failed"},
     },
+    openapi_extra=UPLOAD_REQUEST_BODY,
 )
 async def detect_dental_conditions(
-    file: UploadFile,
+    upload: Annotated[StreamedUpload, Depends(image_upload)],
     inference_service: Annotated[InferenceService, Depends(get_inference_service)],
     settings: Annotated[Settings, Depends(get_settings)],
 ) -> DetectionResponse:
@@ -42,46 +200,15 @@ async def detect_dental_conditions(
 
     This endpoint processes dental X-ray images and returns detected conditions
     with their locations, confidence scores, and classifications.
-    """
-
-    # Validate file type
-    if file.content_type not in settings.allowed_file_types:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File must be one of: {', '.join(settings.allowed_file_types)}",
-        )
-
-    # Validate file size efficiently using seek
-    if file.size and file.size > settings.max_file_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File size ({file.size} bytes) exceeds maximum allowed size ({settings.max_file_size} bytes)",
-        )
 
-    # Read content only once
-    content = await file.read()
-
-    # Double-check size if not available from file.size
-    if not file.size and len(content) > settings.max_file_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File size ({len(content)} bytes) exceeds maximum allowed size ({settings.max_file_size} bytes)",
-        )
-
-    # Save uploaded file temporarily
-    temp_file_path = None
+    The image is uploaded as the multipart field `file`. It is read as it
+    streams in and rejected as soon as it exceeds the maximum file size.
+    """
     try:
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=os.path.splitext(file.filename or "image.jpg")[1]
-        ) as temp_file:
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        # Run inference using the service
+        # Small uploads are handed over as bytes, larger ones as a file path
         result = await inference_service.detect_dental_conditions(
-            temp_file_path, settings.default_model_id
+            upload.source, settings.default_model_id, content_hash=upload.content_hash
         )
-
         return DetectionResponse(**result)
 
     except HTTPException:
@@ -92,13 +219,6 @@ async def detect_dental_conditions(
         raise HTTPException(
             status_code=500, detail="An unexpected error occurred during processing"
         )
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except OSError as e:
-                logger.warning(f"Failed to delete temporary file {temp_file_path}: {e}")
 
 
 @router.post(
@@ -112,11 +232,17 @@ async def detect_dental_conditions(
         413: {"model": ErrorResponse, "description": "File too large"},
         500: {"model": ErrorResponse, "description": "Processing failed"},
     },
+    openapi_extra=UPLOAD_REQUEST_BODY,
 )
 async def detect_dental_conditions_dicom(
-    file: UploadFile,
+    upload: Annotated[StreamedUpload, Depends(dicom_upload)],
     inference_service: Annotated[InferenceService, Depends(get_inference_service)],
+    job_queue: Annotated[ReportJobQueue, Depends(get_report_job_queue)],
     settings: Annotated[Settings, Depends(get_settings)],
+    report: Annotated[
+        bool,
+        Query(description="Start generating the diagnostic report right away"),
+    ] = False,
 ) -> DicomDetectionResponse:
     """
     Detect cavities and periapical lesions in uploaded DICOM file
@@ -131,49 +257,82 @@ async def detect_dental_conditions_dicom(
     - Detection predictions with bounding boxes and confidence scores
     - Complete DICOM metadata
     - Image conversion information
-    """
 
-    # Validate file type - DICOM files can have various content types
-    allowed_extensions = [".dcm", ".dicom", ".DCM", ".DICOM"]
-    file_extension = os.path.splitext(file.filename or "")[1] if file.filename else ""
+    The file is uploaded as the multipart field `file` and read as it
+    streams in. Uploads over the maximum file size, or without the DICOM
+    `DICM` prefix, are rejected before the rest of the body is read.
 
-    if (
-        file.content_type not in settings.allowed_dicom_file_types
-        and file_extension not in allowed_extensions
-    ):
-        raise HTTPException(
-            status_code=400,
-            detail=f"File must be a DICOM file (.dcm, .dicom) or have content type: {', '.join(settings.allowed_dicom_file_types)}",
+    With `report=true` a report job is queued as soon as the detections are
+    available and returned as `report_job`, so the report is generated while
+    the client handles the detections. Wait for it with
+    `GET /report-jobs/{job_id}?wait=...`. If the report job queue is full,
+    `report_job` is null and the detections are returned as usual.
+    """
+    response = await _detect_dicom(
+        upload.source, upload.content_hash, inference_service, settings
+    )
+    if report:
+        # The validated models are handed over as they are
+        request = DiagnosticReportRequest.model_construct(
+            predictions=response.predictions,
+            metadata=response.metadata,
+            image_info=response.image_info,
         )
+        try:
+            response.report_job = await job_queue.submit(request)
+        except HTTPException as e:
+            logger.warning(f"Report job not started with detections: {e.detail}")
+    return response
 
-    # Validate file size
-    content = await file.read()
-    file_size = len(content)
 
-    if file_size > settings.max_file_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File size ({file_size} bytes) exceeds maximum allowed size ({settings.max_file_size} bytes)",
-        )
+@router.post(
+    "/detect-dicom/frames",
+    response_model=MultiFrameDicomDetectionResponse,
+    responses={
+        400: {
+            "model": ErrorResponse,
+            "description": "Invalid DICOM file or parsing error",
+        },
+        413: {"model": ErrorResponse, "description": "File too large"},
+        500: {"model": ErrorResponse, "description": "Processing failed"},
+    },
+    openapi_extra=UPLOAD_REQUEST_BODY,
+)
+async def detect_dental_conditions_dicom_frames(
+    upload: Annotated[StreamedUpload, Depends(dicom_file_upload)],
+    inference_service: Annotated[InferenceService, Depends(get_inference_service)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    start: Annotated[int, Query(ge=0, description="First frame to analyse")] = 0,
+    stride: Annotated[int, Query(ge=1, description="Analyse every n-th frame")] = 1,
+    max_frames: Annotated[
+        Optional[int], Query(ge=1, description="Maximum frames to analyse")
+    ] = None,
+) -> MultiFrameDicomDetectionResponse:
+    """
+    Detect dental conditions in each frame of a multi-frame DICOM file
 
-    # Save uploaded DICOM file temporarily
-    temp_file_path = None
+    Intended for CBCT slices, cine bitewings and other objects with
+    NumberOfFrames > 1. Frames are decoded one at a time and never all held
+    in memory; sampled frames are analysed with bounded parallelism and
+    returned with their frame index. Single-frame files yield one result.
+    """
+    # Frames are read independently by the worker processes, which needs a
+    # seekable file rather than a copy of the upload per frame, so the upload
+    # is always streamed to a temporary file
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".dcm") as temp_file:
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        # Process DICOM file: extract metadata, convert to image, and run inference
-        inference_results, metadata, image_info = (
-            await inference_service.detect_dental_conditions_from_dicom(
-                temp_file_path, settings.default_model_id
+        metadata, number_of_frames, frames = (
+            await inference_service.detect_dental_conditions_from_dicom_frames(
+                upload.path,
+                settings.default_model_id,
+                start=start,
+                stride=stride,
+                max_frames=max_frames,
+                content_hash=upload.content_hash,
             )
         )
 
-        return DicomDetectionResponse(
-            predictions=inference_results.get("predictions", []),
-            metadata=metadata,
-            image_info=image_info,
+        return MultiFrameDicomDetectionResponse(
+            metadata=metadata, number_of_frames=number_of_frames, frames=frames
         )
 
     except HTTPException:
@@ -181,19 +340,199 @@ async def detect_dental_conditions_dicom(
         raise
     except Exception as e:
         logger.error(
-            f"Unexpected error in DICOM detection endpoint: {str(e)}", exc_info=True
+            f"Unexpected error in multi-frame DICOM detection endpoint: {str(e)}",
+            exc_info=True,
         )
         raise HTTPException(
             status_code=500,
             detail="An unexpected error occurred during DICOM processing",
         )
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except OSError as e:
-                logger.warning(f"Failed to delete temporary file {temp_file_path}: {e}")
+
+
+@router.post(
+    "/detect-dicom/batch",
+    responses={
+        200: {
+            "description": "One BatchDicomDetectionItem per file, streamed as NDJSON lines or SSE events in completion order",
+            "content": {"application/x-ndjson": {}, "text/event-stream": {}},
+        },
+        400: {"model": ErrorResponse, "description": "Too many files"},
+        413: {"model": ErrorResponse, "description": "Batch too large"},
+    },
+    openapi_extra=BATCH_UPLOAD_REQUEST_BODY,
+)
+async def detect_dental_conditions_dicom_batch(
+    request: Request,
+    inference_service: Annotated[InferenceService, Depends(get_inference_service)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    format: Literal["ndjson", "sse"] = "ndjson",
+) -> StreamingResponse:
+    """
+    Detect dental conditions in a series of DICOM files in one request
+
+    The upload is parsed as it streams in, and each file is processed as
+    soon as its part has arrived, through the same pipeline as /detect-dicom
+    with at most `batch_max_concurrency` files in flight. Each file's result
+    is streamed back as soon as it finishes, either as newline-delimited
+    JSON or as Server-Sent Events (`format=sse`). A file that fails
+    validation or processing yields an error item without affecting the
+    rest.
+    """
+    semaphore = asyncio.Semaphore(settings.batch_max_concurrency)
+    uploads: List[StreamedUpload] = []
+    tasks: List[asyncio.Task] = []
+
+    async def process_item(
+        index: int, upload: StreamedUpload, error: Optional[HTTPException]
+    ) -> BatchDicomDetectionItem:
+        try:
+            if error is not None:
+                raise error
+            async with semaphore:
+                result = await _detect_dicom(
+                    upload.source, upload.content_hash, inference_service, settings
+                )
+            return BatchDicomDetectionItem(
+                index=index, filename=upload.filename, status="success", result=result
+            )
+        except HTTPException as e:
+            return BatchDicomDetectionItem(
+                index=index,
+                filename=upload.filename,
+                status="error",
+                status_code=e.status_code,
+                detail=str(e.detail),
+            )
+        finally:
+            upload.close()
+
+    def start_item(
+        index: int, upload: StreamedUpload, error: Optional[HTTPException]
+    ) -> None:
+        uploads.append(upload)
+        tasks.append(asyncio.create_task(process_item(index, upload, error)))
+
+    try:
+        total = await read_uploads(
+            request,
+            settings,
+            start_item,
+            settings.batch_max_files,
+            validate=lambda file: _validate_dicom_file(file, settings),
+            require_dicom=True,
+            suffix=".dcm",
+        )
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # Tasks cancelled before they started do not close their upload
+        for upload in uploads:
+            upload.close()
+        raise
+
+    async def stream_results():
+        succeeded = 0
+        try:
+            for next_completed in asyncio.as_completed(tasks):
+                item = await next_completed
+                succeeded += item.status == "success"
+                payload = item.model_dump_json(by_alias=True)
+                if format == "sse":
+                    yield f"event: result\ndata: {payload}\n\n"
+                else:
+                    yield payload + "\n"
+
+            if format == "sse":
+                summary = json.dumps(
+                    {
+                        "total": total,
+                        "succeeded": succeeded,
+                        "failed": total - succeeded,
+                    }
+                )
+                yield f"event: done\ndata: {summary}\n\n"
+        finally:
+            # Stop outstanding work if the client disconnects
+            for task in tasks:
+                task.cancel()
+            for upload in uploads:
+                upload.close()
+
+    return StreamingResponse(
+        stream_results(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.post(
+    "/dicom-metadata",
+    response_model=DicomMetadata,
+    responses={
+        400: {
+            "model": ErrorResponse,
+            "description": "Invalid DICOM file or parsing error",
+        },
+    },
+)
+async def dicom_metadata(
+    file: UploadFile,
+    inference_service: Annotated[InferenceService, Depends(get_inference_service)],
+    settings: Annotated[Settings, Depends(get_settings)],
+) -> DicomMetadata:
+    """
+    Extract DICOM metadata without decoding or reading pixel data
+
+    Only the header elements mapped onto DicomMetadata are parsed, which
+    makes this suitable for deciding which studies to analyse.
+    """
+    _validate_dicom_file(file, settings)
+    return await inference_service.read_dicom_metadata(file.file)
+
+
+@router.post(
+    "/dicom-metadata/batch",
+    response_model=BatchDicomMetadataResponse,
+    responses={
+        400: {"model": ErrorResponse, "description": "Too many files"},
+    },
+)
+async def dicom_metadata_batch(
+    files: List[UploadFile],
+    inference_service: Annotated[InferenceService, Depends(get_inference_service)],
+    settings: Annotated[Settings, Depends(get_settings)],
+) -> BatchDicomMetadataResponse:
+    """
+    Extract DICOM metadata from many files in one request
+
+    Each file is read header-only. Files that cannot be parsed yield an
+    error item without affecting the rest.
+    """
+    if len(files) > settings.metadata_batch_max_files:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files ({len(files)}), at most {settings.metadata_batch_max_files} are allowed per batch",
+        )
+
+    async def read_item(index: int, file: UploadFile) -> BatchDicomMetadataItem:
+        try:
+            _validate_dicom_file(file, settings)
+            metadata = await inference_service.read_dicom_metadata(file.file)
+            return BatchDicomMetadataItem(
+                index=index, filename=file.filename, status="success", metadata=metadata
+            )
+        except HTTPException as e:
+            return BatchDicomMetadataItem(
+                index=index,
+                filename=file.filename,
+                status="error",
+                detail=str(e.detail),
+            )
+
+    items = await asyncio.gather(
+        *(read_item(index, file) for index, file in enumerate(files))
+    )
+    return BatchDicomMetadataResponse(items=list(items))
 
 
 @router.post(
@@ -252,7 +591,172 @@ async def generate_diagnostic_report_from_detections(
         )
 
 
+@router.post(
+    "/generate-diagnostic-report/stream",
+    responses={
+        200: {
+            "description": "Report progress as SSE events: `token`, `section` and finally `report` with a DiagnosticReportResponse",
+            "content": {"text/event-stream": {}},
+        },
+    },
+)
+async def stream_diagnostic_report_from_detections(
+    request: DiagnosticReportRequest,
+    diagnostic_service: Annotated[
+        DiagnosticReportService, Depends(get_diagnostic_report_service)
+    ],
+) -> StreamingResponse:
+    """
+    Generate a diagnostic report, streaming it as Server-Sent Events
+
+    Takes the same input as /generate-diagnostic-report. Model output is
+    streamed as `token` events while it is written, and each report field
+    (summary, severity level, recommendations, then the full report) as a
+    `section` event once complete. The final `report` event carries the same
+    validated DiagnosticReportResponse the non-streaming endpoint returns.
+    """
+
+    async def stream_events():
+        async for event in diagnostic_service.stream_diagnostic_report(
+            detections=request.predictions,
+            metadata=request.metadata,
+            image_info=request.image_info,
+        ):
+            if event.event == "report":
+                payload = DiagnosticReportResponse(
+                    diagnostic_report=event.data,
+                    detections_used=request.predictions,
+                    metadata=request.metadata,
+                ).model_dump_json(by_alias=True)
+            else:
+                payload = json.dumps(event.data)
+            yield f"event: {event.event}\ndata: {payload}\n\n"
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.post(
+    "/report-jobs",
+    response_model=ReportJob,
+    status_code=202,
+    responses={
+        503: {"model": ErrorResponse, "description": "Report job queue is full"},
+    },
+)
+async def submit_report_job(
+    request: DiagnosticReportRequest,
+    response: Response,
+    job_queue: Annotated[ReportJobQueue, Depends(get_report_job_queue)],
+) -> ReportJob:
+    """
+    Queue diagnostic report generation and return its job immediately
+
+    Takes the same input as /generate-diagnostic-report. The report is
+    generated by the next free report worker; poll the job URL in the
+    `Location` header until it is `completed` or `failed`, or configure
+    `report_job_webhook_url` to have finished jobs POSTed there.
+    """
+    job = await job_queue.submit(request)
+    response.headers["Location"] = f"{router.prefix}/report-jobs/{job.job_id}"
+    return job
+
+
+@router.get(
+    "/report-jobs/{job_id}",
+    response_model=ReportJob,
+    responses={404: {"model": ErrorResponse, "description": "Unknown job"}},
+)
+async def get_report_job(
+    job_id: str,
+    job_queue: Annotated[ReportJobQueue, Depends(get_report_job_queue)],
+    wait: Annotated[
+        float,
+        Query(
+            ge=0,
+            le=60,
+            description="Seconds to wait for the job to finish before answering",
+        ),
+    ] = 0,
+) -> ReportJob:
+    """
+    Status of a report job, with its report once it has completed
+
+    With `wait`, the response is held until the job has completed or failed,
+    or until `wait` seconds have passed, so clients need not poll.
+    """
+    job = await job_queue.wait(job_id, wait) if wait else await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Report job {job_id} not found")
+    return job
+
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "dental-detection-api"}
+
+
+@router.get(
+    "/ready",
+    responses={503: {"description": "Still starting up or warming up"}},
+)
+async def readiness_check(response: Response):
+    """
+    Readiness for traffic, with the startup report
+
+    Answers 503 until startup warm-up has finished, so orchestrators and
+    load balancers only send requests to warm replicas; `/health` reports
+    liveness. The report has the duration of each startup phase and the
+    warm-up steps that failed, which the first requests then do instead.
+    """
+    startup = get_startup_report()
+    if not startup.ready:
+        response.status_code = 503
+    return startup.report()
+
+
+@router.get("/stats")
+async def service_stats():
+    """Worker pool utilisation and cache hit/miss statistics"""
+    return {
+        "admission": get_admission_controller().stats(),
+        "worker_pools": get_worker_pools().stats(),
+        "inference_backends": get_inference_backends().stats(),
+        "single_flight": {"detection": get_detection_flights().stats()},
+        "batching": get_inference_batcher().stats(),
+        "report_jobs": await get_report_job_queue().stats(),
+        "startup": get_startup_report().report(),
+        "caches": {
+            "detection": get_detection_cache().stats(),
+            "report": get_report_cache().stats(),
+        },
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Request and per-stage latency histograms in the Prometheus text format"""
+    return PlainTextResponse(
+        get_metrics_registry().render(), media_type=PROMETHEUS_CONTENT_TYPE
+    )
+
+
+@router.delete("/admin/cache", dependencies=[Depends(verify_admin_key)])
+async def invalidate_cache(
+    content_hash: Optional[str] = None,
+    cache: Literal["detection", "report"] = "detection",
+):
+    """
+    Invalidate cached detection results or diagnostic reports
+
+    Removes every entry derived from the given content hash, or the whole
+    cache when no hash is given.
+    """
+    target = get_detection_cache() if cache == "detection" else get_report_cache()
+    removed = target.invalidate(content_hash)
+    logger.info(f"Invalidated {removed} {cache} cache entries")
+    return {"removed": removed}
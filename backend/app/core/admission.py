@@ -0,0 +1,205 @@
+"""
+Admission control for expensive endpoints
+
+Each endpoint class (image detection, DICOM detection, reports, metadata)
+has its own lane: at most `max_concurrency` requests are admitted at once
+and up to `max_queue` more wait, first come first served, for at most
+`admission_max_wait_seconds`. Requests beyond that are shed with a 503 and
+a `Retry-After` estimate before their upload is read, so a burst degrades
+into fast rejections instead of exhausting memory.
+
+Admission happens in an ASGI middleware, ahead of body parsing. Endpoints
+without a class (health, stats) are never queued, and because every class
+has its own lane, lightweight requests are not held up behind heavy ones.
+"""
+
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, Mapping, Optional
+import asyncio
+import math
+import time
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .config import get_settings
+from .metrics import LATENCY_BUCKETS, Histogram
+from .timing import add_server_timing
+
+# Upper bound for the Retry-After estimate, in seconds
+MAX_RETRY_AFTER = 60
+# Weight of the latest request in the moving average of service times
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionLane:
+    """A concurrency limit with a bounded FIFO wait queue"""
+
+    def __init__(
+        self, name: str, max_concurrency: int, max_queue: int, max_wait: float
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._counters = {"admitted": 0, "shed_queue_full": 0, "shed_timeout": 0}
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.service_time: Optional[float] = None
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely to free up, from recent service times"""
+        service_time = self.service_time or 1.0
+        ahead = len(self._waiters) + 1
+        estimate = math.ceil(service_time * ahead / self.max_concurrency)
+        return min(max(estimate, 1), MAX_RETRY_AFTER)
+
+    def _shed(self, reason: str) -> HTTPException:
+        self._counters[f"shed_{reason}"] += 1
+        return HTTPException(
+            status_code=503,
+            detail=f"Server is busy ({self.name} requests), please retry",
+            headers={"Retry-After": str(self._retry_after())},
+        )
+
+    async def acquire(self) -> None:
+        """
+        Wait for a slot in the lane
+
+        Raises:
+            HTTPException: 503 if the queue is full or the wait times out
+        """
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            self._counters["admitted"] += 1
+            self.queue_wait.observe(0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._shed("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.max_wait):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended; pass it on
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, TimeoutError):
+                raise self._shed("timeout")
+            raise
+        self._counters["admitted"] += 1
+        self.queue_wait.observe(time.perf_counter() - started)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """
+        Free a slot, handing it straight to the longest-waiting request
+
+        Args:
+            service_time: How long the slot was held, for Retry-After estimates
+        """
+        if service_time is not None:
+            self.service_time = (
+                service_time
+                if self.service_time is None
+                else self.service_time
+                + SERVICE_TIME_SMOOTHING * (service_time - self.service_time)
+            )
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Limits, current load, shed counters and queue-wait histogram"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queued": len(self._waiters),
+            **self._counters,
+            "service_time_seconds": self.service_time,
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+        }
+
+
+class AdmissionController:
+    """The admission lanes of every endpoint class"""
+
+    def __init__(self):
+        settings = get_settings()
+        self.enabled = settings.admission_control_enabled
+        self.lanes = {
+            name: AdmissionLane(
+                name,
+                max_concurrency=getattr(settings, f"{name}_max_concurrency"),
+                max_queue=getattr(settings, f"{name}_max_queue"),
+                max_wait=settings.admission_max_wait_seconds,
+            )
+            for name in ("detect", "dicom", "report", "metadata")
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    return AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    Admit requests to classified endpoints through their lane
+
+    Args:
+        app: The wrapped ASGI application
+        endpoint_classes: Lane name for each admission-controlled path
+    """
+
+    def __init__(self, app: ASGIApp, endpoint_classes: Mapping[str, str]):
+        self.app = app
+        self.endpoint_classes = dict(endpoint_classes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        lane_name = (
+            self.endpoint_classes.get(scope["path"])
+            if scope["type"] == "http"
+            else None
+        )
+        controller = get_admission_controller()
+        if lane_name is None or not controller.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        lane = controller.lanes[lane_name]
+        queued_at = time.perf_counter()
+        try:
+            await lane.acquire()
+        except HTTPException as e:
+            # Shed before the request body has been read
+            response = JSONResponse(
+                {"detail": e.detail}, status_code=e.status_code, headers=e.headers
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        add_server_timing("queue", started - queued_at)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release(time.perf_counter() - started)
@@ -1,11 +1,27 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
+from typing import Dict, Optional
 
 
 class Settings(BaseSettings):
     app_name: str = "Dobbe Backend"
     debug: bool = False
     roboflow_api_key: str
+    roboflow_api_url: str = "https://serverless.roboflow.com"
+
+    # Hosted inference HTTP client - pooled keep-alive connections, timeouts
+    # in seconds, jittered retries and optional hedging of slow requests
+    inference_connect_timeout: float = 5.0
+    inference_read_timeout: float = 30.0
+    inference_max_connections: int = 32
+    inference_keepalive_connections: int = 16
+    inference_keepalive_expiry: float = 30.0
+    inference_max_retries: int = 2
+    inference_retry_backoff_seconds: float = 0.2
+    inference_retry_backoff_max_seconds: float = 2.0
+    inference_hedge_enabled: bool = False
+    inference_hedge_percentile: float = 95.0
+    inference_hedge_min_samples: int = 20
 
     # OpenAI configuration for diagnostic reports
     openai_api_key: str
@@ -24,6 +40,138 @@ class Settings(BaseSettings):
     ALLOWED_IMAGE_EXTENSIONS: list = [".jpg", ".jpeg", ".png", ".JPG", ".JPEG", ".PNG"]
     ALLOWED_DICOM_EXTENSIONS: list = [".dcm", ".dicom", ".DCM", ".DICOM"]
 
+    # Batch DICOM detection
+    batch_max_files: int = 64
+    batch_max_concurrency: int = 4
+
+    # Header-only DICOM metadata extraction
+    metadata_batch_max_files: int = 256
+
+    # Multi-frame DICOM detection
+    frame_max_count: int = 64  # frames analysed per request
+    frame_max_concurrency: int = 4
+
+    # Upload processing - keep uploads and converted images in memory instead
+    # of temporary files; uploads larger than the threshold use the disk path
+    in_memory_processing: bool = True
+    in_memory_max_bytes: int = 64 * 1024 * 1024  # 64MB in bytes
+
+    # Inference preprocessing - images are downscaled to the model input size
+    # and encoded at the highest quality that fits the byte budget
+    preprocess_enabled: bool = True
+    preprocess_max_size: int = 640  # longest side in pixels
+    preprocess_grayscale: bool = True
+    preprocess_max_bytes: int = 150 * 1024  # 150KB in bytes
+    preprocess_quality: int = 90
+    preprocess_min_quality: int = 50
+
+    # Inference backends - "roboflow" (hosted) or "onnx" (local CPU, needs the
+    # optional onnxruntime package); inference_backends maps model IDs to a
+    # backend and onnx_models maps model IDs to exported .onnx files
+    inference_backend: str = "roboflow"
+    inference_backends: Dict[str, str] = {}
+    onnx_models: Dict[str, str] = {}
+    onnx_intra_op_threads: int = 0  # 0 lets ONNX Runtime choose
+    onnx_inter_op_threads: int = 1
+    onnx_max_concurrency: int = 2
+    onnx_max_queue: int = 32
+    onnx_confidence_threshold: float = 0.4
+    onnx_iou_threshold: float = 0.5
+    onnx_max_detections: int = 300
+
+    # Admission control - each endpoint class admits a bounded number of
+    # concurrent requests and queues a bounded number more, for at most
+    # admission_max_wait_seconds; further requests are shed with a 503
+    admission_control_enabled: bool = True
+    admission_max_wait_seconds: float = 10.0
+    detect_max_concurrency: int = 16
+    detect_max_queue: int = 64
+    dicom_max_concurrency: int = 8
+    dicom_max_queue: int = 32
+    report_max_concurrency: int = 8
+    report_max_queue: int = 32
+    metadata_max_concurrency: int = 64
+    metadata_max_queue: int = 256
+
+    # Worker pools - CPU-bound DICOM conversion runs on a process pool and
+    # blocking inference calls on a thread pool, each with a bounded queue
+    cpu_pool_workers: int = 2
+    cpu_pool_max_queue: int = 32
+    cpu_pool_use_processes: bool = True
+    io_pool_workers: int = 16
+    io_pool_max_queue: int = 64
+
+    # Result caching - persistent tiers live under cache_dir, which is the
+    # backend_cache volume in docker-compose
+    cache_dir: str = ".cache"
+    detection_cache_enabled: bool = True
+    detection_cache_persist: bool = True
+    detection_cache_memory_entries: int = 512
+    detection_cache_disk_max_mb: int = 512
+    detection_cache_ttl_seconds: int = 7 * 24 * 60 * 60  # 7 days
+    report_cache_enabled: bool = True
+    report_cache_persist: bool = True
+    report_cache_memory_entries: int = 256
+    report_cache_disk_max_mb: int = 128
+    report_cache_ttl_seconds: int = 24 * 60 * 60  # 1 day
+
+    # Report prompt - detections are encoded as compact tables and
+    # summarised when the estimated prompt would exceed this many tokens
+    report_prompt_token_budget: int = 2000
+
+    # Rule-based reports - inputs with no detections, or with at most
+    # report_rules_max_detections findings of the classes in
+    # report_rules_classes (class name to severity), each at least
+    # report_rules_min_confidence confident, get a templated report instead
+    # of an LLM call
+    report_rules_enabled: bool = True
+    report_rules_max_detections: int = 1
+    report_rules_min_confidence: float = 0.8
+    report_rules_classes: Dict[str, str] = {
+        "caries": "moderate",
+        "cavity": "moderate",
+        "periapical lesion": "high",
+    }
+
+    # Concurrent requests for the same content and model share one
+    # computation instead of each decoding and calling inference
+    coalesce_requests: bool = True
+
+    # Micro-batching - inference calls for the same model that arrive while
+    # a batch is in flight are grouped into the next batch, dispatched when
+    # it is full or the window expires
+    inference_batching_enabled: bool = True
+    inference_batch_max_size: int = 8
+    inference_batch_window_ms: float = 5.0
+
+    # Report jobs - report requests queued in a SQLite store under cache_dir
+    # and drained by a bounded pool of in-process workers. A job whose worker
+    # is gone (such as after a restart) is retried once it has run for
+    # report_job_timeout_seconds. Finished jobs are kept for
+    # report_job_ttl_seconds and, if report_job_webhook_url is set, POSTed
+    # there, signed with report_job_webhook_secret when one is configured
+    report_job_workers: int = 4
+    report_job_max_queue: int = 1000
+    report_job_timeout_seconds: float = 300.0
+    report_job_max_attempts: int = 2
+    report_job_poll_seconds: float = 1.0
+    report_job_ttl_seconds: int = 7 * 24 * 60 * 60  # 7 days
+    report_job_webhook_url: Optional[str] = None
+    report_job_webhook_secret: Optional[str] = None
+    report_job_webhook_timeout: float = 10.0
+    report_job_webhook_max_attempts: int = 3
+
+    # Startup warm-up - before /ready reports the server ready, the report
+    # service is built, DICOM decoders are initialised on every CPU worker
+    # and, with warmup_connections, upstream connections are opened. Warm-up
+    # failing or exceeding warmup_timeout_seconds does not prevent readiness
+    warmup_enabled: bool = True
+    warmup_connections: bool = True
+    warmup_timeout_seconds: float = 60.0
+
+    # Admin endpoints are disabled unless a key is configured
+    admin_api_key: Optional[str] = None
+
     model_config = SettingsConfigDict(env_file=".env")
 
 
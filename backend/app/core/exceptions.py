@@ -23,6 +23,18 @@ class FileValidationException(DentalDetectionException):
     pass
 
 
+class DicomProcessingException(DentalDetectionException):
+    """Exception raised when a DICOM file cannot be parsed or converted"""
+
+    pass
+
+
+class ImageProcessingException(DentalDetectionException):
+    """Exception raised when an uploaded image cannot be decoded"""
+
+    pass
+
+
 async def global_exception_handler(request: Request, exc: Exception):
     """Global exception handler for unhandled exceptions"""
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
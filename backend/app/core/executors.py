@@ -0,0 +1,190 @@
+"""
+Bounded worker pools for blocking work
+
+CPU-bound work (DICOM decoding, LUT application, JPEG encoding) runs on a
+process pool and blocking network I/O on a thread pool, so neither stalls the
+event loop. Each pool accepts at most `max_workers + max_queue` pending calls;
+callers beyond that are rejected with a 503 instead of queueing unboundedly.
+
+Workers are started on demand. With startup warm-up enabled, the CPU pool's
+processes are started ahead of the first request and each initialises the
+DICOM decoders once, in `app.services.warmup.warm_up_worker`.
+"""
+
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, Optional, TypeVar
+import asyncio
+import logging
+import multiprocessing
+import threading
+
+from fastapi import HTTPException
+
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _started() -> None:
+    """Submitted to start a worker; module level, so processes can run it"""
+
+
+class WorkerPool:
+    """An executor with a bounded number of pending calls and usage counters"""
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        max_queue: int,
+        use_processes: bool,
+        initializer: Optional[Callable[[], None]] = None,
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.use_processes = use_processes
+        # Run once in each worker as it starts; must not raise, as a failing
+        # initializer breaks a process pool
+        self.initializer = initializer
+        self._executor: Optional[Executor] = None
+        # Guards the counters, which executor threads update as calls finish
+        self._lock = threading.Lock()
+        # Calls submitted and not yet finished, whether or not still awaited
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                # Spawned workers avoid inheriting the event loop and threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer,
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.name,
+                    initializer=self.initializer,
+                )
+        return self._executor
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run a blocking callable on the pool without blocking the event loop
+
+        Raises:
+            HTTPException: 503 if the pool and its wait queue are full
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Server is busy ({self.name} pool saturated), please retry",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+
+        try:
+            future = self._get_executor().submit(partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release(None)
+            raise
+        # Released when the call itself finishes: cancelling the caller does
+        # not stop a call a worker has already started
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future: Optional[Future]) -> None:
+        """Count a finished call; runs on whichever thread completed it"""
+        with self._lock:
+            self._pending -= 1
+            if future is None or future.cancelled():
+                return
+            if future.exception() is None:
+                self._completed += 1
+            else:
+                self._failed += 1
+
+    async def start_workers(self) -> None:
+        """
+        Start every worker now rather than on first use
+
+        Executors start a worker for each call submitted while none is idle,
+        so one call per worker submitted at once starts them all, each
+        running the initializer first.
+        """
+        await asyncio.gather(*(self.run(_started) for _ in range(self.max_workers)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Current pool size, queue usage and utilisation"""
+        with self._lock:
+            pending = self._pending
+        active = min(pending, self.max_workers)
+        return {
+            "kind": "process" if self.use_processes else "thread",
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": active,
+            "queued": pending - active,
+            "utilisation": active / self.max_workers if self.max_workers else 0.0,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class WorkerPools:
+    """The application's CPU and I/O worker pools"""
+
+    def __init__(self):
+        settings = get_settings()
+        initializer = None
+        if settings.warmup_enabled and settings.cpu_pool_use_processes:
+            # Deferred, as the services depend on this module
+            from ..services.warmup import warm_up_worker
+
+            initializer = warm_up_worker
+        self.cpu = WorkerPool(
+            "cpu",
+            max_workers=settings.cpu_pool_workers,
+            max_queue=settings.cpu_pool_max_queue,
+            use_processes=settings.cpu_pool_use_processes,
+            initializer=initializer,
+        )
+        self.io = WorkerPool(
+            "io",
+            max_workers=settings.io_pool_workers,
+            max_queue=settings.io_pool_max_queue,
+            use_processes=False,
+        )
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {"cpu": self.cpu.stats(), "io": self.io.stats()}
+
+    def shutdown(self) -> None:
+        self.cpu.shutdown()
+        self.io.shutdown()
+
+
+@lru_cache()
+def get_worker_pools() -> WorkerPools:
+    return WorkerPools()
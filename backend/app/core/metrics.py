@@ -0,0 +1,150 @@
+"""
+In-process metric primitives
+
+Histograms can be used standalone, as in the `/stats` snapshots, or as
+labelled families registered with the `MetricsRegistry`, which renders them
+in the Prometheus text exposition format for `/metrics`.
+"""
+
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Dict, List, Sequence, Tuple
+import threading
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds, in seconds, for latency-like histograms
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """Cumulative bucketed histogram, in the Prometheus sense"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> Dict[str, int]:
+        """Observations less than or equal to each bucket bound"""
+        counts: Dict[str, int] = {}
+        total = 0
+        for bound, count in zip(self.buckets, self._counts):
+            total += count
+            counts[f"{bound:g}"] = total
+        counts["+Inf"] = self.count
+        return counts
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "buckets": self.cumulative_counts(),
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class HistogramFamily:
+    """Histograms sharing a name, one per combination of label values"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels: Any) -> Histogram:
+        """The histogram for the given label values; missing labels are empty"""
+        key = tuple(str(labels.get(name) or "") for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, Histogram(self.buckets))
+        return child
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, histogram in sorted(self._children.items()):
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.label_names, key)
+                if value
+            )
+            sep = "," if labels else ""
+            for bound, count in histogram.cumulative_counts().items():
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{self.name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """The histogram families exported on `/metrics`"""
+
+    def __init__(self):
+        self._families: Dict[str, HistogramFamily] = {}
+        self._lock = threading.Lock()
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> HistogramFamily:
+        """Get or register the histogram family with the given name"""
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = HistogramFamily(name, documentation, label_names, buckets)
+                self._families[name] = family
+            return family
+
+    def render(self) -> str:
+        """All families in the Prometheus text exposition format"""
+        lines: List[str] = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+@lru_cache()
+def get_metrics_registry() -> MetricsRegistry:
+    return MetricsRegistry()
@@ -0,0 +1,78 @@
+"""
+Startup phases and readiness
+
+The application records how long each phase of its startup took: importing
+the application, building its service singletons and each warm-up step.
+`/ready` answers 503 with this report until startup has finished, so
+replicas are only sent traffic once they are warm, and the report is logged
+when it has.
+"""
+
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Imported before anything else by the application module, so its imports
+# are timed from here
+IMPORT_STARTED = time.perf_counter()
+
+
+class StartupReport:
+    """Durations of startup phases and whether the application is ready"""
+
+    def __init__(self):
+        # starting, warming_up or ready
+        self.status = "starting"
+        self.phases: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as a startup phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def fail(self, phase: str, error: BaseException) -> None:
+        """Record a phase that failed without preventing readiness"""
+        self.errors[phase] = str(error) or type(error).__name__
+        logger.warning(f"Startup phase {phase} failed: {self.errors[phase]}")
+
+    def mark_ready(self) -> None:
+        self.status = "ready"
+        self.phases["total"] = time.perf_counter() - IMPORT_STARTED
+        logger.info(
+            "Ready after "
+            + ", ".join(
+                f"{name} {seconds * 1000:.0f} ms"
+                for name, seconds in self.phases.items()
+            )
+        )
+
+    def report(self) -> Dict[str, Any]:
+        """Status, phase durations in milliseconds and failed phases"""
+        return {
+            "status": self.status,
+            "phases_ms": {
+                name: round(seconds * 1000, 1) for name, seconds in self.phases.items()
+            },
+            "errors": dict(self.errors),
+        }
+
+
+@lru_cache()
+def get_startup_report() -> StartupReport:
+    return StartupReport()
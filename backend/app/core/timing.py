@@ -0,0 +1,184 @@
+"""
+Per-request stage timing
+
+Code on the request path measures its stages with `stage_timer`, or reports
+durations measured elsewhere (such as on a worker process) with
+`record_stage`. Every stage duration is observed in the
+`dobbe_stage_duration_seconds` histogram, labelled by stage, endpoint,
+model ID, transfer syntax and image size bucket, and is added to the
+`Server-Timing` header of the request it belongs to.
+
+`ServerTimingMiddleware` sets up the per-request context, times the whole
+request and writes the header. Routes created with `TimedRoute` also report
+how long response serialization took.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional
+import time
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import HistogramFamily, get_metrics_registry
+
+# Upper bounds, in megapixels, of the image size label buckets
+SIZE_BUCKETS_MP = (0.5, 1, 4, 16)
+
+
+def size_bucket(width: int, height: int) -> str:
+    """Coarse image size label, so series stay few"""
+    megapixels = width * height / 1_000_000
+    for bound in SIZE_BUCKETS_MP:
+        if megapixels <= bound:
+            return f"<={bound:g}MP"
+    return f">{SIZE_BUCKETS_MP[-1]:g}MP"
+
+
+def get_stage_durations() -> HistogramFamily:
+    return get_metrics_registry().histogram(
+        "dobbe_stage_duration_seconds",
+        "Duration of request processing stages",
+        ("stage", "endpoint", "model_id", "transfer_syntax", "size_bucket"),
+    )
+
+
+def get_request_durations() -> HistogramFamily:
+    return get_metrics_registry().histogram(
+        "dobbe_request_duration_seconds",
+        "Time from receiving a request to the start of its response",
+        ("endpoint", "method", "status"),
+    )
+
+
+class RequestTimings:
+    """Stage durations of one request, in the order they were first seen"""
+
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.handler_done: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+
+    @property
+    def endpoint(self) -> str:
+        """Path template of the matched route, so unknown paths share a label"""
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+    def add(self, stage: str, seconds: float) -> None:
+        # Repeated stages, such as per-frame decodes, are summed
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def header(self, now: float) -> str:
+        entries = [
+            f"{stage};dur={seconds * 1000:.1f}"
+            for stage, seconds in self.stages.items()
+        ]
+        entries.append(f"total;dur={(now - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record_stage(
+    stage: str,
+    seconds: float,
+    model_id: Optional[str] = None,
+    transfer_syntax: Optional[str] = None,
+    size_bucket: Optional[str] = None,
+) -> None:
+    """Record a stage duration measured by the caller"""
+    timings = _current.get()
+    get_stage_durations().labels(
+        stage=stage,
+        endpoint=timings.endpoint if timings else None,
+        model_id=model_id,
+        transfer_syntax=transfer_syntax,
+        size_bucket=size_bucket,
+    ).observe(seconds)
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+def add_server_timing(stage: str, seconds: float) -> None:
+    """
+    Report a duration in the current request's `Server-Timing` header only
+
+    For waits that are measured before the request is routed, when the
+    endpoint label is not yet known.
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, **labels: Optional[str]) -> Iterator[None]:
+    """Time the enclosed block as a stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, **labels)
+
+
+def _mark_handler_done(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    @wraps(endpoint)
+    async def timed_endpoint(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timings = _current.get()
+            if timings is not None:
+                timings.handler_done = time.perf_counter()
+
+    return timed_endpoint
+
+
+class TimedRoute(APIRoute):
+    """A route that notes when its endpoint returns, to time serialization"""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        super().__init__(path, _mark_handler_done(endpoint), **kwargs)
+
+
+class ServerTimingMiddleware:
+    """Collect stage timings per request and report them in `Server-Timing`"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = _current.set(timings)
+
+        async def send_with_timings(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                if timings.handler_done is not None:
+                    record_stage("serialize", now - timings.handler_done)
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", timings.header(now)
+                )
+                get_request_durations().labels(
+                    endpoint=timings.endpoint,
+                    method=scope["method"],
+                    status=message["status"],
+                ).observe(now - timings.started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _current.reset(token)
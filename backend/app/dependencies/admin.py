@@ -0,0 +1,28 @@
+"""
+Authorization for administrative endpoints
+"""
+
+from fastapi import Depends, Header, HTTPException
+from typing import Annotated, Optional
+import secrets
+
+from ..core.config import Settings, get_settings
+
+
+async def verify_admin_key(
+    settings: Annotated[Settings, Depends(get_settings)],
+    x_admin_key: Annotated[Optional[str], Header()] = None,
+) -> None:
+    """
+    Require the configured admin key in the `X-Admin-Key` header
+
+    Raises:
+        HTTPException: If admin endpoints are disabled or the key is wrong
+    """
+    if not settings.admin_api_key:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+
+    if not x_admin_key or not secrets.compare_digest(
+        x_admin_key, settings.admin_api_key
+    ):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
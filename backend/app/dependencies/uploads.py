@@ -0,0 +1,536 @@
+"""
+Streaming ingestion of uploads
+
+The multipart request body is parsed as it arrives instead of being
+collected by FastAPI first. The uploaded file is size-checked and hashed
+chunk by chunk and kept in memory only while it fits the in-memory budget;
+larger uploads are spilled to a temporary file. Memory per request is
+therefore bounded however large or slow the upload is.
+
+Uploads are rejected as early as possible: with a 413 as soon as the file
+crosses `max_file_size`, with a 400 when the part headers fail validation,
+and, for DICOM uploads, with a 400 when the first bytes lack the `DICM`
+prefix at offset 128.
+
+Batch uploads are parsed the same way, one file part at a time. Each file
+is handed over as soon as its part is complete, and a file rejected by
+these checks only fails that file. All files of a batch share one
+in-memory budget until they are closed; files that do not fit are spilled,
+so a batch holds no more in memory than a single upload.
+"""
+
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, List, Optional, Union
+import hashlib
+import logging
+import os
+import tempfile
+
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from ..core.config import Settings
+from ..core.timing import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Form field holding the uploaded file, and the files of batch uploads
+UPLOAD_FIELD = "file"
+BATCH_UPLOAD_FIELD = "files"
+# DICOM Part 10 files carry "DICM" after a 128 byte preamble
+DICOM_PREFIX_OFFSET = 128
+DICOM_PREFIX = b"DICM"
+# Allowance for boundaries, part headers and small form fields around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# OpenAPI description of the body, which FastAPI cannot infer without an
+# UploadFile parameter
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": [UPLOAD_FIELD],
+                    "properties": {
+                        UPLOAD_FIELD: {"type": "string", "format": "binary"}
+                    },
+                }
+            }
+        },
+    }
+}
+BATCH_UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": [BATCH_UPLOAD_FIELD],
+                    "properties": {
+                        BATCH_UPLOAD_FIELD: {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                        }
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+def _too_large(settings: Settings) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File size exceeds maximum allowed size ({settings.max_file_size} bytes)",
+    )
+
+
+class _MemoryBudget:
+    """Bytes the files of a batch upload may hold in memory at once"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def reserve(self, size: int) -> bool:
+        if self.used + size > self.limit:
+            return False
+        self.used += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.used -= size
+
+
+@dataclass
+class StreamedUpload:
+    """A file read from a streamed multipart upload"""
+
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    size: int = 0
+    content_hash: Optional[str] = None
+    # Exactly one of these is set once the upload is complete
+    content: Optional[bytes] = None
+    path: Optional[str] = None
+    # Budget the in-memory content is counted against, for batch uploads
+    _budget: Optional[_MemoryBudget] = field(default=None, repr=False)
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """The uploaded bytes, or the temporary file they were spilled to"""
+        return self.content if self.content is not None else self.path
+
+    def close(self) -> None:
+        """Release the content, removing the file it was spilled to if any"""
+        if self.content is not None and self._budget is not None:
+            self._budget.release(len(self.content))
+        self.content = None
+        if self.path and os.path.exists(self.path):
+            try:
+                os.unlink(self.path)
+            except OSError as e:
+                logger.warning(f"Failed to delete temporary file {self.path}: {e}")
+        self.path = None
+
+
+class _FileWriter:
+    """Size-checks, hashes and buffers one uploaded file as its data arrives"""
+
+    def __init__(
+        self,
+        settings: Settings,
+        memory_limit: int,
+        suffix: Optional[str],
+        require_dicom: bool,
+        upload: StreamedUpload,
+        budget: Optional[_MemoryBudget] = None,
+    ):
+        self.settings = settings
+        self.memory_limit = memory_limit
+        self.suffix = suffix
+        self.require_dicom = require_dicom
+        self.upload = upload
+        self.budget = budget
+        # Bytes of the buffered chunks counted against the budget
+        self._reserved = 0
+
+        self._hash = hashlib.sha256()
+        self._head = b""
+        self._chunks: List[bytes] = []
+        self._file: Optional[BinaryIO] = None
+
+    def write(self, chunk: bytes) -> None:
+        self.upload.size += len(chunk)
+        if self.upload.size > self.settings.max_file_size:
+            raise _too_large(self.settings)
+
+        if self.require_dicom and len(self._head) < DICOM_PREFIX_OFFSET + 4:
+            self._head += chunk[: DICOM_PREFIX_OFFSET + 4 - len(self._head)]
+            if len(self._head) == DICOM_PREFIX_OFFSET + 4:
+                self._check_dicom_prefix()
+
+        self._hash.update(chunk)
+        if self._file is None and not self._buffer(len(chunk)):
+            self._spill()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+
+    def _check_dicom_prefix(self) -> None:
+        if self._head[DICOM_PREFIX_OFFSET:] != DICOM_PREFIX:
+            raise HTTPException(
+                status_code=400,
+                detail="File is not a DICOM file (missing 'DICM' prefix at offset 128)",
+            )
+
+    def _buffer(self, size: int) -> bool:
+        """Whether the next chunk may be kept in memory"""
+        if self.upload.size > self.memory_limit:
+            return False
+        if self.budget is None:
+            return True
+        if not self.budget.reserve(size):
+            return False
+        self._reserved += size
+        return True
+
+    def _release(self) -> None:
+        if self.budget is not None:
+            self.budget.release(self._reserved)
+        self._reserved = 0
+
+    def _spill(self) -> None:
+        """Move the buffered upload into a temporary file"""
+        suffix = self.suffix or os.path.splitext(self.upload.filename or "")[1]
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        self.upload.path = self._file.name
+        for chunk in self._chunks:
+            self._file.write(chunk)
+        self._chunks = []
+        self._release()
+
+    def finish(self) -> StreamedUpload:
+        if self.require_dicom and len(self._head) < DICOM_PREFIX_OFFSET + 4:
+            self._check_dicom_prefix()
+        if self._file is not None:
+            self._file.close()
+        else:
+            self.upload.content = b"".join(self._chunks)
+            self._chunks = []
+            # The upload now holds the reservation, until it is closed
+            self.upload._budget = self.budget
+            self._reserved = 0
+        self.upload.content_hash = self._hash.hexdigest()
+        return self.upload
+
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._chunks = []
+        self._release()
+        self.upload.close()
+
+
+# Receives each file of a batch upload once its part is complete: its index
+# in the request, the upload and the error that rejected it, if any
+FileCallback = Callable[[int, StreamedUpload, Optional[HTTPException]], None]
+
+
+class _UploadReader:
+    """
+    Collects file fields from python-multipart parser callbacks
+
+    Without `on_file` only the first file is read and kept in `upload`, and
+    an invalid file fails the request. With it, up to `max_files` files are
+    handed to `on_file` as their parts complete, and an invalid file is
+    handed over with its error while the rest of its part is skipped.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        memory_limit: int,
+        suffix: Optional[str],
+        validate: Optional[Callable[[StreamedUpload], None]],
+        require_dicom: bool,
+        field: str = UPLOAD_FIELD,
+        max_files: int = 1,
+        on_file: Optional[FileCallback] = None,
+        budget: Optional[_MemoryBudget] = None,
+    ):
+        self.settings = settings
+        self.memory_limit = memory_limit
+        self.suffix = suffix
+        self.validate = validate
+        self.require_dicom = require_dicom
+        self.field = field
+        self.max_files = max_files
+        self.on_file = on_file
+        self.budget = budget
+
+        self.upload: Optional[StreamedUpload] = None
+        self.files = 0
+        self._writer: Optional[_FileWriter] = None
+
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_name = b""
+        self._header_value = b""
+
+    def callbacks(self) -> Dict[str, Callable]:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        # Other fields, and repeated file fields of single uploads, are skipped
+        if name != self.field or b"filename" not in options:
+            return
+        if self.on_file is None and self.files:
+            return
+        if self.files == self.max_files:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many files, at most {self.max_files} are allowed per batch",
+            )
+
+        self.files += 1
+        content_type = self._headers.get(b"content-type")
+        upload = StreamedUpload(
+            filename=options[b"filename"].decode("utf-8", "replace"),
+            content_type=content_type.decode("latin-1") if content_type else None,
+        )
+        self._writer = _FileWriter(
+            self.settings,
+            self.memory_limit,
+            self.suffix,
+            self.require_dicom,
+            upload,
+            self.budget,
+        )
+        if self.validate is not None:
+            try:
+                self.validate(upload)
+            except HTTPException as e:
+                self._reject(e)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._writer is None:
+            return
+        try:
+            self._writer.write(data[start:end])
+        except HTTPException as e:
+            self._reject(e)
+
+    def on_part_end(self) -> None:
+        if self._writer is None:
+            return
+        try:
+            upload = self._writer.finish()
+        except HTTPException as e:
+            self._reject(e)
+            return
+        self._writer = None
+        if self.on_file is None:
+            self.upload = upload
+        else:
+            self.on_file(self.files - 1, upload, None)
+
+    def _reject(self, error: HTTPException) -> None:
+        """Drop the current file, failing the request unless reading a batch"""
+        writer, self._writer = self._writer, None
+        writer.abort()
+        if self.on_file is None:
+            raise error
+        self.on_file(self.files - 1, writer.upload, error)
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+        if self.upload is not None:
+            self.upload.close()
+
+
+def _multipart_boundary(request: Request) -> bytes:
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(
+            status_code=400, detail="Expected a multipart/form-data upload"
+        )
+    return params[b"boundary"]
+
+
+def _memory_limit(settings: Settings, in_memory: bool) -> int:
+    return (
+        settings.in_memory_max_bytes
+        if in_memory and settings.in_memory_processing
+        else 0
+    )
+
+
+async def _parse(
+    request: Request,
+    settings: Settings,
+    boundary: bytes,
+    reader: _UploadReader,
+    max_body: int,
+) -> None:
+    """Feed the request body to the reader as it arrives"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise _too_large(settings)
+
+    parser = MultipartParser(boundary, reader.callbacks())
+    received = 0
+    try:
+        with stage_timer("upload"):
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > max_body:
+                    raise _too_large(settings)
+                parser.write(chunk)
+            parser.finalize()
+    except MultipartParseError as e:
+        reader.abort()
+        raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+    except BaseException:
+        reader.abort()
+        raise
+
+
+async def read_upload(
+    request: Request,
+    settings: Settings,
+    validate: Optional[Callable[[StreamedUpload], None]] = None,
+    require_dicom: bool = False,
+    in_memory: bool = True,
+    suffix: Optional[str] = None,
+) -> StreamedUpload:
+    """
+    Read the `file` field of a multipart request as it streams in
+
+    Args:
+        request: The incoming request, whose body has not been read
+        settings: Application settings
+        validate: Checks the file name and content type before any data is
+            read; raises HTTPException to reject the upload
+        require_dicom: Reject files without the DICOM `DICM` prefix
+        in_memory: Allow keeping the upload in memory; otherwise it is
+            always written to a temporary file
+        suffix: Temporary file suffix, by default the upload's extension
+
+    Returns:
+        StreamedUpload: The upload; call `close()` to remove its temporary file
+
+    Raises:
+        HTTPException: 413 once the upload exceeds `max_file_size`, 400 if it
+            is malformed, fails validation or is not DICOM when required,
+            422 if there is no file field
+    """
+    boundary = _multipart_boundary(request)
+    reader = _UploadReader(
+        settings, _memory_limit(settings, in_memory), suffix, validate, require_dicom
+    )
+    await _parse(
+        request, settings, boundary, reader, settings.max_file_size + MULTIPART_OVERHEAD
+    )
+    if reader.upload is None:
+        raise HTTPException(
+            status_code=422, detail=f"Missing upload field '{UPLOAD_FIELD}'"
+        )
+    return reader.upload
+
+
+async def read_uploads(
+    request: Request,
+    settings: Settings,
+    on_file: FileCallback,
+    max_files: int,
+    validate: Optional[Callable[[StreamedUpload], None]] = None,
+    require_dicom: bool = False,
+    suffix: Optional[str] = None,
+) -> int:
+    """
+    Read the `files` fields of a multipart request as they stream in
+
+    Each file is handed to `on_file` as soon as its part is complete, so it
+    can be processed while later files are still uploading; the callback
+    owns the upload and must `close()` it. Files share one in-memory budget
+    of `in_memory_max_bytes` until closed, and are spilled to temporary
+    files once it is used up. A file that exceeds
+    `max_file_size`, fails validation or is not DICOM when required is
+    handed over with the error as soon as it is detected, and the rest of
+    its data is skipped without affecting the other files.
+
+    Args:
+        request: The incoming request, whose body has not been read
+        settings: Application settings
+        on_file: Called with each file's index, upload and error, if any
+        max_files: Maximum number of files in the request
+        validate: Checks each file name and content type before its data
+            is read; raises HTTPException to reject the file
+        require_dicom: Reject files without the DICOM `DICM` prefix
+        suffix: Temporary file suffix, by default the upload's extension
+
+    Returns:
+        int: The number of files in the request
+
+    Raises:
+        HTTPException: 400 if the request is malformed or has more than
+            `max_files` files, 413 if it is larger than `max_files` files of
+            `max_file_size`, 422 if there are no files
+    """
+    boundary = _multipart_boundary(request)
+    memory_limit = _memory_limit(settings, True)
+    reader = _UploadReader(
+        settings,
+        memory_limit,
+        suffix,
+        validate,
+        require_dicom,
+        field=BATCH_UPLOAD_FIELD,
+        max_files=max_files,
+        on_file=on_file,
+        budget=_MemoryBudget(memory_limit),
+    )
+    await _parse(
+        request,
+        settings,
+        boundary,
+        reader,
+        max_files * (settings.max_file_size + MULTIPART_OVERHEAD),
+    )
+    if not reader.files:
+        raise HTTPException(
+            status_code=422, detail=f"Missing upload field '{BATCH_UPLOAD_FIELD}'"
+        )
+    return reader.files
@@ -1,15 +1,30 @@
+# First, so the startup report times the application's imports
+from .core.startup import IMPORT_STARTED, StartupReport, get_startup_report
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import logging
+import time
 import uvicorn
 
-from .api.routes import router as api_router
-from .core.config import get_settings
+from .api.routes import ENDPOINT_CLASSES, router as api_router
+from .core.admission import AdmissionMiddleware
+from .core.timing import ServerTimingMiddleware
+from .core.config import Settings, get_settings
+from .core.executors import get_worker_pools
 from .core.exceptions import (
     DentalDetectionException,
     global_exception_handler,
     dental_detection_exception_handler,
 )
+from .services.inference_backends import get_inference_backends
+from .services.inference_client import get_inference_http_client
+from .services.inference_service import get_inference_service
+from .services.report_jobs import get_report_job_queue
+from .services.report_rules import get_rule_based_report_generator
+from .services.warmup import warm_up
 
 # Configure logging
 logging.basicConfig(
@@ -19,8 +34,52 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def build_services(settings: Settings) -> None:
+    """Build the long-lived services now rather than on first request"""
+    get_worker_pools()
+    get_inference_backends().get(settings.default_model_id)
+    get_inference_service()
+    if settings.report_rules_enabled:
+        get_rule_based_report_generator()
+
+
+async def _warm_up(startup: StartupReport, settings: Settings) -> None:
+    await warm_up(startup, settings)
+    startup.mark_ready()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown"""
+    settings = get_settings()
+    startup = get_startup_report()
+    with startup.phase("services"):
+        build_services(settings)
+        # Resume report jobs left queued by a previous run
+        await get_report_job_queue().start()
+
+    # The server answers requests while warming up; /ready reports when done
+    warming = None
+    if settings.warmup_enabled:
+        startup.status = "warming_up"
+        warming = asyncio.create_task(_warm_up(startup, settings))
+    else:
+        startup.mark_ready()
+    yield
+    if warming is not None:
+        warming.cancel()
+        await asyncio.gather(warming, return_exceptions=True)
+    await get_report_job_queue().stop()
+    # Stop worker processes and threads and close pooled connections
+    get_inference_backends().close()
+    get_worker_pools().shutdown()
+    await get_inference_http_client().aclose()
+
+
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application"""
+    started = time.perf_counter()
+    get_startup_report().record("import", started - IMPORT_STARTED)
     settings = get_settings()
 
     app = FastAPI(
@@ -28,6 +87,7 @@ def create_app() -> FastAPI:
         description="AI-powered dental condition detection API for cavities and periapical lesions",
         version="1.0.0",
         debug=settings.debug,
+        lifespan=lifespan,
     )
 
     # Exception handlers
@@ -36,6 +96,12 @@ def create_app() -> FastAPI:
         DentalDetectionException, dental_detection_exception_handler
     )
 
+    # Shed load on expensive endpoints before their uploads are read
+    app.add_middleware(AdmissionMiddleware, endpoint_classes=ENDPOINT_CLASSES)
+
+    # Time request stages for /metrics and the Server-Timing header
+    app.add_middleware(ServerTimingMiddleware)
+
     # Add CORS middleware
     app.add_middleware(
         CORSMiddleware,
@@ -43,6 +109,7 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["Retry-After", "Server-Timing"],
     )
 
     # Include API routes
@@ -57,6 +124,7 @@ def create_app() -> FastAPI:
             "docs": "/docs",
         }
 
+    get_startup_report().record("create_app", time.perf_counter() - started)
     return app
 
 
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any
 from datetime import datetime
 
 
@@ -34,6 +34,7 @@ class DicomMetadata(BaseModel):
     manufacturer_model_name: Optional[str] = None
     rows: Optional[int] = None
     columns: Optional[int] = None
+    number_of_frames: Optional[int] = None
     pixel_spacing: Optional[List[float]] = None
     bits_allocated: Optional[int] = None
     bits_stored: Optional[int] = None
@@ -63,6 +64,9 @@ class ImageInfo(BaseModel):
     transfer_syntax: Optional[str] = Field(
         None, description="DICOM transfer syntax UID"
     )
+    inference_size: Optional[List[int]] = Field(
+        None, description="Size of the image sent for inference [width, height]"
+    )
 
 
 class DicomDetectionResponse(BaseModel):
@@ -71,6 +75,56 @@ class DicomDetectionResponse(BaseModel):
     predictions: List[Detection]
     metadata: DicomMetadata
     image_info: ImageInfo
+    report_job: Optional["ReportJob"] = Field(
+        None, description="Report job started for the detections, if requested"
+    )
+
+
+class FrameDetectionResult(BaseModel):
+    """Detections for a single frame of a multi-frame DICOM file"""
+
+    frame_index: int = Field(description="Zero-based index of the frame")
+    predictions: List[Detection]
+    image_info: ImageInfo
+
+
+class MultiFrameDicomDetectionResponse(BaseModel):
+    """Response model for per-frame detection on a multi-frame DICOM file"""
+
+    metadata: DicomMetadata
+    number_of_frames: int = Field(description="Total frames in the file")
+    frames: List[FrameDetectionResult] = Field(
+        description="Results for the sampled frames, in frame order"
+    )
+
+
+class BatchDicomDetectionItem(BaseModel):
+    """Result for a single file of a batch DICOM detection request"""
+
+    index: int = Field(description="Position of the file in the request")
+    filename: Optional[str] = None
+    status: Literal["success", "error"]
+    result: Optional[DicomDetectionResponse] = None
+    status_code: Optional[int] = Field(
+        None, description="HTTP status the file would have received on its own"
+    )
+    detail: Optional[str] = Field(None, description="Error message if failed")
+
+
+class BatchDicomMetadataItem(BaseModel):
+    """Metadata for a single file of a bulk metadata request"""
+
+    index: int = Field(description="Position of the file in the request")
+    filename: Optional[str] = None
+    status: Literal["success", "error"]
+    metadata: Optional[DicomMetadata] = None
+    detail: Optional[str] = Field(None, description="Error message if failed")
+
+
+class BatchDicomMetadataResponse(BaseModel):
+    """Response model for bulk DICOM metadata extraction"""
+
+    items: List[BatchDicomMetadataItem]
 
 
 class ErrorResponse(BaseModel):
@@ -88,6 +142,17 @@ class DiagnosticReport(BaseModel):
         description="Overall severity assessment (low, moderate, high)"
     )
     generated_at: datetime = Field(default_factory=datetime.now)
+    cache_hit: bool = Field(
+        False, description="Whether the report was served from the report cache"
+    )
+    generated_by: Literal["rules", "llm", "fallback"] = Field(
+        "llm",
+        description="Tier that produced the report: the rule-based templates, the LLM, or the fallback after a failure",
+    )
+    prompt_tokens: Optional[int] = Field(
+        None,
+        description="Prompt tokens of the LLM completion that produced the report",
+    )
 
 
 class DiagnosticReportResponse(BaseModel):
@@ -112,3 +177,25 @@ class DiagnosticReportRequest(BaseModel):
     image_info: Optional[ImageInfo] = Field(
         None, description="Image technical information"
     )
+
+
+class ReportJob(BaseModel):
+    """A queued diagnostic report generation job"""
+
+    job_id: str
+    status: Literal["queued", "running", "completed", "failed"]
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    attempts: int = Field(0, description="Times a worker has started the job")
+    result: Optional[DiagnosticReportResponse] = Field(
+        None, description="The report, once the job has completed"
+    )
+    error: Optional[str] = Field(None, description="Why the job failed")
+    webhook_status: Optional[Literal["pending", "delivered", "failed"]] = Field(
+        None, description="Delivery of the completion webhook, if one is configured"
+    )
+
+
+# Refers to ReportJob, defined after it
+DicomDetectionResponse.model_rebuild()
@@ -0,0 +1,148 @@
+"""
+Dynamic micro-batching of inference calls
+
+Images submitted for the same model by concurrent requests are collected
+and sent to the backend as one batched call, and each result is handed
+back to the request that submitted it.
+
+Batching adapts to load: when no batch for the model is in flight an image
+is dispatched immediately, so a lone request never waits. While a batch is
+in flight new images queue up. They are dispatched together when that batch
+completes, when the queue reaches `inference_batch_max_size`, or at the
+latest after `inference_batch_window_ms`, whichever comes first.
+
+Only backends that run a batch in one call (`supports_batching`) are
+batched. Calls to the others, such as the hosted API, go straight to the
+backend, as batching them would only make each image wait for the window
+and for the slowest image of its batch.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Set
+import asyncio
+import time
+
+from ..core.config import get_settings
+from ..core.metrics import LATENCY_BUCKETS, Histogram
+from .inference_backends import (
+    InferenceBackends,
+    InferenceInput,
+    get_inference_backends,
+)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+@dataclass
+class _Pending:
+    image: InferenceInput
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class MicroBatcher:
+    """Collects concurrent inference calls per model into batches"""
+
+    def __init__(
+        self, backends: InferenceBackends, max_batch_size: int, window_seconds: float
+    ):
+        self.backends = backends
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+
+        self._queues: Dict[str, List[_Pending]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        # Keeps dispatched batches referenced until they finish
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+
+    async def submit(self, image: InferenceInput, model_id: str) -> Dict[str, Any]:
+        """Run inference on an image as part of the next batch for the model"""
+        backend = self.backends.get(model_id)
+        if not backend.supports_batching:
+            return await backend.infer(image, model_id)
+
+        loop = asyncio.get_running_loop()
+        pending = _Pending(image, loop.create_future(), time.perf_counter())
+        queue = self._queues.setdefault(model_id, [])
+        queue.append(pending)
+
+        if len(queue) >= self.max_batch_size or not self._in_flight[model_id]:
+            self._flush(model_id)
+        elif model_id not in self._timers:
+            self._timers[model_id] = loop.call_later(
+                self.window_seconds, self._flush, model_id
+            )
+        return await pending.future
+
+    def _flush(self, model_id: str) -> None:
+        """Dispatch everything queued for a model as one batch"""
+        timer = self._timers.pop(model_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        # Requests that went away while queued are dropped
+        batch = [p for p in self._queues.pop(model_id, []) if not p.future.done()]
+        if not batch:
+            return
+
+        self._in_flight[model_id] += 1
+        task = asyncio.create_task(self._run(model_id, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, model_id: str, batch: List[_Pending]) -> None:
+        dispatched_at = time.perf_counter()
+        for pending in batch:
+            self.queue_wait.observe(dispatched_at - pending.enqueued_at)
+        self.batch_sizes.observe(len(batch))
+
+        try:
+            backend = self.backends.get(model_id)
+            results = await backend.infer_batch([p.image for p in batch], model_id)
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"Backend returned {len(results)} results for {len(batch)} images"
+                )
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self._in_flight[model_id] -= 1
+
+        for pending, result in zip(batch, results):
+            if pending.future.done():
+                continue
+            if isinstance(result, BaseException):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+        # Images that queued up behind this batch go out together now
+        if self._queues.get(model_id):
+            self._flush(model_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch-size and queue-wait histograms and current queue depth"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_seconds": self.window_seconds,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "batches_in_flight": sum(self._in_flight.values()),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+        }
+
+
+@lru_cache()
+def get_inference_batcher() -> MicroBatcher:
+    settings = get_settings()
+    return MicroBatcher(
+        get_inference_backends(),
+        max_batch_size=settings.inference_batch_max_size,
+        window_seconds=settings.inference_batch_window_ms / 1000,
+    )
@@ -0,0 +1,282 @@
+"""
+Content-addressed result cache
+
+Results are stored in a bounded in-memory LRU tier backed by a persistent
+tier of JSON files on disk. Both tiers expire entries after a TTL; the disk
+tier is additionally capped in total size and evicts least recently written
+entries first. Disk access runs off the event loop.
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def hash_content(content: bytes) -> str:
+    """SHA-256 hex digest used to address cached results by content"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def make_cache_key(namespace: str, content_hash: str, *params: Any) -> str:
+    """
+    Build a file-name safe cache key
+
+    The content hash stays readable in the key so that every entry derived
+    from the same content can be invalidated together.
+    """
+    params_hash = hashlib.sha256(
+        json.dumps(params, sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+    return f"{namespace}-{content_hash}-{params_hash}"
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) cache for JSON-serialisable results"""
+
+    def __init__(
+        self,
+        name: str,
+        directory: Optional[str],
+        memory_max_entries: int,
+        disk_max_bytes: int,
+        ttl_seconds: int,
+    ):
+        self.name = name
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        # key -> (expires_at, value)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # key -> (written_at, size), oldest first
+        self._disk_index: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+        self.directory: Optional[Path] = None
+        if directory:
+            try:
+                self.directory = Path(directory)
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._load_disk_index()
+            except OSError as e:
+                logger.warning(f"Disabling disk tier of {name} cache: {e}")
+                self.directory = None
+
+    def _path(self, key: str) -> Path:
+        assert self.directory is not None
+        return self.directory / f"{key}.json"
+
+    def _load_disk_index(self) -> None:
+        """Index existing cache files, oldest first, and enforce the size cap"""
+        assert self.directory is not None
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+
+        for written_at, key, size in sorted(entries):
+            self._disk_index[key] = (written_at, size)
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """Remove the oldest files until the disk tier fits its size cap"""
+        while self._disk_bytes > self.disk_max_bytes and self._disk_index:
+            key, (_, size) = self._disk_index.popitem(last=False)
+            self._disk_bytes -= size
+            self._counters["evictions"] += 1
+            self._unlink(key)
+
+    def _unlink(self, key: str) -> None:
+        try:
+            self._path(key).unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Failed to delete cache file for {key}: {e}")
+
+    def _memory_set(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_max_entries:
+                self._memory.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if self.directory is None or key not in self._disk_index:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read cache file for {key}: {e}")
+            return None
+
+        expires_at = entry["expires_at"]
+        if expires_at <= time.time():
+            with self._lock:
+                self._drop_disk_entry(key)
+            self._counters["expired"] += 1
+            return None
+        return expires_at, entry["value"]
+
+    def _disk_set(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        if self.directory is None:
+            return
+        payload = json.dumps(
+            {"expires_at": expires_at, "value": value}, default=str
+        ).encode()
+        if len(payload) > self.disk_max_bytes:
+            return
+
+        path = self._path(key)
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            # Write then rename so readers never see a partial file
+            with open(temp_path, "wb") as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache file for {key}: {e}")
+            return
+
+        with self._lock:
+            self._drop_disk_entry(key, unlink=False)
+            self._disk_index[key] = (time.time(), len(payload))
+            self._disk_bytes += len(payload)
+            self._evict_disk()
+
+    def _drop_disk_entry(self, key: str, unlink: bool = True) -> None:
+        entry = self._disk_index.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry[1]
+            if unlink:
+                self._unlink(key)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value for a key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+                self._counters["expired"] += 1
+
+        disk_entry = await asyncio.to_thread(self._disk_get, key)
+        if disk_entry is not None:
+            self._counters["disk_hits"] += 1
+            # Promote to the memory tier
+            self._memory_set(key, *disk_entry)
+            return disk_entry[1]
+
+        self._counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a value in both tiers"""
+        expires_at = time.time() + self.ttl_seconds
+        self._memory_set(key, expires_at, value)
+        self._counters["sets"] += 1
+        await asyncio.to_thread(self._disk_set, key, expires_at, value)
+
+    def invalidate(self, content_hash: Optional[str] = None) -> int:
+        """
+        Remove cached entries
+
+        Args:
+            content_hash: Only remove entries derived from this content;
+                removes everything when omitted
+
+        Returns:
+            int: Number of entries removed from either tier
+        """
+
+        def matches(key: str) -> bool:
+            return content_hash is None or f"-{content_hash}-" in key
+
+        with self._lock:
+            keys = {key for key in self._memory if matches(key)}
+            keys |= {key for key in self._disk_index if matches(key)}
+            for key in keys:
+                self._memory.pop(key, None)
+                if self.directory is not None:
+                    self._drop_disk_entry(key)
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and the size of each tier"""
+        hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self.memory_max_entries,
+            "disk_enabled": self.directory is not None,
+            "disk_entries": len(self._disk_index),
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+@lru_cache()
+def get_detection_cache() -> ResultCache:
+    """Cache of detection results keyed by upload content and model"""
+    settings = get_settings()
+    return ResultCache(
+        "detection",
+        directory=(
+            os.path.join(settings.cache_dir, "detections")
+            if settings.detection_cache_persist
+            else None
+        ),
+        memory_max_entries=settings.detection_cache_memory_entries,
+        disk_max_bytes=settings.detection_cache_disk_max_mb * 1024 * 1024,
+        ttl_seconds=settings.detection_cache_ttl_seconds,
+    )
+
+
+@lru_cache()
+def get_report_cache() -> ResultCache:
+    """Cache of diagnostic reports keyed by the canonical prompt inputs"""
+    settings = get_settings()
+    return ResultCache(
+        "report",
+        directory=(
+            os.path.join(settings.cache_dir, "reports")
+            if settings.report_cache_persist
+            else None
+        ),
+        memory_max_entries=settings.report_cache_memory_entries,
+        disk_max_bytes=settings.report_cache_disk_max_mb * 1024 * 1024,
+        ttl_seconds=settings.report_cache_ttl_seconds,
+    )
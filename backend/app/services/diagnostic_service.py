@@ -1,21 +1,49 @@
-from typing import List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple, Union
 import logging
-import asyncio
+import time
 from functools import lru_cache
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import BaseOutputParser
-from langchain.schema.output_parser import OutputParserException
 import json
 
-from ..models.detection import Detection, DicomMetadata, DiagnosticReport
+from ..models.detection import Detection, DicomMetadata, DiagnosticReport, ImageInfo
 from ..core.config import Settings, get_settings
+from ..core.timing import record_stage, stage_timer
+from .cache_service import get_report_cache, hash_content, make_cache_key
+from .report_prompt import (
+    EncodedDetections,
+    encode_detections,
+    estimate_tokens,
+    get_prompt_tokens,
+)
+from .report_rules import get_rule_based_report_generator
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the prompt template changes so cached reports are not reused
+PROMPT_VERSION = 3
 
-class DiagnosticReportParser(BaseOutputParser[DiagnosticReport]):
+# Report fields in the order the model is asked to write them, shortest
+# first, so a streamed report shows its summary early
+REPORT_SECTIONS = ("summary", "severity_level", "recommendations", "report")
+
+
+@dataclass(frozen=True)
+class ReportStreamEvent:
+    """
+    A step of a streamed report
+
+    `token` events carry a chunk of model output (`{"text": ...}`),
+    `section` events a report field as soon as it is complete
+    (`{"name": ..., "value": ...}`) and the final `report` event the
+    validated `DiagnosticReport`.
+    """
+
+    event: str
+    data: Any
+
+
+class DiagnosticReportParser:
     """Custom parser for diagnostic report output"""
 
     def parse(self, text: str) -> DiagnosticReport:
@@ -85,16 +113,33 @@ class DiagnosticReportParser(BaseOutputParser[DiagnosticReport]):
 
 
 class DiagnosticReportService:
-    """Service for generating diagnostic reports using LangChain and OpenAI"""
+    """
+    Service for generating diagnostic reports using LangChain and OpenAI
+
+    LangChain and the OpenAI client take over a second to import, so they
+    are imported when the service is built rather than with this module;
+    the application builds it during startup warm-up.
+    """
 
     def __init__(self):
+        from langchain.prompts import ChatPromptTemplate
+        from langchain_openai import ChatOpenAI
+
         self.settings = get_settings()
         self.llm = ChatOpenAI(
             model=self.settings.openai_model,
             api_key=self.settings.openai_api_key,
             temperature=0.1,  # Low temperature for consistent medical reports
+            stream_usage=True,  # Streamed completions report token usage too
         )
         self.parser = DiagnosticReportParser()
+        self.cache = get_report_cache()
+        # Routine inputs get a templated report, the rest escalate to the LLM
+        self.rules = (
+            get_rule_based_report_generator()
+            if self.settings.report_rules_enabled
+            else None
+        )
 
         # Create the prompt template
         self.prompt = ChatPromptTemplate.from_messages(
@@ -114,10 +159,10 @@ Guidelines:
 
 Return your response in this exact JSON format:
 {{
-    "report": "Full detailed report text",
     "summary": "Brief summary of key findings",
+    "severity_level": "low|moderate|high",
     "recommendations": ["List", "of", "specific", "recommendations"],
-    "severity_level": "low|moderate|high"
+    "report": "Full detailed report text"
 }}""",
                 ),
                 (
@@ -138,79 +183,251 @@ Please provide a comprehensive diagnostic report with specific findings, recomme
             ]
         )
 
-        # Create the chain
-        self.chain = self.prompt | self.llm | self.parser
+        # Create the chain; output is parsed separately, which keeps the
+        # completion's token usage and lets streams be parsed as they arrive
+        self.chain = self.prompt | self.llm
+
+        # Prompt tokens besides the formatted inputs
+        self._prompt_overhead = sum(
+            estimate_tokens(message.content)
+            for message in self.prompt.format_messages(
+                detections="", patient_info="", image_info=""
+            )
+        )
+
+    async def warm_up(self) -> None:
+        """Open a pooled connection to the completions API"""
+        import openai
+
+        try:
+            await self.llm.root_async_client.with_options(max_retries=0).models.list()
+        except openai.APIStatusError:
+            # Any response leaves the connection open for reuse
+            pass
 
     async def generate_diagnostic_report(
         self,
         detections: List[Detection],
         metadata: Optional[DicomMetadata] = None,
         image_info: Optional[Dict[str, Any]] = None,
+        fallback: bool = True,
     ) -> DiagnosticReport:
-        """Generate a diagnostic report from detection results"""
+        """
+        Generate a diagnostic report from detection results
 
+        Args:
+            fallback: Return the fallback report if generation fails, rather
+                than raising; report jobs turn this off to retry instead
+        """
         try:
-            # Format detections for the prompt
-            detection_text = self._format_detections(detections)
-
-            # Format patient info
-            patient_info = self._format_patient_info(metadata)
-
-            # Format image info
-            image_info_text = self._format_image_info(image_info)
-
-            # return DiagnosticReport(
-            #     report=f"Automated dental analysis detected {len(detections)} findings. Professional evaluation recommended.",
-            #     summary=f"Analysis completed with {len(detections)} detections",
-            #     recommendations=[
-            #         "Schedule dental consultation",
-            #         "Professional radiographic interpretation needed",
-            #     ],
-            #     severity_level="moderate",
-            # )
-            # Run the chain asynchronously
-            result = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: self.chain.invoke(
-                    {
-                        "detections": detection_text,
-                        "patient_info": patient_info,
-                        "image_info": image_info_text,
-                    }
-                ),
-            )
+            return await self._generate(detections, metadata, image_info)
+        except Exception as e:
+            if not fallback:
+                raise
+            logger.error(f"Failed to generate diagnostic report: {e}")
+            return self._fallback_report(detections)
 
-            return result
+    async def _generate(
+        self,
+        detections: List[Detection],
+        metadata: Optional[DicomMetadata],
+        image_info: Optional[Dict[str, Any]],
+    ) -> DiagnosticReport:
+        rule_based = self._rule_based_report(detections, metadata)
+        if rule_based is not None:
+            return rule_based
+
+        inputs, encoded = self._prompt_inputs(detections, metadata, image_info)
+        cache_key = self._report_cache_key(inputs)
+        cached = await self._cached_report(cache_key)
+        if cached is not None:
+            return cached
+
+        # Awaiting the chain keeps no executor thread busy for the length of
+        # the completion
+        with stage_timer("report_llm", model_id=self.settings.openai_model):
+            message = await self.chain.ainvoke(inputs)
+        result = self.parser.parse(message.content)
+        result.prompt_tokens = self._record_prompt_tokens(
+            message.usage_metadata, inputs, encoded
+        )
+
+        if cache_key:
+            await self.cache.set(cache_key, result.model_dump(mode="json"))
+
+        return result
+
+    async def stream_diagnostic_report(
+        self,
+        detections: List[Detection],
+        metadata: Optional[DicomMetadata] = None,
+        image_info: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[ReportStreamEvent]:
+        """
+        Generate a diagnostic report, yielding it as the model writes it
+
+        Yields a `token` event per chunk of model output and a `section`
+        event as each report field completes, then a `report` event with the
+        same validated report `generate_diagnostic_report` returns. Rule-based
+        and cached reports are replayed as their sections. On failure the fallback
+        report is delivered as the `report` event.
+        """
+        model_id = self.settings.openai_model
+        started = time.perf_counter()
+        try:
+            ready = self._rule_based_report(detections, metadata)
+            if ready is None:
+                inputs, encoded = self._prompt_inputs(detections, metadata, image_info)
+                cache_key = self._report_cache_key(inputs)
+                ready = await self._cached_report(cache_key)
+            if ready is not None:
+                for name in REPORT_SECTIONS:
+                    yield ReportStreamEvent(
+                        "section", {"name": name, "value": getattr(ready, name)}
+                    )
+                yield ReportStreamEvent("report", ready)
+                return
+
+            text = ""
+            sent: List[str] = []
+            usage = None
+            with stage_timer("report_llm", model_id=model_id):
+                async for chunk in self.chain.astream(inputs):
+                    usage = chunk.usage_metadata or usage
+                    if not chunk.content:
+                        continue
+                    if not text:
+                        record_stage(
+                            "report_first_token",
+                            time.perf_counter() - started,
+                            model_id=model_id,
+                        )
+                    text += chunk.content
+                    yield ReportStreamEvent("token", {"text": chunk.content})
+                    # A field is complete once the next key starts, which
+                    # needs a quote, so most chunks are not parsed at all
+                    if '"' in chunk.content:
+                        for name, value in _completed_sections(text, sent):
+                            sent.append(name)
+                            yield ReportStreamEvent(
+                                "section", {"name": name, "value": value}
+                            )
+
+            result = self.parser.parse(text)
+            result.prompt_tokens = self._record_prompt_tokens(usage, inputs, encoded)
+            for name in REPORT_SECTIONS:
+                if name not in sent:
+                    yield ReportStreamEvent(
+                        "section", {"name": name, "value": getattr(result, name)}
+                    )
+
+            if cache_key:
+                await self.cache.set(cache_key, result.model_dump(mode="json"))
 
         except Exception as e:
-            logger.error(f"Failed to generate diagnostic report: {e}")
-            # Return a fallback report
-            return DiagnosticReport(
-                report=f"Automated dental analysis detected {len(detections)} findings. Professional evaluation recommended.",
-                summary=f"Analysis completed with {len(detections)} detections",
-                recommendations=[
-                    "Schedule dental consultation",
-                    "Professional radiographic interpretation needed",
-                ],
-                severity_level="moderate",
-            )
+            logger.error(f"Failed to stream diagnostic report: {e}")
+            result = self._fallback_report(detections)
 
-    def _format_detections(self, detections: List[Detection]) -> str:
-        """Format detection results for the prompt"""
-        if not detections:
-            return "No significant findings detected in the image."
-
-        formatted = []
-        for i, detection in enumerate(detections, 1):
-            formatted.append(
-                f"Detection {i}:\n"
-                f"  - Condition: {detection.class_}\n"
-                f"  - Location: ({detection.x}, {detection.y}) with dimensions {detection.width}x{detection.height}\n"
-                f"  - Confidence: {detection.confidence:.2%}\n"
-                f"  - Detection ID: {detection.detection_id}"
-            )
+        yield ReportStreamEvent("report", result)
 
-        return "\n\n".join(formatted)
+    def _rule_based_report(
+        self, detections: List[Detection], metadata: Optional[DicomMetadata]
+    ) -> Optional[DiagnosticReport]:
+        """Templated report for routine inputs, or None to use the LLM"""
+        if self.rules is None or not self.rules.matches(detections):
+            return None
+        with stage_timer("report_rules"):
+            return self.rules.generate(detections, metadata)
+
+    def _prompt_inputs(
+        self,
+        detections: List[Detection],
+        metadata: Optional[DicomMetadata],
+        image_info: Optional[Union[ImageInfo, Dict[str, Any]]],
+    ) -> Tuple[Dict[str, str], EncodedDetections]:
+        """
+        Format detections, patient and image information for the prompt
+
+        Detections get the part of `report_prompt_token_budget` the rest of
+        the prompt leaves, and are summarised if they need more.
+        """
+        if isinstance(image_info, ImageInfo):
+            image_info = image_info.model_dump()
+        patient_info = self._format_patient_info(metadata)
+        image_info_text = self._format_image_info(image_info)
+        budget = (
+            self.settings.report_prompt_token_budget
+            - self._prompt_overhead
+            - estimate_tokens(patient_info)
+            - estimate_tokens(image_info_text)
+        )
+        encoded = encode_detections(detections, metadata, image_info, budget)
+        inputs = {
+            "detections": encoded.text,
+            "patient_info": patient_info,
+            "image_info": image_info_text,
+        }
+        return inputs, encoded
+
+    def _record_prompt_tokens(
+        self,
+        usage: Optional[Dict[str, Any]],
+        inputs: Dict[str, str],
+        encoded: EncodedDetections,
+    ) -> int:
+        """Prompt tokens of a completion, as reported by the API or estimated"""
+        tokens = (usage or {}).get("input_tokens") or self._prompt_overhead + sum(
+            estimate_tokens(text) for text in inputs.values()
+        )
+        get_prompt_tokens().labels(
+            model_id=self.settings.openai_model, encoding=encoded.level
+        ).observe(tokens)
+        return tokens
+
+    def _report_cache_key(self, inputs: Dict[str, str]) -> Optional[str]:
+        """Cache key of the prompt inputs, or None when caching is disabled"""
+        if not self.settings.report_cache_enabled:
+            return None
+        return self._cache_key(
+            inputs["detections"], inputs["patient_info"], inputs["image_info"]
+        )
+
+    async def _cached_report(
+        self, cache_key: Optional[str]
+    ) -> Optional[DiagnosticReport]:
+        """Identical prompt inputs produce the same report, serve it from cache"""
+        if cache_key is None:
+            return None
+        with stage_timer("report_cache"):
+            cached = await self.cache.get(cache_key)
+        if cached is None:
+            return None
+        return DiagnosticReport(**{**cached, "cache_hit": True})
+
+    def _fallback_report(self, detections: List[Detection]) -> DiagnosticReport:
+        """Report returned when generation fails"""
+        return DiagnosticReport(
+            report=f"Automated dental analysis detected {len(detections)} findings. Professional evaluation recommended.",
+            summary=f"Analysis completed with {len(detections)} detections",
+            recommendations=[
+                "Schedule dental consultation",
+                "Professional radiographic interpretation needed",
+            ],
+            severity_level="moderate",
+            generated_by="fallback",
+        )
+
+    def _cache_key(
+        self, detection_text: str, patient_info: str, image_info_text: str
+    ) -> str:
+        """Key a report by the exact prompt inputs, model and prompt version"""
+        prompt_inputs = "\x1f".join([detection_text, patient_info, image_info_text])
+        return make_cache_key(
+            "report",
+            hash_content(prompt_inputs.encode()),
+            self.settings.openai_model,
+            PROMPT_VERSION,
+        )
 
     def _format_patient_info(self, metadata: Optional[DicomMetadata]) -> str:
         """Format patient information from DICOM metadata"""
@@ -261,6 +478,31 @@ Please provide a comprehensive diagnostic report with specific findings, recomme
         )
 
 
+def _completed_sections(text: str, sent: List[str]) -> List[Tuple[str, Any]]:
+    """
+    Report fields of partial JSON output that are complete and not yet sent
+
+    Every key but the last one parsed is complete, as the model has moved on.
+    """
+    from langchain_core.utils.json import parse_partial_json
+
+    start = text.find("{")
+    if start < 0:
+        return []
+    try:
+        partial = parse_partial_json(text[start:])
+    except Exception:
+        return []
+    if not isinstance(partial, dict):
+        return []
+    complete = list(partial)[:-1]
+    return [
+        (name, partial[name])
+        for name in complete
+        if name in REPORT_SECTIONS and name not in sent
+    ]
+
+
 @lru_cache()
 def get_diagnostic_report_service() -> DiagnosticReportService:
     """Dependency injection for diagnostic report service"""
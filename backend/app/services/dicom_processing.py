@@ -0,0 +1,535 @@
+"""
+DICOM decoding and conversion pipeline
+
+The dataset is read and its pixel data decoded exactly once by `decode_dicom`;
+the resulting `DecodedDicom` is then shared by metadata extraction, image
+conversion and `ImageInfo` construction.
+
+`process_dicom` runs the whole pipeline and only takes and returns picklable
+values, so it can be executed on a worker process. Multi-frame datasets are
+handled one frame at a time by `process_dicom_frame`, which reads and decodes
+only the requested frame.
+"""
+
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+import io
+import logging
+import time
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset
+from pydicom.pixels import pixel_array as decode_pixel_array
+from PIL import Image
+
+from ..core.exceptions import DicomProcessingException
+from ..models.detection import DicomMetadata, ImageInfo
+from .preprocessing import PreparedImage, PreprocessOptions, prepare_image
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever conversion output changes so cached results are not reused.
+# 2: lookup table conversion, which changed the output for signed data
+CONVERSION_VERSION = 2
+# Integer grayscale pixel data up to this width is converted through a
+# lookup table indexed by stored value
+LUT_MAX_BITS = 16
+
+
+@dataclass
+class DecodedDicom:
+    """A DICOM dataset together with its decoded pixel data"""
+
+    dataset: Dataset
+    pixel_array: np.ndarray
+    pixel_min: float
+    pixel_max: float
+    # Seconds spent reading and decoding, reported as request timings
+    timings: Dict[str, float]
+
+    @property
+    def transfer_syntax(self) -> Optional[str]:
+        file_meta = getattr(self.dataset, "file_meta", None)
+        if file_meta is not None and hasattr(file_meta, "TransferSyntaxUID"):
+            return str(file_meta.TransferSyntaxUID)
+        return None
+
+
+def get_number_of_frames(dataset: Dataset) -> int:
+    """Number of frames in the pixel data, 1 for single-frame datasets"""
+    try:
+        return max(int(getattr(dataset, "NumberOfFrames", 1) or 1), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def _decoded(
+    dataset: Dataset, pixel_array: np.ndarray, timings: Dict[str, float]
+) -> DecodedDicom:
+    return DecodedDicom(
+        dataset=dataset,
+        pixel_array=pixel_array,
+        pixel_min=float(pixel_array.min()),
+        pixel_max=float(pixel_array.max()),
+        timings=timings,
+    )
+
+
+def decode_dicom(source: Union[str, BinaryIO]) -> DecodedDicom:
+    """
+    Read a DICOM dataset and decode its pixel data once
+
+    Only the first frame of a multi-frame dataset is decoded; use
+    `decode_dicom_frame` to access the others.
+
+    Args:
+        source: Path to the DICOM file or a readable binary file-like object
+
+    Returns:
+        DecodedDicom: The dataset, its pixel array and the pixel value range
+    """
+    started = time.perf_counter()
+    dataset = pydicom.dcmread(source)
+    read = time.perf_counter()
+    if get_number_of_frames(dataset) > 1:
+        pixel_array = decode_pixel_array(dataset, index=0)
+    else:
+        pixel_array = dataset.pixel_array
+
+    timings = {"dcmread": read - started, "decode": time.perf_counter() - read}
+    return _decoded(dataset, pixel_array, timings)
+
+
+def decode_dicom_frame(source: Union[str, BinaryIO], index: int) -> DecodedDicom:
+    """
+    Decode a single frame without reading the rest of the pixel data
+
+    Args:
+        source: Path to the DICOM file or a seekable binary file-like object
+        index: Zero-based frame index
+
+    Returns:
+        DecodedDicom: The dataset (without pixel data) and the frame's pixels
+    """
+    started = time.perf_counter()
+    dataset = Dataset()
+    pixel_array = decode_pixel_array(source, ds_out=dataset, index=index)
+    return _decoded(dataset, pixel_array, {"decode": time.perf_counter() - started})
+
+
+def select_frames(
+    number_of_frames: int, start: int = 0, stride: int = 1, limit: Optional[int] = None
+) -> List[int]:
+    """Frame indices to process for the given sampling parameters"""
+    indices = list(range(start, number_of_frames, stride))
+    return indices[:limit] if limit is not None else indices
+
+
+def _float_list(value: Any) -> List[float]:
+    return [float(x) for x in value]
+
+
+# Declarative mapping of DicomMetadata fields to the DICOM keyword they are
+# read from and the converter applied to the element value
+DICOM_METADATA_TAGS: Dict[str, Tuple[str, Callable[[Any], Any]]] = {
+    "patient_id": ("PatientID", str),
+    "patient_name": ("PatientName", str),
+    "patient_birth_date": ("PatientBirthDate", str),
+    "patient_sex": ("PatientSex", str),
+    "study_date": ("StudyDate", str),
+    "study_time": ("StudyTime", str),
+    "study_description": ("StudyDescription", str),
+    "series_description": ("SeriesDescription", str),
+    "modality": ("Modality", str),
+    "manufacturer": ("Manufacturer", str),
+    "manufacturer_model_name": ("ManufacturerModelName", str),
+    "rows": ("Rows", int),
+    "columns": ("Columns", int),
+    "number_of_frames": ("NumberOfFrames", int),
+    "pixel_spacing": ("PixelSpacing", _float_list),
+    "bits_allocated": ("BitsAllocated", int),
+    "bits_stored": ("BitsStored", int),
+    "photometric_interpretation": ("PhotometricInterpretation", str),
+    "acquisition_date": ("AcquisitionDate", str),
+    "acquisition_time": ("AcquisitionTime", str),
+    "institution_name": ("InstitutionName", str),
+    "referring_physician_name": ("ReferringPhysicianName", str),
+}
+
+# Only these elements are parsed when reading headers for metadata;
+# SpecificCharacterSet is needed to decode person names correctly
+METADATA_SPECIFIC_TAGS: List[str] = ["SpecificCharacterSet"] + [
+    keyword for keyword, _ in DICOM_METADATA_TAGS.values()
+]
+
+
+def extract_dicom_metadata(dataset: Dataset) -> DicomMetadata:
+    """Build `DicomMetadata` from the header of an already-read dataset"""
+    fields: Dict[str, Any] = {}
+    for field, (keyword, converter) in DICOM_METADATA_TAGS.items():
+        value = getattr(dataset, keyword, None)
+        fields[field] = converter(value) if value is not None else None
+    return DicomMetadata(**fields)
+
+
+def read_dicom_metadata(source: Union[str, BinaryIO]) -> DicomMetadata:
+    """
+    Read DICOM metadata without touching pixel data
+
+    Parsing stops before the pixel data element and only the elements in
+    `DICOM_METADATA_TAGS` are decoded, so the cost is independent of the
+    image size.
+
+    Raises:
+        DicomProcessingException: If the file cannot be parsed
+    """
+    try:
+        dataset = pydicom.dcmread(
+            source, stop_before_pixels=True, specific_tags=METADATA_SPECIFIC_TAGS
+        )
+        return extract_dicom_metadata(dataset)
+    except Exception as e:
+        logger.error(f"Failed to parse DICOM file: {str(e)}")
+        raise DicomProcessingException(f"Failed to parse DICOM file: {str(e)}")
+
+
+def _apply_value_transforms(
+    values: np.ndarray, dataset: Dataset
+) -> Tuple[np.ndarray, bool]:
+    """
+    Apply the modality LUT and the VOI LUT or window to stored pixel values
+
+    Every step is elementwise, so `values` may be either the pixel array
+    itself or the range of stored values it can contain.
+
+    Returns:
+        Tuple of (values, changed); `changed` is False if no step was applied
+    """
+    changed = False
+
+    # Apply modality LUT if present
+    if hasattr(dataset, "ModalityLUTSequence") and dataset.ModalityLUTSequence:
+        try:
+            from pydicom.pixel_data_handlers.util import apply_modality_lut
+
+            values = apply_modality_lut(values, dataset)
+            changed = True
+        except Exception as e:
+            logger.warning(f"Failed to apply modality LUT: {e}")
+
+    # Apply VOI LUT if present (windowing)
+    if hasattr(dataset, "VOILUTSequence") and dataset.VOILUTSequence:
+        try:
+            from pydicom.pixel_data_handlers.util import apply_voi_lut
+
+            values = apply_voi_lut(values, dataset)
+            changed = True
+        except Exception as e:
+            logger.warning(f"Failed to apply VOI LUT: {e}")
+    elif hasattr(dataset, "WindowCenter") and hasattr(dataset, "WindowWidth"):
+        # Apply windowing manually
+        try:
+            window_center = float(
+                dataset.WindowCenter[0]
+                if isinstance(dataset.WindowCenter, list)
+                else dataset.WindowCenter
+            )
+            window_width = float(
+                dataset.WindowWidth[0]
+                if isinstance(dataset.WindowWidth, list)
+                else dataset.WindowWidth
+            )
+
+            # Apply windowing
+            values = np.clip(
+                (values - (window_center - window_width / 2)) / window_width * 255,
+                0,
+                255,
+            )
+            changed = True
+        except Exception as e:
+            logger.warning(f"Failed to apply windowing: {e}")
+
+    return values, changed
+
+
+def _to_display_values(
+    values: np.ndarray, dataset: Dataset, value_range: Optional[Tuple[Any, Any]]
+) -> np.ndarray:
+    """
+    Invert MONOCHROME1 data and normalise values to the 0-255 range
+
+    Args:
+        values: Output of `_apply_value_transforms`
+        dataset: The dataset the values belong to
+        value_range: (min, max) of `values` over the pixels present in the
+            image, or None to compute it from `values`
+
+    Returns:
+        np.ndarray: uint8 display values
+    """
+    if value_range is None:
+        min_val, max_val = values.min(), values.max()
+    else:
+        min_val, max_val = value_range
+
+    # Handle photometric interpretation
+    if getattr(dataset, "PhotometricInterpretation", None) == "MONOCHROME1":
+        # Invert for MONOCHROME1 (0 = white, max = black), which maps
+        # [min, max] onto [0, max - min]
+        max_val = values.dtype.type(max_val)
+        values = max_val - values
+        min_val, max_val = max_val - max_val, max_val - min_val
+
+    # Normalize pixel values to 0-255 range
+    if values.dtype != np.uint8:
+        if max_val > min_val:
+            # Normalize to 0-255
+            values = ((values - min_val) / (max_val - min_val) * 255).astype(np.uint8)
+        else:
+            # Handle case where all pixels have the same value
+            values = np.full(values.shape, 128, dtype=np.uint8)
+
+    return values
+
+
+def _present_value_range(
+    values: np.ndarray, positions: np.ndarray, first: int, index: np.ndarray
+) -> Tuple[Any, Any]:
+    """
+    Range of transformed values over the stored values present in an image
+
+    Args:
+        values: Transformed value for each table position
+        positions: Table position of each entry of `values`
+        first: Offset of the first entry that can occur in the image
+        index: The image, as table positions
+
+    Returns:
+        Tuple of (min, max)
+    """
+    in_range = values[first:]
+    # Monotonic transforms (windowing, most LUTs) take their extremes at the
+    # ends of the stored value range, which are known to be present
+    if (in_range[1:] >= in_range[:-1]).all():
+        return in_range[0], in_range[-1]
+    if (in_range[1:] <= in_range[:-1]).all():
+        return in_range[-1], in_range[0]
+
+    # Otherwise only consider the stored values that actually occur
+    counts = np.bincount(index.ravel(), minlength=int(positions.max()) + 1)
+    present = values[counts[positions] > 0]
+    return present.min(), present.max()
+
+
+def _convert_with_lut(decoded: DecodedDicom) -> Optional[np.ndarray]:
+    """
+    Convert integer grayscale pixel data with a single lookup table pass
+
+    The full conversion is evaluated once per possible stored value rather
+    than once per pixel, and the resulting uint8 table is applied to the
+    image with one indexing pass. For unsigned data the output is identical
+    to converting the pixel array directly. Signed data is evaluated over
+    its stored range through its unsigned bit pattern and is not guaranteed
+    to match, notably where MONOCHROME1 inversion overflows the dtype.
+
+    Returns:
+        np.ndarray: uint8 grayscale image, or None if the pixel data is not
+        integer grayscale of at most `LUT_MAX_BITS` bits
+    """
+    pixel_array = decoded.pixel_array
+    dtype = pixel_array.dtype
+    if (
+        pixel_array.ndim != 2
+        or dtype.kind not in "ui"
+        or dtype.itemsize * 8 > LUT_MAX_BITS
+        or not dtype.isnative
+    ):
+        return None
+
+    pixel_min, pixel_max = int(decoded.pixel_min), int(decoded.pixel_max)
+    if dtype.kind == "u":
+        # Index the table directly by stored value; entries below the
+        # minimum are never looked up
+        domain = np.arange(0, pixel_max + 1, dtype=dtype)
+        first = pixel_min
+        index = pixel_array
+    else:
+        # Signed values index the table through their unsigned bit pattern
+        domain = np.arange(pixel_min, pixel_max + 1).astype(dtype)
+        first = 0
+        index = pixel_array.view(f"u{dtype.itemsize}")
+    positions = domain.view(index.dtype)
+
+    values, changed = _apply_value_transforms(domain, decoded.dataset)
+    if changed:
+        value_range = _present_value_range(values, positions, first, index)
+    else:
+        value_range = (decoded.pixel_min, decoded.pixel_max)
+    display = _to_display_values(values, decoded.dataset, value_range)
+
+    if dtype.kind == "u":
+        lut = display
+    else:
+        lut = np.zeros(1 << (dtype.itemsize * 8), dtype=np.uint8)
+        lut[positions] = display
+    # Fancy indexing streams the uint16 indices; np.take would first copy
+    # them to a full-size intp array
+    return lut[index]
+
+
+def _convert_array(decoded: DecodedDicom) -> np.ndarray:
+    """Convert arbitrary pixel data to a uint8 RGB array pixel by pixel"""
+    values, changed = _apply_value_transforms(decoded.pixel_array, decoded.dataset)
+    value_range = None if changed else (decoded.pixel_min, decoded.pixel_max)
+    pixel_array = _to_display_values(values, decoded.dataset, value_range)
+
+    # Handle different image dimensions
+    if len(pixel_array.shape) == 2:
+        # Grayscale - convert to RGB
+        rgb_array = np.stack([pixel_array] * 3, axis=-1)
+    elif len(pixel_array.shape) == 3:
+        if pixel_array.shape[2] == 1:
+            # Single channel - convert to RGB
+            rgb_array = np.repeat(pixel_array, 3, axis=2)
+        elif pixel_array.shape[2] == 3:
+            # Already RGB
+            rgb_array = pixel_array
+        else:
+            # Multi-channel - use first 3 channels or convert first channel to RGB
+            if pixel_array.shape[2] >= 3:
+                rgb_array = pixel_array[:, :, :3]
+            else:
+                rgb_array = np.stack([pixel_array[:, :, 0]] * 3, axis=-1)
+    else:
+        raise ValueError(f"Unsupported pixel array shape: {pixel_array.shape}")
+
+    return rgb_array.astype(np.uint8, copy=False)
+
+
+def convert_decoded_dicom(
+    decoded: DecodedDicom, grayscale: bool = False
+) -> Tuple[Image.Image, ImageInfo]:
+    """
+    Convert decoded DICOM pixel data to an image suitable for inference
+
+    Integer grayscale data goes through a lookup table; anything else is
+    converted pixel by pixel.
+
+    Args:
+        decoded: Output of `decode_dicom`
+        grayscale: Return a single-channel image instead of RGB
+
+    Returns:
+        Tuple of (image, image_info)
+
+    Raises:
+        ValueError: If the pixel array has an unsupported shape
+    """
+    dicom_data = decoded.dataset
+
+    gray = _convert_with_lut(decoded)
+    if gray is not None:
+        image = Image.fromarray(gray)
+        if not grayscale:
+            # PIL expands grayscale to RGB without intermediate arrays
+            image = image.convert("RGB")
+    else:
+        image = Image.fromarray(_convert_array(decoded))
+        if grayscale:
+            image = image.convert("L")
+
+    # Create type-safe image info from the values captured at decode time
+    image_info = ImageInfo(
+        original_shape=list(decoded.pixel_array.shape),
+        converted_format="JPEG",
+        converted_size=list(image.size),
+        original_dtype=str(decoded.pixel_array.dtype),
+        pixel_array_min=decoded.pixel_min,
+        pixel_array_max=decoded.pixel_max,
+        photometric_interpretation=getattr(
+            dicom_data, "PhotometricInterpretation", None
+        ),
+        transfer_syntax=decoded.transfer_syntax,
+    )
+
+    return image, image_info
+
+
+def _prepare_decoded(
+    decoded: DecodedDicom, options: Optional[PreprocessOptions]
+) -> Tuple[PreparedImage, ImageInfo]:
+    started = time.perf_counter()
+    image, image_info = convert_decoded_dicom(
+        decoded, grayscale=options is not None and options.grayscale
+    )
+    converted = time.perf_counter() - started
+    prepared = prepare_image(image, options)
+    prepared.timings = {**decoded.timings, "convert": converted, **prepared.timings}
+    image_info.inference_size = [prepared.width, prepared.height]
+    return prepared, image_info
+
+
+def process_dicom(
+    source: Union[str, bytes], options: Optional[PreprocessOptions] = None
+) -> Tuple[DicomMetadata, PreparedImage, ImageInfo]:
+    """
+    Decode a DICOM file, extract its metadata and encode it for inference
+
+    Args:
+        source: Path to the DICOM file or its raw bytes
+        options: Inference preprocessing options; None encodes the image at
+            full resolution
+
+    Returns:
+        Tuple of (metadata, prepared_image, image_info)
+
+    Raises:
+        DicomProcessingException: If the file cannot be parsed or converted
+    """
+    try:
+        decoded = decode_dicom(
+            io.BytesIO(source) if isinstance(source, bytes) else source
+        )
+        metadata = extract_dicom_metadata(decoded.dataset)
+    except Exception as e:
+        logger.error(f"Failed to parse DICOM file: {str(e)}")
+        raise DicomProcessingException(f"Failed to parse DICOM file: {str(e)}")
+
+    try:
+        prepared, image_info = _prepare_decoded(decoded, options)
+        return metadata, prepared, image_info
+    except Exception as e:
+        logger.error(f"Failed to convert DICOM to image: {str(e)}")
+        raise DicomProcessingException(
+            f"Failed to convert DICOM file to image: {str(e)}"
+        )
+
+
+def process_dicom_frame(
+    source: str, index: int, options: Optional[PreprocessOptions] = None
+) -> Tuple[PreparedImage, ImageInfo]:
+    """
+    Decode one frame of a DICOM file and encode it for inference
+
+    Args:
+        source: Path to the DICOM file
+        index: Zero-based frame index
+        options: Inference preprocessing options; None encodes the frame at
+            full resolution
+
+    Returns:
+        Tuple of (prepared_image, image_info)
+
+    Raises:
+        DicomProcessingException: If the frame cannot be decoded or converted
+    """
+    try:
+        decoded = decode_dicom_frame(source, index)
+        return _prepare_decoded(decoded, options)
+    except Exception as e:
+        logger.error(f"Failed to convert DICOM frame {index}: {str(e)}")
+        raise DicomProcessingException(
+            f"Failed to convert frame {index} of DICOM file to image: {str(e)}"
+        )
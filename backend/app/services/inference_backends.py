@@ -0,0 +1,438 @@
+"""
+Inference backends
+
+A backend turns an encoded image into Roboflow-style results
+(`{"predictions": [...], "image": {"width": ..., "height": ...}}`) with
+boxes in the pixel coordinates of the image it was given. The backend used
+for a model is chosen by `Settings.inference_backends`, falling back to
+`Settings.inference_backend`:
+
+- `roboflow`: the hosted Roboflow serverless API, through the pooled async
+  client in `inference_client`
+- `onnx`: an exported model run in-process with ONNX Runtime on the CPU.
+  Requires the optional `onnxruntime` package.
+"""
+
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+import ast
+import asyncio
+import base64
+import io
+import logging
+import threading
+import time
+import uuid
+
+import numpy as np
+from PIL import Image
+
+from ..core.config import Settings, get_settings
+from ..core.executors import WorkerPool, WorkerPools, get_worker_pools
+from .inference_client import get_inference_http_client
+
+logger = logging.getLogger(__name__)
+
+# Accepted inference inputs: a path to an image file or encoded image bytes
+# held in memory
+InferenceInput = Union[str, bytes]
+# Result of one image in a batch: the detections, or why that image failed
+BatchResult = Union[Dict[str, Any], Exception]
+
+# Grey used to pad letterboxed inputs, as in YOLO training pipelines
+LETTERBOX_FILL = (114, 114, 114)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class InferenceBackend(ABC):
+    """Runs a detection model on a single image"""
+
+    name: str
+    # Whether infer_batch runs a batch in one call; micro-batching only
+    # pays off then, otherwise each image waits for the slowest of its batch
+    supports_batching = False
+
+    def __init__(self, settings: Settings, pools: WorkerPools):
+        self.settings = settings
+        self.pools = pools
+
+    @abstractmethod
+    async def infer(self, image: InferenceInput, model_id: str) -> Dict[str, Any]:
+        """Detect conditions in an image, without blocking the event loop"""
+
+    async def infer_batch(
+        self, images: List[InferenceInput], model_id: str
+    ) -> List[BatchResult]:
+        """
+        Detect conditions in several images
+
+        A failing image does not fail the others; its entry holds the error.
+        By default the images are inferred concurrently.
+        """
+        return await asyncio.gather(
+            *(self.infer(image, model_id) for image in images), return_exceptions=True
+        )
+
+    async def warm_up(self, model_id: str) -> None:
+        """Prepare to serve a model, ahead of its first request"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+class RoboflowBackend(InferenceBackend):
+    """Hosted inference through the Roboflow serverless API"""
+
+    name = "roboflow"
+
+    def __init__(self, settings: Settings, pools: WorkerPools):
+        super().__init__(settings, pools)
+        self.client = get_inference_http_client()
+
+    async def infer(self, image: InferenceInput, model_id: str) -> Dict[str, Any]:
+        if isinstance(image, str):
+            image = await self.pools.io.run(_read_file, image)
+        # The API takes the image base64 encoded in the request body
+        return await self.client.infer(
+            base64.b64encode(image).decode("ascii"), model_id
+        )
+
+    async def warm_up(self, model_id: str) -> None:
+        if self.settings.warmup_connections:
+            await self.client.warm_up()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.client.stats()
+
+
+def non_max_suppression(
+    boxes: np.ndarray, scores: np.ndarray, iou_threshold: float
+) -> np.ndarray:
+    """
+    Greedy non-maximum suppression
+
+    Args:
+        boxes: (N, 4) boxes as x1, y1, x2, y2
+        scores: (N,) box scores
+        iou_threshold: Boxes overlapping a kept box by more than this are
+            suppressed
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, highest score first
+    """
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(
+            boxes[best, 0], boxes[rest, 0]
+        )
+        height = np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(
+            boxes[best, 1], boxes[rest, 1]
+        )
+        intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+        iou = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.intp)
+
+
+def _parse_class_names(value: Optional[str]) -> Dict[int, str]:
+    """Class names from the `names` metadata written by YOLO exporters"""
+    if not value:
+        return {}
+    try:
+        names = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return {}
+    if isinstance(names, dict):
+        return {int(k): str(v) for k, v in names.items()}
+    if isinstance(names, (list, tuple)):
+        return {i: str(name) for i, name in enumerate(names)}
+    return {}
+
+
+class OnnxModel:
+    """
+    An exported YOLO-style detection model loaded into an ONNX Runtime session
+
+    The model takes a (B, 3, H, W) float RGB tensor in [0, 1] and returns
+    (B, 4 + classes, N) candidates as centre x, centre y, width, height
+    followed by per-class scores. Models exported with a dynamic batch axis
+    run a whole batch in one call; others run one image at a time. The
+    session is created once and shared by all calls; ONNX Runtime sessions
+    are safe to run concurrently.
+    """
+
+    def __init__(self, path: str, settings: Settings):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = settings.onnx_intra_op_threads
+        options.inter_op_num_threads = settings.onnx_inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        height, width = model_input.shape[2:4]
+        # Dynamic axes are reported as names; use the preprocessing size then
+        self.input_height = (
+            height if isinstance(height, int) else settings.preprocess_max_size
+        )
+        self.input_width = (
+            width if isinstance(width, int) else settings.preprocess_max_size
+        )
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.class_names = _parse_class_names(metadata.get("names"))
+
+        self.confidence_threshold = settings.onnx_confidence_threshold
+        self.iou_threshold = settings.onnx_iou_threshold
+        self.max_detections = settings.onnx_max_detections
+
+    def _letterbox(self, image: Image.Image) -> Tuple[np.ndarray, float, int, int]:
+        """Fit the image into the model input keeping its aspect ratio"""
+        scale = min(self.input_width / image.width, self.input_height / image.height)
+        size = (
+            max(round(image.width * scale), 1),
+            max(round(image.height * scale), 1),
+        )
+        pad_x = (self.input_width - size[0]) // 2
+        pad_y = (self.input_height - size[1]) // 2
+
+        canvas = Image.new("RGB", (self.input_width, self.input_height), LETTERBOX_FILL)
+        canvas.paste(
+            image.convert("RGB").resize(size, Image.Resampling.BILINEAR), (pad_x, pad_y)
+        )
+
+        tensor = np.asarray(canvas, dtype=np.float32).transpose(2, 0, 1)[np.newaxis]
+        tensor = np.ascontiguousarray(tensor) / 255.0
+        return tensor.astype(np.float32, copy=False), scale, pad_x, pad_y
+
+    def predict(self, image: Image.Image) -> Dict[str, Any]:
+        """Run the model and return Roboflow-style results for the image"""
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images: List[Image.Image]) -> List[Dict[str, Any]]:
+        """Run the model on several images, batched if the model allows"""
+        started = time.perf_counter()
+        inputs = [self._letterbox(image) for image in images]
+        if self.dynamic_batch:
+            tensor = np.concatenate([tensor for tensor, *_ in inputs])
+            outputs = self.session.run(None, {self.input_name: tensor})[0]
+            if len(outputs) != len(images):
+                raise ValueError(
+                    f"Model returned {len(outputs)} outputs for {len(images)} images"
+                )
+        else:
+            outputs = [
+                self.session.run(None, {self.input_name: tensor})[0][0]
+                for tensor, *_ in inputs
+            ]
+        elapsed = time.perf_counter() - started
+
+        return [
+            {
+                **self._postprocess(output, image, scale, pad_x, pad_y),
+                "time": elapsed,
+            }
+            for output, image, (_, scale, pad_x, pad_y) in zip(outputs, images, inputs)
+        ]
+
+    def _postprocess(
+        self,
+        output: np.ndarray,
+        image: Image.Image,
+        scale: float,
+        pad_x: int,
+        pad_y: int,
+    ) -> Dict[str, Any]:
+        """Filter, suppress and un-letterbox the candidates for one image"""
+        # (4 + classes, N) -> (N, 4 + classes)
+        candidates = output.T
+        class_scores = candidates[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+
+        selected = scores >= self.confidence_threshold
+        centres = candidates[selected, :4]
+        scores, class_ids = scores[selected], class_ids[selected]
+
+        boxes = np.empty_like(centres)
+        boxes[:, :2] = centres[:, :2] - centres[:, 2:] / 2
+        boxes[:, 2:] = centres[:, :2] + centres[:, 2:] / 2
+        # Offset boxes per class so suppression never crosses classes
+        offsets = class_ids[:, np.newaxis] * float(
+            max(self.input_width, self.input_height) + 1
+        )
+        keep = non_max_suppression(boxes + offsets, scores, self.iou_threshold)
+        keep = keep[: self.max_detections]
+
+        # Undo the letterbox to get coordinates in the given image
+        centres = centres[keep]
+        x = (centres[:, 0] - pad_x) / scale
+        y = (centres[:, 1] - pad_y) / scale
+        widths = centres[:, 2] / scale
+        heights = centres[:, 3] / scale
+
+        predictions = [
+            {
+                "x": round(float(x[i]), 1),
+                "y": round(float(y[i]), 1),
+                "width": round(float(widths[i])),
+                "height": round(float(heights[i])),
+                "confidence": round(float(scores[k]), 3),
+                "class": self.class_names.get(
+                    int(class_ids[k]), str(int(class_ids[k]))
+                ),
+                "class_id": int(class_ids[k]),
+                "detection_id": str(uuid.uuid4()),
+            }
+            for i, k in enumerate(keep)
+        ]
+        return {
+            "predictions": predictions,
+            "image": {"width": image.width, "height": image.height},
+        }
+
+
+class OnnxBackend(InferenceBackend):
+    """In-process inference with ONNX Runtime on the CPU"""
+
+    name = "onnx"
+    supports_batching = True
+
+    def __init__(self, settings: Settings, pools: WorkerPools):
+        super().__init__(settings, pools)
+        # ONNX Runtime releases the GIL, so sessions run on threads; each
+        # call also uses `onnx_intra_op_threads` threads of its own
+        self.pool = WorkerPool(
+            "onnx",
+            max_workers=settings.onnx_max_concurrency,
+            max_queue=settings.onnx_max_queue,
+            use_processes=False,
+        )
+        self._models: Dict[str, OnnxModel] = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model_id: str) -> OnnxModel:
+        """Load the model's session on first use and reuse it afterwards"""
+        with self._lock:
+            model = self._models.get(model_id)
+            if model is None:
+                path = self.settings.onnx_models.get(model_id)
+                if path is None:
+                    raise ValueError(f"No ONNX model configured for {model_id}")
+                logger.info(f"Loading ONNX model {model_id} from {path}")
+                model = self._models[model_id] = OnnxModel(path, self.settings)
+            return model
+
+    def _predict_batch(
+        self, images: List[InferenceInput], model_id: str
+    ) -> List[BatchResult]:
+        model = self._model(model_id)
+        results: List[BatchResult] = []
+        decoded: Dict[int, Image.Image] = {}
+        for position, image in enumerate(images):
+            try:
+                img = Image.open(
+                    io.BytesIO(image) if isinstance(image, bytes) else image
+                )
+                img.load()
+            except Exception as e:
+                results.append(e)
+                continue
+            decoded[position] = img
+            results.append({})
+
+        # Only the images that decoded go through the model
+        if decoded:
+            predictions = model.predict_batch(list(decoded.values()))
+            for position, prediction in zip(decoded, predictions):
+                results[position] = prediction
+        return results
+
+    async def infer(self, image: InferenceInput, model_id: str) -> Dict[str, Any]:
+        result = (await self.infer_batch([image], model_id))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def infer_batch(
+        self, images: List[InferenceInput], model_id: str
+    ) -> List[BatchResult]:
+        return await self.pool.run(self._predict_batch, images, model_id)
+
+    async def warm_up(self, model_id: str) -> None:
+        """Load the model's session and run it once on a blank image"""
+        model = await self.pool.run(self._model, model_id)
+        blank = Image.new("RGB", (model.input_width, model.input_height))
+        await self.pool.run(model.predict, blank)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pool": self.pool.stats(), "loaded_models": sorted(self._models)}
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    RoboflowBackend.name: RoboflowBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+class InferenceBackends:
+    """Selects and lazily creates the backend serving each model"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.pools = get_worker_pools()
+        self._backends: Dict[str, InferenceBackend] = {}
+
+    def backend_name(self, model_id: str) -> str:
+        return self.settings.inference_backends.get(
+            model_id, self.settings.inference_backend
+        )
+
+    def get(self, model_id: str) -> InferenceBackend:
+        """
+        Backend serving a model
+
+        Raises:
+            ValueError: If the configured backend does not exist
+        """
+        name = self.backend_name(model_id)
+        backend = self._backends.get(name)
+        if backend is None:
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown inference backend: {name}")
+            backend = self._backends[name] = BACKENDS[name](self.settings, self.pools)
+        return backend
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: backend.stats() for name, backend in self._backends.items()}
+
+    def close(self) -> None:
+        for backend in self._backends.values():
+            backend.close()
+        self._backends.clear()
+
+
+@lru_cache()
+def get_inference_backends() -> InferenceBackends:
+    return InferenceBackends()
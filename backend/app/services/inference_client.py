@@ -0,0 +1,212 @@
+"""
+Async HTTP client for hosted Roboflow inference
+
+Requests share one `httpx.AsyncClient`, so connections to the inference API
+are pooled and kept alive across requests. The client is created on first
+use and closed by the application lifespan.
+
+Every call has connect and read timeouts. Connection errors, timeouts and
+429/500/502/503/504 responses are retried with jittered exponential backoff;
+inference calls have no side effects, so retrying them is safe. When
+hedging is enabled, a call that has not finished within the configured
+latency percentile of recent calls gets a second, parallel request and the
+first successful response wins.
+"""
+
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, Optional
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+from fastapi import HTTPException
+
+from ..core.config import Settings, get_settings
+from ..core.exceptions import InferenceException
+
+logger = logging.getLogger(__name__)
+
+# The hosted API answers 500 for transient backend failures too, and
+# inference is idempotent, so those are retried as well
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Number of recent call latencies the hedging threshold is computed from
+LATENCY_WINDOW = 256
+
+
+class AsyncInferenceClient:
+    """Pooled async client for the Roboflow hosted inference API"""
+
+    def __init__(self, settings: Settings):
+        self.api_url = settings.roboflow_api_url.rstrip("/")
+        self.api_key = settings.roboflow_api_key
+        self.timeout = httpx.Timeout(
+            settings.inference_read_timeout,
+            connect=settings.inference_connect_timeout,
+        )
+        self.limits = httpx.Limits(
+            max_connections=settings.inference_max_connections,
+            max_keepalive_connections=settings.inference_keepalive_connections,
+            keepalive_expiry=settings.inference_keepalive_expiry,
+        )
+        self.max_retries = settings.inference_max_retries
+        self.backoff = settings.inference_retry_backoff_seconds
+        self.backoff_max = settings.inference_retry_backoff_max_seconds
+        self.hedge_enabled = settings.inference_hedge_enabled
+        self.hedge_percentile = settings.inference_hedge_percentile
+        self.hedge_min_samples = settings.inference_hedge_min_samples
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {
+            "requests": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_url, timeout=self.timeout, limits=self.limits
+            )
+        return self._client
+
+    async def warm_up(self) -> None:
+        """Open a pooled connection to the inference API before the first call"""
+        # Any response leaves the connection open for reuse
+        await self._get_client().head("/")
+
+    async def aclose(self) -> None:
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # Full jitter: uniform over [0, capped exponential backoff]
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2**attempt))
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Latency after which a hedged request is sent, if hedging applies"""
+        if not self.hedge_enabled or len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(
+            int(len(latencies) * self.hedge_percentile / 100), len(latencies) - 1
+        )
+        return latencies[index]
+
+    async def _post(self, image: str, model_id: str) -> Dict[str, Any]:
+        """A single request, retried on transient failures"""
+        client = self._get_client()
+        attempt = 0
+        while True:
+            self._counters["requests"] += 1
+            started = time.perf_counter()
+            try:
+                response = await client.post(
+                    f"/{model_id}",
+                    params={"api_key": self.api_key},
+                    content=image,
+                    headers={"Content-Type": "application/x-www-form-urlencoded"},
+                )
+                retryable = response.status_code in RETRYABLE_STATUS_CODES
+                if not retryable:
+                    response.raise_for_status()
+                    self._latencies.append(time.perf_counter() - started)
+                    return response.json()
+                error: Exception = InferenceException(
+                    f"Inference API returned {response.status_code}"
+                )
+            except httpx.TimeoutException as e:
+                self._counters["timeouts"] += 1
+                error = e
+            except httpx.TransportError as e:
+                error = e
+            except httpx.HTTPStatusError as e:
+                self._counters["errors"] += 1
+                raise InferenceException(
+                    f"Inference API returned {e.response.status_code}: {e.response.text[:200]}"
+                )
+
+            if attempt >= self.max_retries:
+                self._counters["errors"] += 1
+                if isinstance(error, httpx.TimeoutException):
+                    raise HTTPException(
+                        status_code=504, detail="Inference API timed out"
+                    )
+                raise InferenceException(str(error) or type(error).__name__)
+
+            delay = self._backoff_delay(attempt)
+            logger.warning(
+                f"Retrying inference for {model_id} in {delay:.2f}s after: {error!r}"
+            )
+            self._counters["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def infer(self, image: str, model_id: str) -> Dict[str, Any]:
+        """
+        Run hosted inference on a base64 encoded image
+
+        Raises:
+            HTTPException: 504 if the API keeps timing out
+            InferenceException: If the API fails otherwise
+        """
+        primary = asyncio.create_task(self._post(image, model_id))
+        tasks = {primary}
+        try:
+            delay = self._hedge_delay()
+            if delay is None:
+                return await primary
+
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                # Slower than usual: race a second request against the first
+                self._counters["hedged"] += 1
+                tasks.add(asyncio.create_task(self._post(image, model_id)))
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            if error is None:
+                raise InferenceException("No inference request produced a result")
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Request counters and recent latency percentiles"""
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)]
+
+        return {
+            **self._counters,
+            "latency_p50": percentile(50),
+            "latency_p95": percentile(95),
+            "latency_p99": percentile(99),
+            "hedge_delay": self._hedge_delay(),
+        }
+
+
+@lru_cache()
+def get_inference_http_client() -> AsyncInferenceClient:
+    return AsyncInferenceClient(get_settings())
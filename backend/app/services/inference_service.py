@@ -1,26 +1,69 @@
-from inference_sdk import InferenceHTTPClient
+from dataclasses import asdict
 from functools import lru_cache
 from fastapi import HTTPException
+import asyncio
+import io
 import logging
-import pydicom
-import numpy as np
-from PIL import Image
-import tempfile
 import os
-from typing import Dict, Any, Tuple
+import secrets
+import shutil
+from typing import (
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Any,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from ..core.config import get_settings
-from ..models.detection import DicomMetadata, ImageInfo
+from ..core.exceptions import DicomProcessingException, ImageProcessingException
+from ..core.executors import get_worker_pools
+from ..core.timing import record_stage, size_bucket, stage_timer
+from ..models.detection import DicomMetadata, FrameDetectionResult, ImageInfo
+from .cache_service import get_detection_cache, hash_content, make_cache_key
+from .inference_backends import InferenceInput, get_inference_backends
+from .dicom_processing import (
+    CONVERSION_VERSION,
+    process_dicom,
+    process_dicom_frame,
+    read_dicom_metadata,
+    select_frames,
+)
+from .preprocessing import (
+    JPEG_QUALITY,
+    PreparedImage,
+    get_preprocess_options,
+    prepare_image_file,
+    rescale_predictions,
+)
+from .batching import get_inference_batcher
+from .single_flight import get_detection_flights
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
 
-@lru_cache
-def get_roboflow_client(api_key: str):
-    """Create and cache Roboflow client"""
-    client = InferenceHTTPClient(
-        api_url="https://serverless.roboflow.com", api_key=api_key
-    )
-    return client
+
+def _link_file(path: str) -> str:
+    """A second name for the file, next to it, which can be removed separately"""
+    base, extension = os.path.splitext(path)
+    link = f"{base}-{secrets.token_hex(4)}{extension}"
+    try:
+        os.link(path, link)
+    except OSError:
+        # File systems without hard links get a copy
+        shutil.copyfile(path, link)
+    return link
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError as e:
+        logger.warning(f"Failed to delete temporary file {path}: {e}")
 
 
 class InferenceService:
@@ -28,249 +71,261 @@ class InferenceService:
 
     def __init__(self):
         self.settings = get_settings()
+        self.pools = get_worker_pools()
+        self.cache = get_detection_cache()
+        self.backends = get_inference_backends()
+        self.preprocess = get_preprocess_options(self.settings)
+        self.flights = get_detection_flights()
+        self.batcher = get_inference_batcher()
+
+    def use_in_memory(self, content_size: int) -> bool:
+        """Whether an upload of the given size should skip temporary files"""
+        return (
+            self.settings.in_memory_processing
+            and content_size <= self.settings.in_memory_max_bytes
+        )
+
+    async def content_hash(self, content: bytes) -> Optional[str]:
+        """
+        Hash uploaded content for cache lookups and request coalescing
+
+        Returns None if both the cache and coalescing are disabled.
+        """
+        if not (
+            self.settings.detection_cache_enabled or self.settings.coalesce_requests
+        ):
+            return None
+        return await asyncio.to_thread(hash_content, content)
+
+    def _cache_key(
+        self, namespace: str, content_hash: str, model_id: str, *params: Any
+    ) -> str:
+        return make_cache_key(
+            namespace,
+            content_hash,
+            model_id,
+            self.backends.backend_name(model_id),
+            CONVERSION_VERSION,
+            JPEG_QUALITY,
+            asdict(self.preprocess) if self.preprocess else None,
+            *params,
+        )
+
+    async def _cached(self, key: Optional[str]) -> Optional[dict]:
+        if key is None or not self.settings.detection_cache_enabled:
+            return None
+        with stage_timer("cache"):
+            return await self.cache.get(key)
+
+    async def _store(self, key: Optional[str], value: dict) -> None:
+        if key is not None and self.settings.detection_cache_enabled:
+            await self.cache.set(key, value)
+
+    async def _single_flight(
+        self, key: Optional[str], fn: Callable[[], Awaitable[T]]
+    ) -> T:
+        """Share one computation between concurrent requests with the same key"""
+        if key is None or not self.settings.coalesce_requests:
+            return await fn()
+        return await self.flights.run(key, fn)
+
+    async def _single_flight_on_file(
+        self,
+        key: Optional[str],
+        source: Union[str, bytes],
+        fn: Callable[[Union[str, bytes]], Awaitable[T]],
+    ) -> T:
+        """
+        Share work on an uploaded file between concurrent requests
+
+        The shared computation can outlive the request that started it, and
+        that request's temporary file is removed when it ends. A file source
+        is therefore linked under a name owned by the computation, which is
+        removed once the computation is done.
+        """
+        if key is None or not self.settings.coalesce_requests:
+            return await fn(source)
+        if not isinstance(source, str):
+            return await self.flights.run(key, lambda: fn(source))
+
+        def start() -> Awaitable[T]:
+            # Linked before the first await, while the caller's file exists
+            path = _link_file(source)
+            task = asyncio.ensure_future(fn(path))
+            # Runs even if the task is cancelled before it starts
+            task.add_done_callback(lambda _: _remove_file(path))
+            return task
+
+        return await self.flights.run(key, start)
 
     async def detect_dental_conditions(
-        self, image_path: str, model_id: str = "adr/6"
+        self,
+        image: InferenceInput,
+        model_id: str = "adr/6",
+        content_hash: Optional[str] = None,
     ) -> dict:
         """
         Run inference on dental image to detect cavities and periapical lesions
 
+        When preprocessing is enabled the image is downscaled and re-encoded
+        before upload and the detections are mapped back to its original
+        pixel coordinates.
+
         Args:
-            image_path: Path to the image file
+            image: Path to the image file or encoded image bytes
             model_id: Model ID to use for inference
+            content_hash: Hash of the uploaded content; enables the result
+                cache and coalescing of concurrent identical requests
 
         Returns:
-            dict: Inference results from Roboflow
+            dict: Inference results in the Roboflow response format
 
         Raises:
             HTTPException: If inference fails
         """
-        try:
-            client = get_roboflow_client(self.settings.roboflow_api_key)
-            result = client.infer(image_path, model_id=model_id)
+        key = (
+            self._cache_key("detect", content_hash, model_id) if content_hash else None
+        )
+        cached = await self._cached(key)
+        if cached is not None:
+            return cached
+
+        async def detect() -> dict:
+            if self.preprocess is not None:
+                prepared = await self.prepare_image(image)
+                result = await self._infer_prepared(prepared, model_id)
+            else:
+                result = await self._infer(image, model_id)
+
+            await self._store(key, result)
             return result
-        except Exception as e:
-            logger.error(f"Inference failed: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Inference failed: {str(e)}")
 
-    def parse_dicom_metadata(self, dicom_file_path: str) -> DicomMetadata:
-        """
-        Parse DICOM metadata from file
+        return await self._single_flight(key, detect)
 
-        Args:
-            dicom_file_path: Path to the DICOM file
-
-        Returns:
-            DicomMetadata: Parsed metadata
+    async def prepare_image(self, image: InferenceInput) -> PreparedImage:
+        """
+        Downscale and re-encode an uploaded image on the CPU pool
 
         Raises:
-            HTTPException: If DICOM parsing fails
+            HTTPException: If the image cannot be decoded
         """
         try:
-            dicom_data = pydicom.dcmread(dicom_file_path)
-
-            # Extract pixel spacing if available
-            pixel_spacing = None
-            if hasattr(dicom_data, "PixelSpacing"):
-                pixel_spacing = [float(x) for x in dicom_data.PixelSpacing]
-
-            metadata = DicomMetadata(
-                patient_id=getattr(dicom_data, "PatientID", None),
-                patient_name=(
-                    str(getattr(dicom_data, "PatientName", None))
-                    if hasattr(dicom_data, "PatientName")
-                    else None
-                ),
-                patient_birth_date=getattr(dicom_data, "PatientBirthDate", None),
-                patient_sex=getattr(dicom_data, "PatientSex", None),
-                study_date=getattr(dicom_data, "StudyDate", None),
-                study_time=getattr(dicom_data, "StudyTime", None),
-                study_description=getattr(dicom_data, "StudyDescription", None),
-                series_description=getattr(dicom_data, "SeriesDescription", None),
-                modality=getattr(dicom_data, "Modality", None),
-                manufacturer=getattr(dicom_data, "Manufacturer", None),
-                manufacturer_model_name=getattr(
-                    dicom_data, "ManufacturerModelName", None
-                ),
-                rows=getattr(dicom_data, "Rows", None),
-                columns=getattr(dicom_data, "Columns", None),
-                pixel_spacing=pixel_spacing,
-                bits_allocated=getattr(dicom_data, "BitsAllocated", None),
-                bits_stored=getattr(dicom_data, "BitsStored", None),
-                photometric_interpretation=getattr(
-                    dicom_data, "PhotometricInterpretation", None
-                ),
-                acquisition_date=getattr(dicom_data, "AcquisitionDate", None),
-                acquisition_time=getattr(dicom_data, "AcquisitionTime", None),
-                institution_name=getattr(dicom_data, "InstitutionName", None),
-                referring_physician_name=(
-                    str(getattr(dicom_data, "ReferringPhysicianName", None))
-                    if hasattr(dicom_data, "ReferringPhysicianName")
-                    else None
+            prepared = await self.pools.cpu.run(
+                prepare_image_file, image, self.preprocess
+            )
+        except ImageProcessingException as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        self._record_preparation(prepared)
+        return prepared
+
+    def _record_preparation(
+        self, prepared: PreparedImage, image_info: Optional[ImageInfo] = None
+    ) -> None:
+        """Report the stages timed on the worker process for this request"""
+        for stage, seconds in prepared.timings.items():
+            record_stage(
+                stage,
+                seconds,
+                transfer_syntax=image_info.transfer_syntax if image_info else None,
+                size_bucket=size_bucket(
+                    prepared.original_width, prepared.original_height
                 ),
             )
 
-            return metadata
+    async def _infer_prepared(self, prepared: PreparedImage, model_id: str) -> dict:
+        """Run inference on a prepared image and rescale its detections"""
+        result = await self._infer(prepared.content, model_id)
+        return rescale_predictions(result, prepared)
+
+    async def _infer(self, image: InferenceInput, model_id: str) -> dict:
+        """
+        Run inference on the backend serving the model
 
+        With batching enabled and a backend that runs batches in one call,
+        the call joins the next micro-batch for the model instead of going
+        out on its own.
+        """
+        try:
+            with stage_timer("inference", model_id=model_id):
+                if self.settings.inference_batching_enabled:
+                    return await self.batcher.submit(image, model_id)
+                backend = self.backends.get(model_id)
+                return await backend.infer(image, model_id)
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"Failed to parse DICOM metadata: {str(e)}")
-            raise HTTPException(
-                status_code=400, detail=f"Failed to parse DICOM file: {str(e)}"
-            )
+            logger.error(f"Inference failed: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Inference failed: {str(e)}")
 
-    def convert_dicom_to_image(self, dicom_file_path: str) -> Tuple[str, ImageInfo]:
+    async def process_dicom(
+        self, source: Union[str, bytes]
+    ) -> Tuple[DicomMetadata, PreparedImage, ImageInfo]:
         """
-        Convert DICOM file to a standard image format for inference
+        Decode a DICOM file, extract metadata and prepare it for inference
+
+        The work runs on the CPU worker pool. The file is read and its pixels
+        decoded a single time; the decoded result is shared by metadata
+        extraction and image conversion.
 
         Args:
-            dicom_file_path: Path to the DICOM file
+            source: Path to the DICOM file or its raw bytes
 
         Returns:
-            Tuple of (converted_image_path, image_info)
+            Tuple of (metadata, prepared_image, image_info)
 
         Raises:
-            HTTPException: If conversion fails
+            HTTPException: If the file cannot be parsed or converted
         """
         try:
-            dicom_data = pydicom.dcmread(dicom_file_path)
-
-            # Apply modality LUT if present
-            if (
-                hasattr(dicom_data, "ModalityLUTSequence")
-                and dicom_data.ModalityLUTSequence
-            ):
-                try:
-                    from pydicom.pixel_data_handlers.util import apply_modality_lut
-
-                    pixel_array = apply_modality_lut(dicom_data.pixel_array, dicom_data)
-                except Exception as e:
-                    logger.warning(f"Failed to apply modality LUT: {e}")
-                    pixel_array = dicom_data.pixel_array
-            else:
-                pixel_array = dicom_data.pixel_array
+            metadata, prepared, image_info = await self.pools.cpu.run(
+                process_dicom, source, self.preprocess
+            )
+        except DicomProcessingException as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        self._record_preparation(prepared, image_info)
+        return metadata, prepared, image_info
 
-            # Apply VOI LUT if present (windowing)
-            if hasattr(dicom_data, "VOILUTSequence") and dicom_data.VOILUTSequence:
-                try:
-                    from pydicom.pixel_data_handlers.util import apply_voi_lut
-
-                    pixel_array = apply_voi_lut(pixel_array, dicom_data)
-                except Exception as e:
-                    logger.warning(f"Failed to apply VOI LUT: {e}")
-            elif hasattr(dicom_data, "WindowCenter") and hasattr(
-                dicom_data, "WindowWidth"
-            ):
-                # Apply windowing manually
-                try:
-                    window_center = float(
-                        dicom_data.WindowCenter[0]
-                        if isinstance(dicom_data.WindowCenter, list)
-                        else dicom_data.WindowCenter
-                    )
-                    window_width = float(
-                        dicom_data.WindowWidth[0]
-                        if isinstance(dicom_data.WindowWidth, list)
-                        else dicom_data.WindowWidth
-                    )
+    async def read_dicom_metadata(self, source: Union[str, BinaryIO]) -> DicomMetadata:
+        """
+        Read DICOM metadata from the file header only, skipping pixel data
 
-                    # Apply windowing
-                    pixel_array = np.clip(
-                        (pixel_array - (window_center - window_width / 2))
-                        / window_width
-                        * 255,
-                        0,
-                        255,
-                    )
-                except Exception as e:
-                    logger.warning(f"Failed to apply windowing: {e}")
-
-            # Handle photometric interpretation
-            if hasattr(dicom_data, "PhotometricInterpretation"):
-                if dicom_data.PhotometricInterpretation == "MONOCHROME1":
-                    # Invert for MONOCHROME1 (0 = white, max = black)
-                    pixel_array = pixel_array.max() - pixel_array
-
-            # Normalize pixel values to 0-255 range
-            if pixel_array.dtype != np.uint8:
-                # Get the min and max values
-                min_val = pixel_array.min()
-                max_val = pixel_array.max()
-
-                if max_val > min_val:
-                    # Normalize to 0-255
-                    pixel_array = (
-                        (pixel_array - min_val) / (max_val - min_val) * 255
-                    ).astype(np.uint8)
-                else:
-                    # Handle case where all pixels have the same value
-                    pixel_array = np.full(pixel_array.shape, 128, dtype=np.uint8)
-
-            # Handle different image dimensions
-            if len(pixel_array.shape) == 2:
-                # Grayscale - convert to RGB
-                rgb_array = np.stack([pixel_array] * 3, axis=-1)
-            elif len(pixel_array.shape) == 3:
-                if pixel_array.shape[2] == 1:
-                    # Single channel - convert to RGB
-                    rgb_array = np.repeat(pixel_array, 3, axis=2)
-                elif pixel_array.shape[2] == 3:
-                    # Already RGB
-                    rgb_array = pixel_array
-                else:
-                    # Multi-channel - use first 3 channels or convert first channel to RGB
-                    if pixel_array.shape[2] >= 3:
-                        rgb_array = pixel_array[:, :, :3]
-                    else:
-                        rgb_array = np.stack([pixel_array[:, :, 0]] * 3, axis=-1)
-            else:
-                raise ValueError(f"Unsupported pixel array shape: {pixel_array.shape}")
-
-            # Create PIL Image
-            image = Image.fromarray(rgb_array.astype(np.uint8))
-
-            # Save as temporary JPEG file
-            temp_image_fd, temp_image_path = tempfile.mkstemp(suffix=".jpg")
-            os.close(temp_image_fd)
-
-            image.save(temp_image_path, "JPEG", quality=95)
-
-            # Create type-safe image info
-            image_info = ImageInfo(
-                original_shape=list(dicom_data.pixel_array.shape),
-                converted_format="JPEG",
-                converted_size=list(image.size),
-                original_dtype=str(dicom_data.pixel_array.dtype),
-                pixel_array_min=float(dicom_data.pixel_array.min()),
-                pixel_array_max=float(dicom_data.pixel_array.max()),
-                photometric_interpretation=getattr(
-                    dicom_data, "PhotometricInterpretation", None
-                ),
-                transfer_syntax=(
-                    str(dicom_data.file_meta.TransferSyntaxUID)
-                    if hasattr(dicom_data, "file_meta")
-                    and hasattr(dicom_data.file_meta, "TransferSyntaxUID")
-                    else None
-                ),
-            )
+        Args:
+            source: Path to the DICOM file or a file-like object holding it
 
-            return temp_image_path, image_info
+        Returns:
+            DicomMetadata: Parsed metadata
 
-        except Exception as e:
-            logger.error(f"Failed to convert DICOM to image: {str(e)}")
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to convert DICOM file to image: {str(e)}",
-            )
+        Raises:
+            HTTPException: If the header cannot be parsed
+        """
+        try:
+            # Header reads are I/O bound and cheap, a thread is enough
+            with stage_timer("dcmread"):
+                return await asyncio.to_thread(read_dicom_metadata, source)
+        except DicomProcessingException as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     async def detect_dental_conditions_from_dicom(
-        self, dicom_file_path: str, model_id: str = "adr/6"
+        self,
+        source: Union[str, bytes],
+        model_id: str = "adr/6",
+        content_hash: Optional[str] = None,
     ) -> Tuple[dict, DicomMetadata, ImageInfo]:
         """
         Process DICOM file: extract metadata, convert to image, and run inference
 
+        The converted image is kept in memory and never written to disk. When
+        a content hash is given, a cached result for the same file skips
+        pixel decoding and inference, and concurrent requests for the same
+        file share a single decode and inference call. Metadata is not
+        cached, as it identifies the patient; a cache hit reads it from the
+        file header again.
+
         Args:
-            dicom_file_path: Path to the DICOM file
+            source: Path to the DICOM file or its raw bytes
             model_id: Model ID to use for inference
+            content_hash: Hash of the uploaded file; enables the result cache
+                and coalescing of concurrent identical requests
 
         Returns:
             Tuple of (inference_results, metadata, image_info)
@@ -278,34 +333,145 @@ class InferenceService:
         Raises:
             HTTPException: If processing fails
         """
-        converted_image_path = None
-        try:
-            # Parse DICOM metadata
-            metadata = self.parse_dicom_metadata(dicom_file_path)
-
-            # Convert DICOM to image
-            converted_image_path, image_info = self.convert_dicom_to_image(
-                dicom_file_path
+        key = self._cache_key("dicom", content_hash, model_id) if content_hash else None
+        cached = await self._cached(key)
+        if cached is not None:
+            # Patient data is not cached; the header is cheap to read again
+            header = io.BytesIO(source) if isinstance(source, bytes) else source
+            return (
+                cached["inference"],
+                await self.read_dicom_metadata(header),
+                ImageInfo(**cached["image_info"]),
             )
 
+        async def detect(
+            source: Union[str, bytes],
+        ) -> Tuple[dict, DicomMetadata, ImageInfo]:
+            # Decode, extract metadata and convert to image on the CPU pool
+            metadata, prepared, image_info = await self.process_dicom(source)
+
             # Run inference on converted image
-            inference_results = await self.detect_dental_conditions(
-                converted_image_path, model_id
+            inference_results = await self._infer_prepared(prepared, model_id)
+
+            await self._store(
+                key,
+                {
+                    "inference": inference_results,
+                    "image_info": image_info.model_dump(),
+                },
             )
-
             return inference_results, metadata, image_info
 
-        finally:
-            # Clean up converted image file
-            if converted_image_path and os.path.exists(converted_image_path):
+        return await self._single_flight_on_file(key, source, detect)
+
+    async def detect_dental_conditions_from_dicom_frames(
+        self,
+        dicom_file_path: str,
+        model_id: str = "adr/6",
+        start: int = 0,
+        stride: int = 1,
+        max_frames: Optional[int] = None,
+        content_hash: Optional[str] = None,
+    ) -> Tuple[DicomMetadata, int, List[FrameDetectionResult]]:
+        """
+        Run inference on each sampled frame of a multi-frame DICOM file
+
+        Frames are decoded lazily, one per task, straight from the file so
+        the full volume is never materialised. At most
+        `frame_max_concurrency` frames are decoded or inferred at once.
+
+        Args:
+            dicom_file_path: Path to the DICOM file
+            model_id: Model ID to use for inference
+            start: First frame to analyse
+            stride: Analyse every `stride`-th frame
+            max_frames: Maximum number of frames to analyse
+            content_hash: Hash of the uploaded file; enables the result cache
+                and coalescing of concurrent identical requests
+
+        Returns:
+            Tuple of (metadata, number_of_frames, frame_results)
+
+        Raises:
+            HTTPException: If processing fails
+        """
+        limit = min(
+            max_frames or self.settings.frame_max_count, self.settings.frame_max_count
+        )
+
+        key = (
+            self._cache_key("frames", content_hash, model_id, start, stride, limit)
+            if content_hash
+            else None
+        )
+        cached = await self._cached(key)
+        if cached is not None:
+            return (
+                await self.read_dicom_metadata(dicom_file_path),
+                cached["number_of_frames"],
+                [FrameDetectionResult(**frame) for frame in cached["frames"]],
+            )
+
+        return await self._single_flight_on_file(
+            key,
+            dicom_file_path,
+            lambda path: self._detect_frames(path, model_id, start, stride, limit, key),
+        )
+
+    async def _detect_frames(
+        self,
+        dicom_file_path: str,
+        model_id: str,
+        start: int,
+        stride: int,
+        limit: int,
+        key: Optional[str],
+    ) -> Tuple[DicomMetadata, int, List[FrameDetectionResult]]:
+        metadata = await self.read_dicom_metadata(dicom_file_path)
+        number_of_frames = metadata.number_of_frames or 1
+
+        semaphore = asyncio.Semaphore(self.settings.frame_max_concurrency)
+
+        async def detect_frame(index: int) -> FrameDetectionResult:
+            async with semaphore:
                 try:
-                    os.unlink(converted_image_path)
-                except OSError as e:
-                    logger.warning(
-                        f"Failed to delete converted image file {converted_image_path}: {e}"
+                    prepared, image_info = await self.pools.cpu.run(
+                        process_dicom_frame, dicom_file_path, index, self.preprocess
                     )
+                except DicomProcessingException as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                self._record_preparation(prepared, image_info)
+
+                inference_results = await self._infer_prepared(prepared, model_id)
+                return FrameDetectionResult(
+                    frame_index=index,
+                    predictions=inference_results.get("predictions", []),
+                    image_info=image_info,
+                )
+
+        # A failing frame cancels the remaining ones
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [
+                    group.create_task(detect_frame(index))
+                    for index in select_frames(number_of_frames, start, stride, limit)
+                ]
+        except ExceptionGroup as e:
+            raise e.exceptions[0]
+        frames = [task.result() for task in tasks]
+
+        await self._store(
+            key,
+            {
+                "number_of_frames": number_of_frames,
+                "frames": [frame.model_dump(by_alias=True) for frame in frames],
+            },
+        )
+
+        return metadata, number_of_frames, frames
 
 
 # Dependency function to get inference service
+@lru_cache()
 def get_inference_service() -> InferenceService:
     return InferenceService()
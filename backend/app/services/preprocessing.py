@@ -0,0 +1,227 @@
+"""
+Inference-aware image preprocessing
+
+The upstream model resizes every image to its own input resolution, so
+sending it more pixels than that only costs upload time. Before inference,
+images are downscaled to the model input size and JPEG-encoded (optionally
+as grayscale) at the highest quality that fits a byte budget. Detections
+are returned in the coordinates of the image that was sent and are scaled
+back to the original pixel coordinates with `rescale_predictions`.
+
+Everything here takes and returns picklable values so it can run on a
+worker process.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Union
+import io
+import os
+import time
+
+from PIL import Image, UnidentifiedImageError
+
+from ..core.config import Settings
+from ..core.exceptions import ImageProcessingException
+
+JPEG_QUALITY = 95
+# Quality is lowered in these steps until the encoded image fits the budget
+QUALITY_STEP = 10
+
+
+@dataclass(frozen=True)
+class PreprocessOptions:
+    """How images are prepared before they are sent for inference"""
+
+    max_size: int
+    grayscale: bool
+    max_bytes: int
+    quality: int
+    min_quality: int
+
+
+@dataclass
+class PreparedImage:
+    """Encoded image to send for inference and its original dimensions"""
+
+    content: bytes
+    width: int
+    height: int
+    original_width: int
+    original_height: int
+    # Seconds spent in each preparation stage, reported as request timings
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def scale_x(self) -> float:
+        return self.original_width / self.width
+
+    @property
+    def scale_y(self) -> float:
+        return self.original_height / self.height
+
+    @property
+    def resized(self) -> bool:
+        return (self.width, self.height) != (
+            self.original_width,
+            self.original_height,
+        )
+
+
+def get_preprocess_options(settings: Settings) -> Optional[PreprocessOptions]:
+    """Preprocessing options from settings, or None if preprocessing is off"""
+    if not settings.preprocess_enabled:
+        return None
+    return PreprocessOptions(
+        max_size=settings.preprocess_max_size,
+        grayscale=settings.preprocess_grayscale,
+        max_bytes=settings.preprocess_max_bytes,
+        quality=settings.preprocess_quality,
+        min_quality=settings.preprocess_min_quality,
+    )
+
+
+def encode_image(image: Image.Image, quality: int = JPEG_QUALITY) -> bytes:
+    """Encode an image as JPEG into an in-memory buffer"""
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def encode_within_budget(image: Image.Image, options: PreprocessOptions) -> bytes:
+    """
+    Encode at the highest quality whose output fits `options.max_bytes`
+
+    Falls back to `options.min_quality` if no quality fits the budget.
+    """
+    quality = options.quality
+    content = encode_image(image, quality)
+    while len(content) > options.max_bytes and quality > options.min_quality:
+        quality = max(quality - QUALITY_STEP, options.min_quality)
+        content = encode_image(image, quality)
+    return content
+
+
+def prepare_image(
+    image: Image.Image, options: Optional[PreprocessOptions]
+) -> PreparedImage:
+    """
+    Downscale and encode an image for inference
+
+    Args:
+        image: Image at its original resolution
+        options: Preprocessing options; None encodes the image unchanged at
+            `JPEG_QUALITY`
+
+    Returns:
+        PreparedImage: The encoded image and the original dimensions
+    """
+    started = time.perf_counter()
+    original_width, original_height = image.size
+    if options is None:
+        return PreparedImage(
+            content=encode_image(image),
+            width=original_width,
+            height=original_height,
+            original_width=original_width,
+            original_height=original_height,
+            timings={"encode": time.perf_counter() - started},
+        )
+
+    if options.grayscale and image.mode != "L":
+        image = image.convert("L")
+    elif image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+
+    longest = max(original_width, original_height)
+    if longest > options.max_size:
+        scale = options.max_size / longest
+        size = (
+            max(round(original_width * scale), 1),
+            max(round(original_height * scale), 1),
+        )
+        image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+    return PreparedImage(
+        content=encode_within_budget(image, options),
+        width=image.width,
+        height=image.height,
+        original_width=original_width,
+        original_height=original_height,
+        timings={"encode": time.perf_counter() - started},
+    )
+
+
+def prepare_image_file(
+    source: Union[str, bytes], options: PreprocessOptions
+) -> PreparedImage:
+    """
+    Prepare an uploaded image for inference
+
+    Uploads that already fit the model input size and byte budget are sent
+    as they are, without re-encoding.
+
+    Args:
+        source: Path to the image file or its encoded bytes
+
+    Raises:
+        ImageProcessingException: If the image cannot be decoded
+    """
+    try:
+        with Image.open(
+            io.BytesIO(source) if isinstance(source, bytes) else source
+        ) as image:
+            width, height = image.size
+            size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+            if max(width, height) <= options.max_size and size <= options.max_bytes:
+                if isinstance(source, str):
+                    with open(source, "rb") as f:
+                        source = f.read()
+                return PreparedImage(
+                    content=source,
+                    width=width,
+                    height=height,
+                    original_width=width,
+                    original_height=height,
+                )
+            started = time.perf_counter()
+            image.load()
+            decoded = time.perf_counter() - started
+            prepared = prepare_image(image, options)
+            prepared.timings = {"decode": decoded, **prepared.timings}
+            return prepared
+    except UnidentifiedImageError:
+        raise ImageProcessingException("Failed to read image: unrecognised format")
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageProcessingException(f"Failed to read image: {str(e)}")
+
+
+def rescale_predictions(
+    result: Dict[str, Any], prepared: PreparedImage
+) -> Dict[str, Any]:
+    """
+    Map detections on a prepared image back to original pixel coordinates
+
+    Returns a new result; the given one is not modified.
+    """
+    if not prepared.resized:
+        return result
+
+    scale_x, scale_y = prepared.scale_x, prepared.scale_y
+    rescaled = dict(result)
+    rescaled["predictions"] = [
+        {
+            **prediction,
+            "x": prediction["x"] * scale_x,
+            "y": prediction["y"] * scale_y,
+            "width": round(prediction["width"] * scale_x),
+            "height": round(prediction["height"] * scale_y),
+        }
+        for prediction in result.get("predictions", [])
+    ]
+    if isinstance(result.get("image"), dict):
+        rescaled["image"] = {
+            **result["image"],
+            "width": prepared.original_width,
+            "height": prepared.original_height,
+        }
+    return rescaled
@@ -0,0 +1,544 @@
+"""
+Queued diagnostic report generation
+
+Report requests are stored as jobs in a SQLite database under `cache_dir`
+and answered at once with a job ID, instead of holding a connection open for
+the whole completion. A bounded pool of workers on the event loop claims
+queued jobs oldest first, so report throughput is set by the worker count
+rather than by how many connections clients keep open. Clients poll for the
+result, long-poll for it with `wait`, or receive it at the configured
+webhook. Requests submitted in this process are handed to the worker as the
+validated models, so only jobs resumed from the store are parsed again.
+
+A failed generation is retried up to `report_job_max_attempts` times and
+then marks the job failed; jobs never complete with the fallback report of
+the synchronous endpoint.
+
+Jobs survive restarts. Jobs running at shutdown are queued again, and a job
+whose worker went away without that, such as in a crash, is claimed again
+once it has run for longer than `report_job_timeout_seconds`. A job is
+claimed in a single transaction, so the workers of several server processes
+can share one store; workers poll it for jobs submitted elsewhere.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException
+import httpx
+
+from ..core.config import Settings, get_settings
+from ..core.metrics import HistogramFamily, get_metrics_registry
+from ..models.detection import (
+    DiagnosticReportRequest,
+    DiagnosticReportResponse,
+    ReportJob,
+)
+from .diagnostic_service import get_diagnostic_report_service
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds, in seconds, for queue waits and report generation
+JOB_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Extra time a running job gets before another worker may claim it, so a
+# worker that is about to time out is not raced
+STALE_GRACE_SECONDS = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    webhook_status TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS report_jobs_status ON report_jobs (status, created_at);
+"""
+
+
+def get_job_wait() -> HistogramFamily:
+    return get_metrics_registry().histogram(
+        "dobbe_report_job_wait_seconds",
+        "Time report jobs spent queued before a worker started them",
+        (),
+        JOB_BUCKETS,
+    )
+
+
+def get_job_duration() -> HistogramFamily:
+    return get_metrics_registry().histogram(
+        "dobbe_report_job_duration_seconds",
+        "Time workers spent generating the report of a job",
+        ("status",),
+        JOB_BUCKETS,
+    )
+
+
+class ReportJobStore:
+    """
+    SQLite persistence of report jobs
+
+    Methods block on the database, so call them off the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def insert(self, job_id: str, request: str, created_at: float) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO report_jobs (job_id, status, request, created_at)"
+                " VALUES (?, 'queued', ?, ?)",
+                (job_id, request, created_at),
+            )
+
+    def get(self, job_id: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT * FROM report_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+
+    def claim(
+        self, now: float, stale_before: float, max_attempts: int
+    ) -> Optional[sqlite3.Row]:
+        """
+        Mark the oldest claimable job running and return it
+
+        Queued jobs are claimable, and so are jobs that started before
+        `stale_before` and are still running, as their worker is gone. Stale
+        jobs that used up their attempts are failed instead.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    job = self._connection.execute(
+                        "SELECT job_id, attempts FROM report_jobs"
+                        " WHERE status = 'queued'"
+                        " OR (status = 'running' AND started_at < ?)"
+                        " ORDER BY created_at LIMIT 1",
+                        (stale_before,),
+                    ).fetchone()
+                    if job is None or job["attempts"] < max_attempts:
+                        break
+                    self._connection.execute(
+                        "UPDATE report_jobs SET status = 'failed', error = ?,"
+                        " finished_at = ? WHERE job_id = ?",
+                        (
+                            f"Abandoned after {job['attempts']} attempts",
+                            now,
+                            job["job_id"],
+                        ),
+                    )
+
+                claimed = None
+                if job is not None:
+                    self._connection.execute(
+                        "UPDATE report_jobs SET status = 'running', started_at = ?,"
+                        " attempts = attempts + 1 WHERE job_id = ?",
+                        (now, job["job_id"]),
+                    )
+                    claimed = self._connection.execute(
+                        "SELECT * FROM report_jobs WHERE job_id = ?", (job["job_id"],)
+                    ).fetchone()
+                self._connection.execute("COMMIT")
+                return claimed
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def requeue(self, job_ids: List[str], refund_attempt: bool = False) -> None:
+        """Queue running jobs again, optionally not counting their attempt"""
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE report_jobs SET status = 'queued', started_at = NULL,"
+                " attempts = attempts - ? WHERE job_id = ? AND status = 'running'",
+                [(int(refund_attempt), job_id) for job_id in job_ids],
+            )
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[str],
+        error: Optional[str],
+        finished_at: float,
+        webhook_status: Optional[str],
+    ) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE report_jobs SET status = ?, result = ?, error = ?,"
+                " finished_at = ?, webhook_status = ? WHERE job_id = ?",
+                (status, result, error, finished_at, webhook_status, job_id),
+            )
+
+    def set_webhook_status(self, job_id: str, webhook_status: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE report_jobs SET webhook_status = ? WHERE job_id = ?",
+                (webhook_status, job_id),
+            )
+
+    def pending_webhooks(self) -> List[str]:
+        """Finished jobs whose webhook was not delivered before a restart"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT job_id FROM report_jobs WHERE webhook_status = 'pending'"
+                " AND finished_at IS NOT NULL"
+            ).fetchall()
+        return [row["job_id"] for row in rows]
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM report_jobs WHERE status = ?", (status,)
+            ).fetchone()[0]
+
+    def prune(self, finished_before: float) -> int:
+        """Delete jobs that finished before the given time"""
+        with self._lock:
+            return self._connection.execute(
+                "DELETE FROM report_jobs WHERE finished_at < ?", (finished_before,)
+            ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def _timestamp(value: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+def _to_report_job(row: sqlite3.Row) -> ReportJob:
+    return ReportJob(
+        job_id=row["job_id"],
+        status=row["status"],
+        created_at=_timestamp(row["created_at"]),
+        started_at=_timestamp(row["started_at"]),
+        finished_at=_timestamp(row["finished_at"]),
+        attempts=row["attempts"],
+        result=(
+            DiagnosticReportResponse.model_validate_json(row["result"])
+            if row["result"]
+            else None
+        ),
+        error=row["error"],
+        webhook_status=row["webhook_status"],
+    )
+
+
+class ReportJobQueue:
+    """Report jobs in a persistent store, drained by a bounded worker pool"""
+
+    def __init__(self, store: ReportJobStore, settings: Settings):
+        self.store = store
+        self.settings = settings
+        self.workers = settings.report_job_workers
+        self.max_queue = settings.report_job_max_queue
+
+        self._workers: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        # Jobs this process is running, queued again on shutdown
+        self._running: Set[str] = set()
+        # Keeps webhook deliveries referenced until they finish
+        self._deliveries: Set[asyncio.Task] = set()
+        # Requests submitted here, for the worker instead of the stored JSON
+        self._requests: OrderedDict[str, DiagnosticReportRequest] = OrderedDict()
+        # Notified whenever this process finishes a job
+        self._finished = asyncio.Condition()
+        self._last_pruned = 0.0
+
+        self._counters = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "retried": 0,
+            "webhooks_delivered": 0,
+            "webhooks_failed": 0,
+        }
+
+    async def start(self) -> None:
+        """Start the workers and resume webhooks interrupted by a restart"""
+        if self._workers:
+            return
+        self._wake = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"report-job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        if self.settings.report_job_webhook_url:
+            for job_id in await asyncio.to_thread(self.store.pending_webhooks):
+                self._deliver(job_id)
+
+    async def stop(self) -> None:
+        """Stop the workers, queueing their jobs again for the next start"""
+        tasks = self._workers + list(self._deliveries)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        if self._running:
+            await asyncio.to_thread(
+                self.store.requeue, list(self._running), refund_attempt=True
+            )
+            self._running.clear()
+
+    async def submit(self, request: DiagnosticReportRequest) -> ReportJob:
+        """
+        Queue a report job
+
+        Raises:
+            HTTPException: 503 if `report_job_max_queue` jobs are queued
+        """
+        await self.start()
+        queued = await asyncio.to_thread(self.store.count, "queued")
+        if queued >= self.max_queue:
+            self._counters["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Report job queue is full ({queued} jobs), please retry",
+                headers={"Retry-After": "30"},
+            )
+
+        job_id = uuid.uuid4().hex
+        created_at = time.time()
+        await asyncio.to_thread(
+            self.store.insert,
+            job_id,
+            request.model_dump_json(by_alias=True),
+            created_at,
+        )
+        self._counters["submitted"] += 1
+        self._requests[job_id] = request
+        while len(self._requests) > self.max_queue:
+            self._requests.popitem(last=False)
+        self._wake.set()
+        return ReportJob(
+            job_id=job_id, status="queued", created_at=_timestamp(created_at)
+        )
+
+    async def get(self, job_id: str) -> Optional[ReportJob]:
+        row = await asyncio.to_thread(self.store.get, job_id)
+        return _to_report_job(row) if row is not None else None
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[ReportJob]:
+        """
+        A job once it has finished, or as it is after `timeout` seconds
+
+        Jobs finished in this process are returned at once; jobs run by other
+        processes sharing the store are checked every `report_job_poll_seconds`.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job.status in ("completed", "failed") or remaining <= 0:
+                return job
+            async with self._finished:
+                try:
+                    await asyncio.wait_for(
+                        self._finished.wait(),
+                        min(remaining, self.settings.report_job_poll_seconds),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _work(self) -> None:
+        timeout = self.settings.report_job_timeout_seconds
+        while True:
+            # Cleared before claiming, so a job submitted after an empty
+            # claim still wakes the worker
+            self._wake.clear()
+            now = time.time()
+            job = await asyncio.to_thread(
+                self.store.claim,
+                now,
+                now - timeout - STALE_GRACE_SECONDS,
+                self.settings.report_job_max_attempts,
+            )
+            if job is None:
+                await self._prune()
+                try:
+                    await asyncio.wait_for(
+                        self._wake.wait(), self.settings.report_job_poll_seconds
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"Report job {job['job_id']} failed unexpectedly: {e}")
+
+    async def _run(self, job: sqlite3.Row) -> None:
+        job_id = job["job_id"]
+        get_job_wait().labels().observe(job["started_at"] - job["created_at"])
+        self._running.add(job_id)
+        try:
+            request = self._requests.get(
+                job_id
+            ) or DiagnosticReportRequest.model_validate_json(job["request"])
+            diagnostic_report = await asyncio.wait_for(
+                get_diagnostic_report_service().generate_diagnostic_report(
+                    detections=request.predictions,
+                    metadata=request.metadata,
+                    image_info=request.image_info,
+                    fallback=False,
+                ),
+                self.settings.report_job_timeout_seconds,
+            )
+            result = DiagnosticReportResponse(
+                diagnostic_report=diagnostic_report,
+                detections_used=request.predictions,
+                metadata=request.metadata,
+            ).model_dump_json(by_alias=True)
+            status, error = "completed", None
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if job["attempts"] < self.settings.report_job_max_attempts:
+                logger.warning(f"Retrying report job {job_id}: {error}")
+                self._counters["retried"] += 1
+                self._running.discard(job_id)
+                await asyncio.to_thread(self.store.requeue, [job_id])
+                return
+            logger.error(f"Report job {job_id} failed: {error}")
+            status, result = "failed", None
+        # Not on cancellation, so stop() queues the job again
+        self._running.discard(job_id)
+        self._requests.pop(job_id, None)
+
+        finished_at = time.time()
+        get_job_duration().labels(status=status).observe(
+            finished_at - job["started_at"]
+        )
+        self._counters[status] += 1
+        webhook = self.settings.report_job_webhook_url
+        await asyncio.to_thread(
+            self.store.finish,
+            job_id,
+            status,
+            result,
+            error,
+            finished_at,
+            "pending" if webhook else None,
+        )
+        async with self._finished:
+            self._finished.notify_all()
+        if webhook:
+            self._deliver(job_id)
+
+    def _deliver(self, job_id: str) -> None:
+        """POST a finished job to the webhook in the background"""
+        task = asyncio.create_task(self._post_webhook(job_id))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+
+    async def _post_webhook(self, job_id: str) -> None:
+        job = await self.get(job_id)
+        if job is None:
+            return
+        body = job.model_dump_json(by_alias=True).encode()
+        headers = {"Content-Type": "application/json"}
+        secret = self.settings.report_job_webhook_secret
+        if secret:
+            signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Dobbe-Signature"] = f"sha256={signature}"
+
+        max_attempts = self.settings.report_job_webhook_max_attempts
+        webhook_status = "failed"
+        async with httpx.AsyncClient(
+            timeout=self.settings.report_job_webhook_timeout
+        ) as client:
+            for attempt in range(max_attempts):
+                try:
+                    response = await client.post(
+                        self.settings.report_job_webhook_url,
+                        content=body,
+                        headers=headers,
+                    )
+                    if response.is_success:
+                        webhook_status = "delivered"
+                        break
+                    reason = f"status {response.status_code}"
+                except httpx.HTTPError as e:
+                    reason = str(e) or type(e).__name__
+                logger.warning(
+                    f"Webhook for report job {job_id} failed"
+                    f" (attempt {attempt + 1}/{max_attempts}): {reason}"
+                )
+                if attempt + 1 < max_attempts:
+                    await asyncio.sleep(2**attempt)
+
+        self._counters[f"webhooks_{webhook_status}"] += 1
+        await asyncio.to_thread(self.store.set_webhook_status, job_id, webhook_status)
+
+    async def _prune(self) -> None:
+        """Delete expired finished jobs, at most once a minute"""
+        now = time.time()
+        if now - self._last_pruned < 60:
+            return
+        self._last_pruned = now
+        pruned = await asyncio.to_thread(
+            self.store.prune, now - self.settings.report_job_ttl_seconds
+        )
+        if pruned:
+            logger.info(f"Pruned {pruned} expired report jobs")
+
+    async def stats(self) -> Dict[str, Any]:
+        """Queue depth, worker usage, outcomes and wait/duration histograms"""
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued": await asyncio.to_thread(self.store.count, "queued"),
+            "max_queue": self.max_queue,
+            **self._counters,
+            "wait_seconds": get_job_wait().labels().snapshot(),
+            "duration_seconds": {
+                status: get_job_duration().labels(status=status).snapshot()
+                for status in ("completed", "failed")
+            },
+        }
+
+
+@lru_cache()
+def get_report_job_queue() -> ReportJobQueue:
+    """Report job queue persisted in the cache directory"""
+    settings = get_settings()
+    path = os.path.join(settings.cache_dir, "report_jobs.sqlite3")
+    try:
+        Path(settings.cache_dir).mkdir(parents=True, exist_ok=True)
+        store = ReportJobStore(path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Report jobs will not survive restarts, {path} failed: {e}")
+        store = ReportJobStore(":memory:")
+    return ReportJobQueue(store, settings)
@@ -0,0 +1,211 @@
+"""
+Compact, token-budgeted encoding of detections for the report prompt
+
+Detections are written as one small table per class, grouped by image
+region, with positions and sizes in millimetres when the pixel spacing is
+known. Fields the model has no use for, such as detection and class IDs,
+are left out. When the table would exceed its token budget it is
+summarised deterministically, first to one row per class and region, then
+to counts per class, so the prompt and with it LLM latency stay bounded
+however many findings an image has.
+
+Token counts are estimated from the text length, which is deterministic
+and needs no tokenizer download; the API reports actual usage.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import math
+
+from ..core.metrics import HistogramFamily, get_metrics_registry
+from ..models.detection import Detection, DicomMetadata
+
+# Conservative for digit-heavy tables, English prose runs closer to 4
+CHARS_PER_TOKEN = 3
+
+# Bucket upper bounds for prompt token counts
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Image regions: thirds across and halves down the image
+COLUMNS = ("left", "centre", "right")
+ROWS = ("upper", "lower")
+
+
+def get_prompt_tokens() -> HistogramFamily:
+    return get_metrics_registry().histogram(
+        "dobbe_report_prompt_tokens",
+        "Prompt tokens of report completions",
+        ("model_id", "encoding"),
+        TOKEN_BUCKETS,
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimated prompt tokens of a text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass(frozen=True)
+class EncodedDetections:
+    """
+    Detections as prompt text
+
+    `level` is how far the detections were summarised to fit the budget:
+    `table` (every detection), `grouped` (one row per class and region)
+    or `counts` (one count per class).
+    """
+
+    text: str
+    level: str
+    tokens: int
+
+
+@dataclass(frozen=True)
+class _Geometry:
+    """Image size in pixels and millimetres per pixel, if known"""
+
+    width: Optional[float]
+    height: Optional[float]
+    spacing: Optional[Tuple[float, float]]  # (x, y) in mm per pixel
+
+    @property
+    def unit(self) -> str:
+        return "mm" if self.spacing else "px"
+
+    def length(self, pixels: float, axis: int) -> str:
+        if self.spacing:
+            return f"{pixels * self.spacing[axis]:.1f}"
+        return f"{round(pixels)}"
+
+    def region(self, detection: Detection) -> str:
+        if not self.width or not self.height:
+            return "unknown"
+        column = min(int(3 * detection.x / self.width), 2)
+        row = min(int(2 * detection.y / self.height), 1)
+        return f"{ROWS[max(row, 0)]} {COLUMNS[max(column, 0)]}"
+
+
+def image_geometry(
+    detections: Sequence[Detection],
+    metadata: Optional[DicomMetadata],
+    image_info: Optional[Dict[str, Any]],
+) -> _Geometry:
+    """
+    Size of the image the detections refer to, and its pixel spacing
+
+    The size comes from the converted image, the DICOM dimensions or, failing
+    those, the extent of the detections. DICOM pixel spacing is given per
+    row and column of the original image, so it is rescaled if the image was
+    resized.
+    """
+    width = height = None
+    original = None
+    if image_info:
+        if image_info.get("converted_size"):
+            width, height = image_info["converted_size"][:2]
+        if image_info.get("original_shape"):
+            original = image_info["original_shape"][:2]  # rows, columns
+    if metadata and metadata.rows and metadata.columns:
+        original = original or [metadata.rows, metadata.columns]
+    if width is None and original:
+        height, width = original
+    if width is None and detections:
+        width = max(d.x + d.width / 2 for d in detections)
+        height = max(d.y + d.height / 2 for d in detections)
+
+    spacing = None
+    if metadata and metadata.pixel_spacing and len(metadata.pixel_spacing) >= 2:
+        row_spacing, column_spacing = metadata.pixel_spacing[:2]
+        if original and width and height:
+            column_spacing *= original[1] / width
+            row_spacing *= original[0] / height
+        spacing = (column_spacing, row_spacing)
+    return _Geometry(width, height, spacing)
+
+
+def _table(
+    groups: Dict[str, Dict[str, List[Detection]]], geometry: _Geometry
+) -> List[str]:
+    unit = geometry.unit
+    lines = []
+    for name, regions in groups.items():
+        lines.append(f"[{name}] {sum(len(d) for d in regions.values())}")
+        lines.append(f"region|x,y {unit}|w x h {unit}|conf %")
+        for region, detections in regions.items():
+            for d in detections:
+                lines.append(
+                    f"{region}|{geometry.length(d.x, 0)},{geometry.length(d.y, 1)}"
+                    f"|{geometry.length(d.width, 0)}x{geometry.length(d.height, 1)}"
+                    f"|{round(d.confidence * 100)}"
+                )
+    return lines
+
+
+def _grouped(
+    groups: Dict[str, Dict[str, List[Detection]]], geometry: _Geometry
+) -> List[str]:
+    unit = geometry.unit
+    lines = []
+    for name, regions in groups.items():
+        lines.append(f"[{name}] {sum(len(d) for d in regions.values())}")
+        lines.append(f"region|count|conf % min-max|largest w x h {unit}")
+        for region, detections in regions.items():
+            confidences = [round(d.confidence * 100) for d in detections]
+            largest = max(detections, key=lambda d: (d.width * d.height, d.x, d.y))
+            lines.append(
+                f"{region}|{len(detections)}|{min(confidences)}-{max(confidences)}"
+                f"|{geometry.length(largest.width, 0)}x{geometry.length(largest.height, 1)}"
+            )
+    return lines
+
+
+def encode_detections(
+    detections: Sequence[Detection],
+    metadata: Optional[DicomMetadata] = None,
+    image_info: Optional[Dict[str, Any]] = None,
+    token_budget: Optional[int] = None,
+) -> EncodedDetections:
+    """
+    Encode detections for the report prompt within a token budget
+
+    Detections are ordered canonically and rounded to the precision shown,
+    so cosmetically different requests produce the same text.
+    """
+    if not detections:
+        text = "No significant findings detected in the image."
+        return EncodedDetections(text, "table", estimate_tokens(text))
+
+    geometry = image_geometry(detections, metadata, image_info)
+    ordered = sorted(
+        detections, key=lambda d: (d.class_, round(d.y), round(d.x), d.detection_id)
+    )
+    groups: Dict[str, Dict[str, List[Detection]]] = defaultdict(
+        lambda: defaultdict(list)
+    )
+    for detection in ordered:
+        groups[detection.class_][geometry.region(detection)].append(detection)
+    for name in groups:
+        groups[name] = dict(sorted(groups[name].items()))
+
+    header = [f"{len(ordered)} findings"]
+    if geometry.width and geometry.height:
+        header.append(
+            f"image {geometry.length(geometry.width, 0)}x"
+            f"{geometry.length(geometry.height, 1)} {geometry.unit}"
+        )
+    header.append("region = upper/lower half, left/centre/right third of the image")
+    preamble = "; ".join(header)
+
+    for level, encode in (("table", _table), ("grouped", _grouped)):
+        text = "\n".join([preamble, *encode(groups, geometry)])
+        tokens = estimate_tokens(text)
+        if token_budget is None or tokens <= token_budget:
+            return EncodedDetections(text, level, tokens)
+
+    counts = ", ".join(
+        f"{name} {sum(len(d) for d in regions.values())}"
+        for name, regions in groups.items()
+    )
+    text = f"{preamble}\n{counts}\n(per-finding detail omitted to fit the prompt)"
+    return EncodedDetections(text, "counts", estimate_tokens(text))
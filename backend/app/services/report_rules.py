@@ -0,0 +1,157 @@
+"""
+Rule-based reports for routine inputs
+
+Reports for routine inputs are essentially templated, so inputs matching the
+configured rules get a deterministic report without an LLM call: no
+detections at all, or at most `report_rules_max_detections` findings whose
+classes all appear in `report_rules_classes`, each detected with at least
+`report_rules_min_confidence`. Anything else escalates to the LLM.
+"""
+
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from ..core.config import get_settings
+from ..models.detection import Detection, DicomMetadata, DiagnosticReport
+
+SEVERITY_ORDER = ("low", "moderate", "high")
+
+RECOMMENDATIONS = {
+    "low": [
+        "Continue routine dental check-ups",
+        "Professional review of the radiograph is recommended",
+    ],
+    "moderate": [
+        "Schedule a dental consultation to confirm the findings",
+        "Clinical examination of the affected area",
+        "Professional radiographic interpretation is recommended",
+    ],
+    "high": [
+        "Schedule a prompt dental consultation",
+        "Clinical and radiographic evaluation of the affected tooth",
+        "Professional radiographic interpretation is recommended",
+    ],
+}
+
+
+def _class_key(name: str) -> str:
+    """Class names compared case-insensitively, `_` and `-` as spaces"""
+    return name.lower().replace("_", " ").replace("-", " ").strip()
+
+
+class RuleBasedReportGenerator:
+    """
+    Templated reports for inputs within configurable rules
+
+    Args:
+        max_detections: Most findings a routine input may have
+        min_confidence: Lowest confidence of any finding of a routine input
+        class_severity: Severity of each class routine inputs may contain
+
+    Raises:
+        ValueError: If a severity is not low, moderate or high
+    """
+
+    def __init__(
+        self,
+        max_detections: int,
+        min_confidence: float,
+        class_severity: Dict[str, str],
+    ):
+        unknown = set(class_severity.values()) - set(SEVERITY_ORDER)
+        if unknown:
+            raise ValueError(
+                f"Unknown severity levels {sorted(unknown)} in rule-based report classes"
+            )
+        self.max_detections = max_detections
+        self.min_confidence = min_confidence
+        self.class_severity = {
+            _class_key(name): severity for name, severity in class_severity.items()
+        }
+
+    def matches(self, detections: List[Detection]) -> bool:
+        """Whether the input is routine enough for a templated report"""
+        return len(detections) <= self.max_detections and all(
+            detection.confidence >= self.min_confidence
+            and _class_key(detection.class_) in self.class_severity
+            for detection in detections
+        )
+
+    def generate(
+        self, detections: List[Detection], metadata: Optional[DicomMetadata] = None
+    ) -> DiagnosticReport:
+        """The templated report of a routine input"""
+        study = self._study_line(metadata)
+        if not detections:
+            return DiagnosticReport(
+                report=(
+                    f"{study}Automated analysis of the radiograph did not detect "
+                    "cavities or periapical lesions. Findings outside the scope "
+                    "of the detection model cannot be excluded, and the "
+                    "radiograph should be reviewed by a dental professional."
+                ),
+                summary="No significant findings detected",
+                recommendations=list(RECOMMENDATIONS["low"]),
+                severity_level="low",
+                generated_by="rules",
+            )
+
+        ordered = sorted(detections, key=lambda d: (round(d.y), round(d.x)))
+        severity = max(
+            (self.class_severity[_class_key(d.class_)] for d in ordered),
+            key=SEVERITY_ORDER.index,
+        )
+        counts = Counter(_class_key(d.class_) for d in ordered)
+        findings = ", ".join(f"{count} {name}" for name, count in counts.items())
+        detected = (
+            "1 finding with"
+            if len(ordered) == 1
+            else f"{len(ordered)} findings, each with"
+        )
+        lines = [
+            f"{study}Automated analysis of the radiograph detected {detected} "
+            f"a confidence of at least {self.min_confidence:.0%}:"
+        ]
+        for i, detection in enumerate(ordered, 1):
+            lines.append(
+                f"{i}. {_class_key(detection.class_).capitalize()} at "
+                f"({round(detection.x)}, {round(detection.y)}), "
+                f"{detection.width}x{detection.height} pixels, "
+                f"confidence {detection.confidence:.0%}"
+            )
+        lines.append(
+            "These findings should be confirmed by clinical examination and "
+            "professional interpretation of the radiograph before treatment "
+            "planning."
+        )
+        return DiagnosticReport(
+            report="\n".join(lines),
+            summary=f"Detected {findings} with high confidence",
+            recommendations=list(RECOMMENDATIONS[severity]),
+            severity_level=severity,
+            generated_by="rules",
+        )
+
+    def _study_line(self, metadata: Optional[DicomMetadata]) -> str:
+        if metadata is None:
+            return ""
+        parts = [
+            f"{label} {value}"
+            for label, value in (
+                ("Modality", metadata.modality),
+                ("study date", metadata.study_date),
+            )
+            if value
+        ]
+        return f"{', '.join(parts)}.\n" if parts else ""
+
+
+@lru_cache()
+def get_rule_based_report_generator() -> RuleBasedReportGenerator:
+    settings = get_settings()
+    return RuleBasedReportGenerator(
+        max_detections=settings.report_rules_max_detections,
+        min_confidence=settings.report_rules_min_confidence,
+        class_severity=settings.report_rules_classes,
+    )
@@ -0,0 +1,76 @@
+"""
+Single-flight coalescing of concurrent identical requests
+
+Concurrent calls with the same key share one computation: the first caller
+starts it and later callers wait for the same result. The computation runs
+as its own task, so one caller disconnecting does not cancel it for the
+others; it is only cancelled once every caller waiting for it is gone.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one computation"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+        self._counters = {"leaders": 0, "coalesced": 0, "max_waiters": 0}
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Return the result of `fn()`, sharing it with concurrent callers
+
+        Args:
+            key: Identifies equivalent calls
+            fn: Starts the computation; only called by the first caller
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(task=asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self._counters["leaders"] += 1
+        else:
+            self._counters["coalesced"] += 1
+
+        flight.waiters += 1
+        self._counters["max_waiters"] = max(
+            self._counters["max_waiters"], flight.waiters
+        )
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Computations started, calls coalesced onto them and current load"""
+        return {
+            **self._counters,
+            "in_flight": len(self._flights),
+            "waiting": sum(flight.waiters for flight in self._flights.values()),
+        }
+
+
+@lru_cache()
+def get_detection_flights() -> SingleFlight:
+    """Coalesces concurrent detections of the same content and model"""
+    return SingleFlight("detection")
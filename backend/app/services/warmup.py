@@ -0,0 +1,187 @@
+"""
+Startup warm-up
+
+Work that would otherwise make the first requests of a new replica slow is
+done before `/ready` reports it ready:
+
+- the report service is built, importing LangChain and the OpenAI client,
+  and opens a connection to the completions API
+- a small synthetic DICOM file in each transfer syntax with an installed
+  decoder is run through the conversion pipeline on every CPU worker, so
+  pixel data handlers are imported and initialised
+- the default model's inference backend opens its connection or loads its
+  model
+
+The steps run concurrently. A failing step is logged and reported but does
+not keep the application from becoming ready; the first request that needs
+it then does the work, as it would without warm-up.
+"""
+
+from typing import Awaitable, Callable, List
+import asyncio
+import io
+import logging
+
+import numpy as np
+from PIL import Image, features
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.pixels import get_decoder, get_encoder
+from pydicom.uid import (
+    UID,
+    ExplicitVRLittleEndian,
+    JPEG2000Lossless,
+    JPEGBaseline8Bit,
+    JPEGLSLossless,
+    RLELossless,
+    SecondaryCaptureImageStorage,
+    generate_uid,
+)
+
+from ..core.config import Settings, get_settings
+from ..core.executors import get_worker_pools
+from ..core.startup import StartupReport
+from .diagnostic_service import get_diagnostic_report_service
+from .dicom_processing import process_dicom
+from .inference_backends import get_inference_backends
+from .preprocessing import get_preprocess_options
+
+logger = logging.getLogger(__name__)
+
+# Transfer syntaxes warmed up, where a decoder for them is installed
+WARMUP_SYNTAXES = (
+    ExplicitVRLittleEndian,
+    JPEGBaseline8Bit,
+    JPEG2000Lossless,
+    JPEGLSLossless,
+    RLELossless,
+)
+WARMUP_IMAGE_SIZE = 64
+# Syntaxes pydicom has no encoder for, encoded with Pillow: format, Pillow
+# feature and save options
+PILLOW_ENCODED = {
+    JPEGBaseline8Bit: ("JPEG", "jpg", {}),
+    JPEG2000Lossless: ("JPEG2000", "jpg_2000", {"no_jp2": True}),
+}
+
+
+def synthetic_dicom(uid: UID) -> bytes:
+    """
+    A small 8-bit grayscale DICOM file in the given transfer syntax
+
+    Raises:
+        RuntimeError: If no encoder for the transfer syntax is installed
+    """
+    size = WARMUP_IMAGE_SIZE
+    gradient = np.linspace(0, 255, size, dtype=np.uint8)
+    pixels = np.add.outer(gradient, gradient) // 2
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = "OT"
+    ds.Rows = ds.Columns = size
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+
+    if uid == ExplicitVRLittleEndian:
+        ds.PixelData = pixels.tobytes()
+    elif uid in PILLOW_ENCODED:
+        image_format, feature, save_options = PILLOW_ENCODED[uid]
+        if not features.check(feature):
+            raise RuntimeError(f"Pillow was built without {image_format} support")
+        encoded = io.BytesIO()
+        Image.fromarray(pixels).save(encoded, format=image_format, **save_options)
+        ds.file_meta.TransferSyntaxUID = uid
+        ds.PixelData = encapsulate([encoded.getvalue()])
+        ds["PixelData"].VR = "OB"
+        ds["PixelData"].is_undefined_length = True
+    else:
+        if not get_encoder(uid).is_available:
+            raise RuntimeError(f"No {uid.name} encoder installed")
+        ds.compress(uid, pixels, generate_instance_uid=False)
+
+    output = io.BytesIO()
+    ds.save_as(output, enforce_file_format=True)
+    return output.getvalue()
+
+
+def warm_up_decoders() -> List[str]:
+    """
+    Run a synthetic DICOM file in each decodable transfer syntax through the
+    conversion pipeline
+
+    Returns:
+        Names of the transfer syntaxes that were warmed up
+    """
+    options = get_preprocess_options(get_settings())
+    warmed = []
+    for uid in WARMUP_SYNTAXES:
+        if uid.is_compressed and not get_decoder(uid).is_available:
+            continue
+        try:
+            process_dicom(synthetic_dicom(uid), options)
+            warmed.append(uid.name)
+        except Exception as e:
+            logger.debug(f"Skipped warming up {uid.name}: {e}")
+    return warmed
+
+
+def warm_up_worker() -> None:
+    """CPU worker process initializer; never raises, so the pool stays usable"""
+    try:
+        warm_up_decoders()
+    except Exception as e:
+        logger.warning(f"CPU worker warm-up failed: {e}")
+
+
+async def _warm_up_decoders() -> None:
+    pool = get_worker_pools().cpu
+    if pool.use_processes:
+        # Each process runs warm_up_worker as it starts
+        await pool.start_workers()
+    else:
+        warmed = await pool.run(warm_up_decoders)
+        logger.info(f"Warmed up DICOM decoders for {', '.join(warmed)}")
+
+
+async def _warm_up_inference(settings: Settings) -> None:
+    model_id = settings.default_model_id
+    await get_inference_backends().get(model_id).warm_up(model_id)
+
+
+async def warm_up(report: StartupReport, settings: Settings) -> None:
+    """Run the warm-up steps concurrently, recording each in the report"""
+
+    async def step(name: str, warm: Callable[[], Awaitable[None]]) -> None:
+        with report.phase(f"warmup.{name}"):
+            try:
+                await warm()
+            except Exception as e:
+                report.fail(f"warmup.{name}", e)
+
+    async def report_service() -> None:
+        # Importing LangChain holds the GIL, so it stays off the event loop
+        service = await asyncio.to_thread(get_diagnostic_report_service)
+        if settings.warmup_connections:
+            await step("completions", service.warm_up)
+
+    steps = [
+        step("report_service", report_service),
+        step("decoders", _warm_up_decoders),
+        step("inference", lambda: _warm_up_inference(settings)),
+    ]
+    timeout = settings.warmup_timeout_seconds
+    with report.phase("warmup"):
+        try:
+            await asyncio.wait_for(asyncio.gather(*steps), timeout)
+        except asyncio.TimeoutError:
+            report.fail("warmup", TimeoutError(f"Not finished after {timeout} s"))
@@ -0,0 +1,14 @@
+"""
+Reproducible benchmarks for the backend
+
+Run from the backend directory with `python -m benchmarks`. A synthetic
+dental DICOM corpus is generated, then DICOM processing and report prompt
+formatting are microbenchmarked and `/detect-dicom` is run end to end with
+the Roboflow and OpenAI APIs replaced by local stubs. Results are written
+as JSON and can be compared with a baseline with `--baseline`.
+
+`python -m benchmarks.load` load-tests a running backend against the same
+stand-ins, with configurable latencies, errors and rate limits, and
+`python -m benchmarks.startup` measures cold starts with and without
+startup warm-up.
+"""
@@ -0,0 +1,5 @@
+from .runner import main
+
+# Guarded, as spawned worker processes import this module again
+if __name__ == "__main__":
+    raise SystemExit(main())
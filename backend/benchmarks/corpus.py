@@ -0,0 +1,319 @@
+"""
+Synthetic dental DICOM corpus
+
+Every case is generated from a fixed seed, so the same pydicom, numpy and
+Pillow versions always produce byte-identical files; the manifest records
+their SHA-256 so runs on different corpora are easy to spot. The pixel data
+is a smooth phantom (a dental arch of bright ellipses on a graded
+background with mild noise) rather than random noise, so compressed
+transfer syntaxes see realistic compression ratios.
+
+Cases whose encoder, or whose decoder in the app, is not installed are
+reported as unavailable instead of failing the run.
+"""
+
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import hashlib
+import io
+
+import numpy as np
+from PIL import Image, features
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.pixels.decoders.base import get_decoder
+from pydicom.pixels.encoders.base import get_encoder
+from pydicom.sequence import Sequence
+from pydicom.uid import (
+    UID,
+    ExplicitVRLittleEndian,
+    JPEG2000Lossless,
+    JPEGBaseline8Bit,
+    JPEGLSLossless,
+    RLELossless,
+    generate_uid,
+)
+
+SEED = 20240101
+
+# Rows and columns of the simulated detectors, from intraoral to panoramic
+SIZES = {
+    "periapical": (1000, 750),
+    "bitewing": (1000, 1300),
+    "panoramic": (1400, 2800),
+}
+
+TRANSFER_SYNTAXES: Dict[str, UID] = {
+    "explicit": ExplicitVRLittleEndian,
+    "jpeg-baseline": JPEGBaseline8Bit,
+    "j2k": JPEG2000Lossless,
+    "jpegls": JPEGLSLossless,
+    "rle": RLELossless,
+}
+
+INTRAORAL_SOP_CLASS = "1.2.840.10008.5.1.4.1.1.1.3"
+DIGITAL_XRAY_SOP_CLASS = "1.2.840.10008.5.1.4.1.1.1.1"
+
+
+@dataclass(frozen=True)
+class CorpusCase:
+    """One synthetic DICOM file"""
+
+    size: str
+    bits_stored: int
+    photometric: str = "MONOCHROME2"
+    # "window" for Window Center/Width, "lut" for a VOI LUT Sequence, or None
+    voi: Optional[str] = "window"
+    syntax: str = "explicit"
+    signed: bool = False
+
+    @property
+    def name(self) -> str:
+        depth = f"{self.bits_stored}bit{'-signed' if self.signed else ''}"
+        photometric = self.photometric.lower().replace("monochrome", "mono")
+        return "-".join(
+            [self.syntax, depth, photometric, self.voi or "novoi", self.size]
+        )
+
+    @property
+    def transfer_syntax(self) -> UID:
+        return TRANSFER_SYNTAXES[self.syntax]
+
+
+CASES: List[CorpusCase] = [
+    # Bit depths, photometric interpretations and VOI variants, uncompressed
+    CorpusCase("bitewing", 8, voi=None),
+    CorpusCase("bitewing", 12),
+    CorpusCase("bitewing", 12, voi=None),
+    CorpusCase("bitewing", 12, photometric="MONOCHROME1"),
+    CorpusCase("bitewing", 16, voi="lut"),
+    CorpusCase("bitewing", 16, signed=True),
+    # Image sizes
+    CorpusCase("periapical", 12),
+    CorpusCase("panoramic", 12),
+    # Transfer syntaxes, at the smallest and largest common sizes
+    CorpusCase("bitewing", 8, voi=None, syntax="jpeg-baseline"),
+    CorpusCase("panoramic", 8, voi=None, syntax="jpeg-baseline"),
+    CorpusCase("bitewing", 12, syntax="j2k"),
+    CorpusCase("panoramic", 12, syntax="j2k"),
+    CorpusCase("bitewing", 12, syntax="jpegls"),
+    CorpusCase("panoramic", 12, syntax="jpegls"),
+    CorpusCase("bitewing", 12, syntax="rle"),
+    CorpusCase("panoramic", 12, syntax="rle"),
+]
+
+
+def unavailable_reason(case: CorpusCase) -> Optional[str]:
+    """Why a case cannot be generated or read here, or None if it can"""
+    uid = case.transfer_syntax
+    if case.syntax == "jpeg-baseline" and not features.check("jpg"):
+        return "Pillow was built without JPEG support"
+    if case.syntax == "j2k" and not features.check("jpg_2000"):
+        return "Pillow was built without JPEG 2000 support"
+    if case.syntax in ("jpegls", "rle"):
+        encoder = get_encoder(uid)
+        if not encoder.is_available:
+            missing = "; ".join(encoder.missing_dependencies)
+            return f"no {uid.name} encoder installed ({missing})"
+    if uid.is_compressed:
+        decoder = get_decoder(uid)
+        if not decoder.is_available:
+            return f"no {uid.name} decoder installed, the app cannot read it"
+    return None
+
+
+def _phantom(case: CorpusCase, rng: np.random.Generator) -> np.ndarray:
+    """Stored pixel values of a synthetic radiograph"""
+    rows, cols = SIZES[case.size]
+    y, x = np.ogrid[0:rows, 0:cols]
+    y = y / rows
+    x = x / cols
+
+    # Graded soft tissue background, brighter towards the occlusal plane
+    image = 0.15 + 0.25 * np.exp(-(((y - 0.5) / 0.35) ** 2)) + 0.05 * x
+    image = np.broadcast_to(image, (rows, cols)).astype(np.float32)
+
+    # Teeth along an arch, each an ellipse with a darker pulp
+    teeth = 14 if case.size == "panoramic" else 4
+    for i in range(teeth):
+        cx = (i + 0.5) / teeth
+        cy = 0.5 + 0.15 * (2 * cx - 1) ** 2
+        rx, ry = 0.35 / teeth, 0.3
+        ellipse = ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2
+        image = image + 0.45 * (ellipse <= 1) - 0.2 * (ellipse <= 0.15)
+
+    image = image + rng.normal(0, 0.02, (rows, cols)).astype(np.float32)
+    image = np.clip(image, 0, 1)
+    if case.photometric == "MONOCHROME1":
+        image = 1 - image
+
+    if case.signed:
+        low, high = -(2 ** (case.bits_stored - 1)), 2 ** (case.bits_stored - 1) - 1
+        dtype = np.int16
+    else:
+        low, high = 0, 2**case.bits_stored - 1
+        dtype = np.uint8 if case.bits_stored <= 8 else np.uint16
+    return (low + image * (high - low)).round().astype(dtype)
+
+
+def _voi_lut(case: CorpusCase) -> Dataset:
+    """A sigmoid VOI LUT covering every stored value"""
+    entries = 2**case.bits_stored
+    values = np.arange(entries, dtype=np.float64)
+    curve = 1 / (1 + np.exp(-(values - entries / 2) / (entries / 10)))
+    item = Dataset()
+    # A first entry count of 0 means 65536 entries
+    item.LUTDescriptor = [entries % 65536, 0, 12]
+    item.LUTExplanation = "Synthetic sigmoid"
+    lut = (curve * 4095).round().astype(np.uint16)
+    item.add_new("LUTData", "OW", lut.tobytes())
+    return item
+
+
+def _dataset(case: CorpusCase) -> Dataset:
+    rows, cols = SIZES[case.size]
+    intraoral = case.size != "panoramic"
+    sop_class = INTRAORAL_SOP_CLASS if intraoral else DIGITAL_XRAY_SOP_CLASS
+    sop_instance = generate_uid(entropy_srcs=[case.name, "instance"])
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = sop_class
+    meta.MediaStorageSOPInstanceUID = sop_instance
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = sop_instance
+    ds.StudyInstanceUID = generate_uid(entropy_srcs=[case.name, "study"])
+    ds.SeriesInstanceUID = generate_uid(entropy_srcs=[case.name, "series"])
+    ds.PatientID = "BENCH-0001"
+    ds.PatientName = "Bench^Patient"
+    ds.PatientBirthDate = "19800101"
+    ds.PatientSex = "O"
+    ds.StudyDate = "20240101"
+    ds.StudyTime = "120000"
+    ds.StudyDescription = "Synthetic benchmark study"
+    ds.SeriesDescription = case.name
+    ds.Modality = "IO" if intraoral else "PX"
+    ds.Manufacturer = "Dobbe Benchmarks"
+    ds.ManufacturerModelName = "Synthetic"
+    ds.InstitutionName = "Benchmark Clinic"
+    ds.ReferringPhysicianName = "Ref^Doctor"
+    ds.PixelSpacing = [0.02, 0.02] if intraoral else [0.1, 0.1]
+
+    ds.Rows, ds.Columns = rows, cols
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = case.photometric
+    ds.BitsAllocated = 8 if case.bits_stored <= 8 else 16
+    ds.BitsStored = case.bits_stored
+    ds.HighBit = case.bits_stored - 1
+    ds.PixelRepresentation = 1 if case.signed else 0
+
+    if case.signed:
+        ds.RescaleIntercept = 2 ** (case.bits_stored - 1)
+        ds.RescaleSlope = 1
+    if case.voi == "window":
+        full_range = 2**case.bits_stored
+        ds.WindowCenter = full_range / 2
+        ds.WindowWidth = full_range * 0.8
+    elif case.voi == "lut":
+        ds.VOILUTSequence = Sequence([_voi_lut(case)])
+    return ds
+
+
+def _encapsulate(ds: Dataset, frame: bytes, uid: UID) -> None:
+    ds.file_meta.TransferSyntaxUID = uid
+    ds.PixelData = encapsulate([frame])
+    ds["PixelData"].VR = "OB"
+    ds["PixelData"].is_undefined_length = True
+
+
+def build_case(case: CorpusCase) -> bytes:
+    """
+    Generate the DICOM file of a case
+
+    Raises:
+        RuntimeError: If the case is unavailable here
+    """
+    reason = unavailable_reason(case)
+    if reason:
+        raise RuntimeError(f"{case.name}: {reason}")
+
+    rng = np.random.default_rng([SEED, CASES.index(case)])
+    pixels = _phantom(case, rng)
+    ds = _dataset(case)
+
+    if case.syntax == "explicit":
+        ds.PixelData = pixels.tobytes()
+    elif case.syntax == "jpeg-baseline":
+        encoded = io.BytesIO()
+        Image.fromarray(pixels).save(encoded, format="JPEG", quality=90)
+        _encapsulate(ds, encoded.getvalue(), case.transfer_syntax)
+        ds.LossyImageCompression = "01"
+    elif case.syntax == "j2k":
+        encoded = io.BytesIO()
+        Image.fromarray(pixels).save(
+            encoded, format="JPEG2000", irreversible=False, no_jp2=True
+        )
+        _encapsulate(ds, encoded.getvalue(), case.transfer_syntax)
+    else:
+        ds.compress(case.transfer_syntax, pixels, generate_instance_uid=False)
+
+    output = io.BytesIO()
+    ds.save_as(output, enforce_file_format=True)
+    return output.getvalue()
+
+
+def build_jpeg(case: CorpusCase) -> bytes:
+    """The case's image as an 8-bit JPEG, for the image upload endpoint"""
+    pixels = _phantom(case, np.random.default_rng([SEED, CASES.index(case)]))
+    low, high = pixels.min(), pixels.max()
+    scaled = (pixels.astype(np.float32) - low) * (255 / max(high - low, 1))
+    if case.photometric == "MONOCHROME1":
+        scaled = 255 - scaled
+    output = io.BytesIO()
+    Image.fromarray(scaled.astype(np.uint8)).save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def manifest_entry(case: CorpusCase) -> Dict[str, Any]:
+    """Description of a case, with the reason it is unavailable if it is"""
+    rows, cols = SIZES[case.size]
+    entry: Dict[str, Any] = {
+        "name": case.name,
+        **asdict(case),
+        "rows": rows,
+        "columns": cols,
+        "transfer_syntax": str(case.transfer_syntax),
+    }
+    reason = unavailable_reason(case)
+    if reason:
+        entry["skipped"] = reason
+    return entry
+
+
+def write_corpus(directory: Path) -> List[Dict[str, Any]]:
+    """
+    Write every available case to `directory`
+
+    Returns:
+        The manifest: one entry per case, with its file path and checksum, or
+        the reason it was skipped
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for case in CASES:
+        entry = manifest_entry(case)
+        if "skipped" not in entry:
+            content = build_case(case)
+            path = directory / f"{case.name}.dcm"
+            path.write_bytes(content)
+            entry.update(
+                path=str(path),
+                bytes=len(content),
+                sha256=hashlib.sha256(content).hexdigest(),
+            )
+        manifest.append(entry)
+    return manifest
@@ -0,0 +1,86 @@
+"""
+End-to-end benchmarks through the FastAPI application
+
+Requests go through the full middleware stack and the worker pools, with
+the upstreams answered by `StubServers`; the environment set up by the
+runner points the app at them and turns result caching off, so every
+iteration does the full work. Each timed call returns the request's
+`Server-Timing` stages, which the runner reports alongside the total.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+import logging
+import time
+
+from .micro import BenchmarkFunction, report_inputs
+from .stubs import STUB_REPORT
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Stage durations in seconds from a `Server-Timing` header"""
+    stages = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                stages[name] = float(value) / 1000
+    return stages
+
+
+@contextmanager
+def _client():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    # Per-request INFO logs would be timed too
+    logging.disable(logging.INFO)
+    with TestClient(app) as client:
+        # Startup warm-up runs in the background; it is not to be timed
+        while client.get("/api/v1/ready").status_code != 200:
+            time.sleep(0.05)
+        yield client
+
+
+def _checked(response) -> Dict[str, float]:
+    if response.status_code != 200:
+        raise RuntimeError(
+            f"{response.request.url.path} returned {response.status_code}: "
+            f"{response.text[:200]}"
+        )
+    return parse_server_timing(response.headers.get("server-timing", ""))
+
+
+@contextmanager
+def detect_dicom(path: str) -> Iterator[BenchmarkFunction]:
+    """`POST /api/v1/detect-dicom` with a corpus file"""
+    content = Path(path).read_bytes()
+    files = {"file": (Path(path).name, content, "application/dicom")}
+    with _client() as client:
+        yield lambda: _checked(client.post("/api/v1/detect-dicom", files=files))
+
+
+@contextmanager
+def generate_report(count: int = 10) -> Iterator[BenchmarkFunction]:
+    """`POST /api/v1/generate-diagnostic-report` for synthetic detections"""
+    detections, metadata, image_info = report_inputs(count)
+    body = {
+        "predictions": [d.model_dump(by_alias=True) for d in detections],
+        "metadata": metadata.model_dump(),
+        "image_info": image_info,
+    }
+
+    def run() -> Dict[str, float]:
+        response = client.post("/api/v1/generate-diagnostic-report", json=body)
+        stages = _checked(response)
+        # Failed generations fall back to a canned report with a 200
+        summary = response.json()["diagnostic_report"]["summary"]
+        if summary != STUB_REPORT["summary"]:
+            raise RuntimeError("The report was not generated by the stub upstream")
+        return stages
+
+    with _client() as client:
+        yield run
@@ -0,0 +1,593 @@
+"""
+Load-testing harness
+
+Starts the stand-in upstreams and the real backend under uvicorn, then
+drives it with closed-loop virtual users: at each concurrency level, that
+many users send requests back to back for a fixed time. Each user picks the
+endpoint of its next request from a weighted mix of `/detect`,
+`/detect-dicom` and `/generate-diagnostic-report`.
+
+For every level the harness reports throughput, p50/p95/p99 latency of
+successful requests per endpoint, a breakdown of all outcomes by status
+code or client error, and what the stand-in upstreams served. The resident
+memory of the server and its worker processes is sampled throughout.
+
+Run from the backend directory with `python -m benchmarks.load`.
+"""
+
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .corpus import CASES, build_case, build_jpeg, unavailable_reason
+from .micro import report_inputs
+from .runner import BENCH_ENVIRONMENT, environment_info
+from .stubs import STUB_REPORT, Latency, StubServers, UpstreamBehaviour
+
+RESULTS_DIR = Path(__file__).parent / "results"
+DEFAULT_OUTPUT = RESULTS_DIR / "load-latest.json"
+DEFAULT_DICOM_CASES = [
+    "explicit-12bit-mono2-window-bitewing",
+    "jpeg-baseline-8bit-mono2-novoi-bitewing",
+    "explicit-12bit-mono2-window-panoramic",
+]
+ENDPOINTS = ("detect", "detect-dicom", "report")
+
+# Identical payloads would be coalesced or served from cache otherwise
+LOAD_ENVIRONMENT = {**BENCH_ENVIRONMENT, "COALESCE_REQUESTS": "false"}
+
+
+@dataclass
+class Sample:
+    """One request made by a virtual user"""
+
+    endpoint: str
+    started: float
+    latency: float
+    # Status code, "200-fallback" for canned reports, or the client error
+    outcome: str
+
+    @property
+    def ok(self) -> bool:
+        return self.outcome.startswith("2") and self.outcome.isdigit()
+
+
+class Payloads:
+    """Request bodies, built once and shared by all virtual users"""
+
+    def __init__(self, dicom_cases: List[str]):
+        cases = {case.name: case for case in CASES}
+        unknown = [name for name in dicom_cases if name not in cases]
+        if unknown:
+            raise ValueError(f"Unknown corpus cases: {', '.join(unknown)}")
+        unavailable = [name for name in dicom_cases if unavailable_reason(cases[name])]
+        if unavailable:
+            raise ValueError(f"Unavailable corpus cases: {', '.join(unavailable)}")
+
+        self.image = build_jpeg(cases[DEFAULT_DICOM_CASES[0]])
+        self.dicoms = [(f"{name}.dcm", build_case(cases[name])) for name in dicom_cases]
+        detections, metadata, image_info = report_inputs(10)
+        self.report = {
+            "predictions": [d.model_dump(by_alias=True) for d in detections],
+            "metadata": metadata.model_dump(),
+            "image_info": image_info,
+        }
+
+    async def send(
+        self, client: httpx.AsyncClient, endpoint: str, rng: random.Random
+    ) -> str:
+        """Send one request and classify its outcome"""
+        if endpoint == "detect":
+            response = await client.post(
+                "/api/v1/detect",
+                files={"file": ("bitewing.jpg", self.image, "image/jpeg")},
+            )
+        elif endpoint == "detect-dicom":
+            name, content = rng.choice(self.dicoms)
+            response = await client.post(
+                "/api/v1/detect-dicom",
+                files={"file": (name, content, "application/dicom")},
+            )
+        else:
+            response = await client.post(
+                "/api/v1/generate-diagnostic-report", json=self.report
+            )
+            # Failed generations fall back to a canned report with a 200
+            if (
+                response.status_code == 200
+                and response.json()["diagnostic_report"]["summary"]
+                != STUB_REPORT["summary"]
+            ):
+                return "200-fallback"
+        return str(response.status_code)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse `detect=1,detect-dicom=2,report=1` into endpoint weights"""
+    mix = {}
+    for part in text.split(","):
+        endpoint, _, weight = part.partition("=")
+        endpoint = endpoint.strip()
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(
+                f"unknown endpoint {endpoint!r}, expected one of {', '.join(ENDPOINTS)}"
+            )
+        mix[endpoint] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return mix
+
+
+def _latency(text: str) -> Latency:
+    try:
+        return Latency.parse(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid latency {text!r}: {e}")
+
+
+def _percentile(ordered: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values"""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _process_tree(root: int) -> Dict[int, int]:
+    """Resident memory in bytes of a process and all its descendants"""
+    parents: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, fields follow its ")"
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            continue
+
+    tree, frontier = {root}, [root]
+    while frontier:
+        parent = frontier.pop()
+        children = [pid for pid, ppid in parents.items() if ppid == parent]
+        tree.update(children)
+        frontier.extend(children)
+
+    rss = {}
+    for pid in tree:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss[pid] = int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return rss
+
+
+async def _sample_rss(
+    pid: int, interval: float, started: float, samples: List[Dict[str, Any]]
+) -> None:
+    """Append the server's memory to `samples` every `interval` seconds"""
+    while True:
+        processes = _process_tree(pid)
+        samples.append(
+            {
+                "t": round(time.monotonic() - started, 2),
+                "rss_bytes": sum(processes.values()),
+                "processes": len(processes),
+            }
+        )
+        await asyncio.sleep(interval)
+
+
+async def _virtual_user(
+    client: httpx.AsyncClient,
+    payloads: Payloads,
+    mix: Dict[str, float],
+    deadline: float,
+    rng: random.Random,
+    samples: List[Sample],
+) -> None:
+    endpoints, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        started = time.monotonic()
+        try:
+            outcome = await payloads.send(client, endpoint, rng)
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        samples.append(Sample(endpoint, started, time.monotonic() - started, outcome))
+
+
+def _outcomes(samples: List[Sample]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for sample in samples:
+        counts[sample.outcome] = counts.get(sample.outcome, 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def summarize_level(
+    concurrency: int, samples: List[Sample], elapsed: float
+) -> Dict[str, Any]:
+    """Throughput, latency percentiles and outcomes of one concurrency level"""
+    endpoints = {}
+    for endpoint in sorted({s.endpoint for s in samples}):
+        selected = [s for s in samples if s.endpoint == endpoint]
+        ok = sorted(s.latency * 1000 for s in selected if s.ok)
+        endpoints[endpoint] = {
+            "requests": len(selected),
+            "ok": len(ok),
+            "throughput_rps": len(ok) / elapsed,
+            "latency_ms": {
+                "p50": _percentile(ok, 50),
+                "p95": _percentile(ok, 95),
+                "p99": _percentile(ok, 99),
+                "max": ok[-1] if ok else None,
+            },
+            "outcomes": _outcomes(selected),
+        }
+    ok_count = sum(1 for s in samples if s.ok)
+    return {
+        "concurrency": concurrency,
+        "elapsed_seconds": elapsed,
+        "requests": len(samples),
+        "ok": ok_count,
+        "throughput_rps": ok_count / elapsed,
+        "outcomes": _outcomes(samples),
+        "endpoints": endpoints,
+    }
+
+
+async def run_level(
+    url: str,
+    concurrency: int,
+    duration: float,
+    payloads: Payloads,
+    mix: Dict[str, float],
+    seed: int,
+    timeout: float,
+) -> Tuple[List[Sample], float]:
+    """Drive the server with `concurrency` users for `duration` seconds"""
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=url, timeout=timeout, limits=limits
+    ) as client:
+        samples: List[Sample] = []
+        started = time.monotonic()
+        deadline = started + duration
+        # Requests still in flight at the deadline are waited for
+        async with asyncio.TaskGroup() as group:
+            for user in range(concurrency):
+                rng = random.Random(f"{seed}-{concurrency}-{user}")
+                group.create_task(
+                    _virtual_user(client, payloads, mix, deadline, rng, samples)
+                )
+        return samples, time.monotonic() - started
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(
+    environment: Dict[str, str],
+    workers: int,
+    log_path: Path,
+    wait_for: str = "/api/v1/ready",
+) -> Tuple[subprocess.Popen, str]:
+    """
+    Start `uvicorn app.main:app` and wait until `wait_for` answers with
+    success, by default until it has warmed up
+
+    Raises:
+        RuntimeError: If the server exits or does not answer within a minute
+    """
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    log = open(log_path, "w")
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--no-access-log",
+        ],
+        cwd=Path(__file__).parent.parent,
+        env={**os.environ, **environment},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    log.close()
+
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            httpx.get(f"{url}{wait_for}", timeout=1).raise_for_status()
+            return server, url
+        except httpx.HTTPError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                stop_backend(server)
+                raise RuntimeError(f"Backend failed to start, see {log_path}")
+            time.sleep(0.2)
+
+
+def stop_backend(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def _counter_delta(
+    before: Dict[str, Dict[str, int]], after: Dict[str, Dict[str, int]]
+) -> Dict[str, Dict[str, int]]:
+    return {
+        name: {key: value - before[name].get(key, 0) for key, value in counters.items()}
+        for name, counters in after.items()
+    }
+
+
+async def run_load(
+    args: argparse.Namespace,
+    url: str,
+    pid: Optional[int],
+    stubs: Optional[StubServers],
+    log: Callable[[str], None],
+) -> Dict[str, Any]:
+    """Run every concurrency level against a started server"""
+    payloads = Payloads(args.dicom_cases)
+    levels = []
+    rss_samples: List[Dict[str, Any]] = []
+    started = time.monotonic()
+    sampler = (
+        asyncio.create_task(_sample_rss(pid, args.rss_interval, started, rss_samples))
+        if pid is not None and os.path.isdir("/proc")
+        else None
+    )
+    try:
+        for concurrency in args.concurrency:
+            log(f"{concurrency} concurrent users for {args.duration:g}s")
+            upstream_before = stubs.stats() if stubs else None
+            first_sample = len(rss_samples)
+            level_started = time.monotonic() - started
+            samples, elapsed = await run_level(
+                url,
+                concurrency,
+                args.duration,
+                payloads,
+                args.mix,
+                args.seed,
+                args.timeout,
+            )
+            level = summarize_level(concurrency, samples, elapsed)
+            level["started_at_seconds"] = round(level_started, 2)
+            level_rss = [s["rss_bytes"] for s in rss_samples[first_sample:]]
+            level["peak_rss_bytes"] = max(level_rss) if level_rss else None
+            if stubs:
+                level["upstreams"] = _counter_delta(upstream_before, stubs.stats())
+            levels.append(level)
+    finally:
+        if sampler:
+            sampler.cancel()
+    return {"levels": levels, "rss": rss_samples}
+
+
+def format_report(report: Dict[str, Any]) -> List[str]:
+    """Human-readable summary of every level"""
+
+    def ms(value: Optional[float]) -> str:
+        return f"{value:.0f}" if value is not None else "-"
+
+    lines = []
+    for level in report["levels"]:
+        lines.append(
+            f"\n{level['concurrency']} users: {level['requests']} requests in "
+            f"{level['elapsed_seconds']:.1f}s, {level['throughput_rps']:.1f} ok/s"
+        )
+        lines.append(
+            f"  {'endpoint':<14}{'requests':>9}{'ok/s':>8}{'p50 ms':>9}"
+            f"{'p95 ms':>9}{'p99 ms':>9}  outcomes"
+        )
+        for endpoint, stats in level["endpoints"].items():
+            latency = stats["latency_ms"]
+            outcomes = ", ".join(f"{k}: {v}" for k, v in stats["outcomes"].items())
+            lines.append(
+                f"  {endpoint:<14}{stats['requests']:>9}"
+                f"{stats['throughput_rps']:>8.1f}{ms(latency['p50']):>9}"
+                f"{ms(latency['p95']):>9}{ms(latency['p99']):>9}  {outcomes}"
+            )
+        if level.get("peak_rss_bytes"):
+            lines.append(f"  peak server RSS {level['peak_rss_bytes'] / 2**20:.0f} MiB")
+        for name, counters in level.get("upstreams", {}).items():
+            lines.append(
+                f"  {name} stub: " + ", ".join(f"{k} {v}" for k, v in counters.items())
+            )
+    return lines
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load",
+        description="Load-test the backend against stand-in upstreams",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[10, 50, 200],
+        help="Concurrent users of each level (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=30.0,
+        help="Seconds each level runs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="detect=1,detect-dicom=2,report=1",
+        help="Endpoint weights (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dicom-cases",
+        nargs="+",
+        default=DEFAULT_DICOM_CASES,
+        help="Corpus files uploaded to /detect-dicom (see python -m "
+        "benchmarks --list)",
+    )
+    for name, latency in (("roboflow", "300-3000"), ("openai", "2000-10000")):
+        parser.add_argument(
+            f"--{name}-latency",
+            type=_latency,
+            default=latency,
+            help="Milliseconds, as 300 (fixed), 300-3000 (uniform) or "
+            "lognormal:800:3000 (median and p99) (default: %(default)s)",
+        )
+        parser.add_argument(
+            f"--{name}-error-rate",
+            type=float,
+            default=0.0,
+            help="Share of requests answered with a 500 (default: %(default)s)",
+        )
+        parser.add_argument(
+            f"--{name}-rate-limit",
+            type=float,
+            help="Requests per second above which the stub answers 429",
+        )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="uvicorn worker processes"
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Extra backend setting, e.g. --env ADMISSION_CONTROL_ENABLED=false",
+    )
+    parser.add_argument(
+        "--url",
+        help="Load-test this running backend instead of starting one; its "
+        "upstreams are not stubbed",
+    )
+    parser.add_argument(
+        "--pid", type=int, help="Process ID of the --url backend, for RSS sampling"
+    )
+    parser.add_argument(
+        "--rss-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between server memory samples (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300.0,
+        help="Client timeout per request in seconds (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=DEFAULT_OUTPUT,
+        help=f"Where to write the JSON results (default: {DEFAULT_OUTPUT.name} "
+        "in benchmarks/results)",
+    )
+    args = parser.parse_args(argv)
+    for setting in args.env:
+        if "=" not in setting:
+            parser.error(f"--env expects KEY=VALUE, got {setting!r}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    def log(message: str) -> None:
+        print(message, file=sys.stderr)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    options = {
+        "concurrency": args.concurrency,
+        "duration_seconds": args.duration,
+        "mix": args.mix,
+        "dicom_cases": args.dicom_cases,
+        "workers": args.workers,
+        "env": args.env,
+        "seed": args.seed,
+    }
+
+    if args.url:
+        report = asyncio.run(run_load(args, args.url, args.pid, None, log))
+    else:
+        behaviours = {
+            name: UpstreamBehaviour(
+                latency=getattr(args, f"{name}_latency"),
+                error_rate=getattr(args, f"{name}_error_rate"),
+                rate_limit=getattr(args, f"{name}_rate_limit"),
+            )
+            for name in ("roboflow", "openai")
+        }
+        # Latencies in seconds
+        options["upstreams"] = {
+            name: asdict(behaviour) for name, behaviour in behaviours.items()
+        }
+        with StubServers(seed=args.seed, **behaviours) as stubs:
+            environment = {
+                **LOAD_ENVIRONMENT,
+                **stubs.environment(),
+                **dict(setting.split("=", 1) for setting in args.env),
+            }
+            log_path = args.output.with_suffix(".server.log")
+            log(f"Starting backend with {args.workers} worker(s), log in {log_path}")
+            server, url = start_backend(environment, args.workers, log_path)
+            try:
+                report = asyncio.run(run_load(args, url, server.pid, stubs, log))
+            finally:
+                stop_backend(server)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment_info(),
+        "options": options,
+        **report,
+    }
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print("\n".join(format_report(report)))
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+# Guarded, as the spawned stub server process imports this module again
+if __name__ == "__main__":
+    raise SystemExit(main())
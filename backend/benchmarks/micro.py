@@ -0,0 +1,145 @@
+"""
+Microbenchmarks of DICOM processing, report prompt formatting and
+rule-based reports
+
+Each benchmark is a context manager that does its setup, then yields the
+function to time. DICOM benchmarks read their corpus file once during setup
+so the timed function never touches the disk.
+"""
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+import io
+import random
+
+BenchmarkFunction = Callable[[], Any]
+
+DETECTION_CLASSES = [("caries", 0), ("periapical lesion", 1)]
+
+
+@contextmanager
+def metadata(path: str) -> Iterator[BenchmarkFunction]:
+    """Header-only metadata read"""
+    from app.services.dicom_processing import read_dicom_metadata
+
+    with open(path, "rb") as f:
+        content = f.read()
+    yield lambda: read_dicom_metadata(io.BytesIO(content))
+
+
+@contextmanager
+def decode(path: str) -> Iterator[BenchmarkFunction]:
+    """Dataset read and pixel data decode"""
+    from app.services.dicom_processing import decode_dicom
+
+    with open(path, "rb") as f:
+        content = f.read()
+    yield lambda: decode_dicom(io.BytesIO(content))
+
+
+@contextmanager
+def convert(path: str) -> Iterator[BenchmarkFunction]:
+    """Conversion of decoded pixel data to an 8-bit image"""
+    from app.services.dicom_processing import convert_decoded_dicom, decode_dicom
+
+    decoded = decode_dicom(path)
+    yield lambda: convert_decoded_dicom(decoded)
+
+
+@contextmanager
+def process(path: str) -> Iterator[BenchmarkFunction]:
+    """The whole worker-side pipeline: decode, convert and encode for inference"""
+    from app.core.config import get_settings
+    from app.services.dicom_processing import process_dicom
+    from app.services.preprocessing import get_preprocess_options
+
+    options = get_preprocess_options(get_settings())
+    with open(path, "rb") as f:
+        content = f.read()
+    yield lambda: process_dicom(content, options)
+
+
+def synthetic_detections(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Detections spread over a bitewing-sized image"""
+    rng = random.Random(seed)
+    detections = []
+    for i in range(count):
+        name, class_id = DETECTION_CLASSES[i % len(DETECTION_CLASSES)]
+        detections.append(
+            {
+                "x": rng.uniform(0, 1300),
+                "y": rng.uniform(0, 1000),
+                "width": rng.randint(20, 120),
+                "height": rng.randint(20, 120),
+                "confidence": rng.uniform(0.3, 0.99),
+                "class": name,
+                "class_id": class_id,
+                "detection_id": f"det-{i}",
+            }
+        )
+    return detections
+
+
+def report_inputs(count: int):
+    """Detections, metadata and image info as a report request carries them"""
+    from app.models.detection import Detection, DicomMetadata, ImageInfo
+
+    detections = [Detection(**d) for d in synthetic_detections(count)]
+    metadata = DicomMetadata(
+        patient_id="BENCH-0001",
+        patient_sex="O",
+        study_date="20240101",
+        modality="IO",
+        institution_name="Benchmark Clinic",
+    )
+    image_info = ImageInfo(
+        original_shape=[1000, 1300],
+        converted_format="JPEG",
+        converted_size=[1300, 1000],
+        original_dtype="uint16",
+        pixel_array_min=0,
+        pixel_array_max=4095,
+        photometric_interpretation="MONOCHROME2",
+    ).model_dump()
+    return detections, metadata, image_info
+
+
+@contextmanager
+def report_formatter(name: str, count: int = 10) -> Iterator[BenchmarkFunction]:
+    """
+    One of the report prompt formatters, or the whole prompt when `name` is
+    "prompt"
+    """
+    from app.services.diagnostic_service import DiagnosticReportService
+    from app.services.report_prompt import encode_detections
+
+    service = DiagnosticReportService()
+    detections, metadata, image_info = report_inputs(count)
+
+    def render_prompt():
+        inputs, _ = service._prompt_inputs(detections, metadata, image_info)
+        return service.prompt.format_messages(**inputs)
+
+    yield {
+        "detections": lambda: encode_detections(
+            detections,
+            metadata,
+            image_info,
+            service.settings.report_prompt_token_budget,
+        ),
+        "patient_info": lambda: service._format_patient_info(metadata),
+        "image_info": lambda: service._format_image_info(image_info),
+        "prompt": render_prompt,
+    }[name]
+
+
+@contextmanager
+def report_rules(count: int = 1) -> Iterator[BenchmarkFunction]:
+    """A templated report from the rule-based tier"""
+    from app.services.report_rules import get_rule_based_report_generator
+
+    generator = get_rule_based_report_generator()
+    detections, metadata, _ = report_inputs(count)
+    for detection in detections:
+        detection.confidence = 0.95
+    yield lambda: generator.generate(detections, metadata)
@@ -0,0 +1,472 @@
+"""
+Benchmark runner
+
+Every benchmark runs in a fresh process, so its peak RSS is its own and
+earlier benchmarks cannot warm caches for it. A benchmark is timed over
+repeated calls after a warm-up; one further call is traced with
+`tracemalloc` for its allocations, so tracing does not skew the timings.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from importlib import metadata as package_metadata
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import e2e, micro
+from .corpus import CASES, manifest_entry, write_corpus
+from .stubs import Latency, StubServers, UpstreamBehaviour
+
+SCHEMA_VERSION = 1
+DEFAULT_OUTPUT = Path(__file__).parent / "results" / "latest.json"
+# Relative change in median time beyond which a benchmark counts as changed
+DEFAULT_THRESHOLD = 0.10
+
+# Settings for the benchmarked app; upstream URLs are added at run time
+BENCH_ENVIRONMENT = {
+    "ROBOFLOW_API_KEY": "bench",
+    "OPENAI_API_KEY": "bench",
+    "INFERENCE_BACKEND": "roboflow",
+    "DETECTION_CACHE_ENABLED": "false",
+    "REPORT_CACHE_ENABLED": "false",
+}
+
+REPORTED_PACKAGES = ("fastapi", "numpy", "pillow", "pydicom", "langchain-openai")
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    group: str
+    factory: Callable[..., ContextManager[micro.BenchmarkFunction]]
+    args: Tuple[Any, ...] = ()
+
+
+def collect(manifest: List[Dict[str, Any]]) -> List[Benchmark]:
+    """Every benchmark over the available corpus cases, in run order"""
+    cases = [entry for entry in manifest if "skipped" not in entry]
+    benchmarks = [
+        Benchmark(f"dicom.{stage.__name__}[{case['name']}]", "dicom", stage, (path,))
+        for stage in (micro.metadata, micro.decode, micro.convert, micro.process)
+        for case in cases
+        for path in [case.get("path")]
+    ]
+    for formatter, counts in (
+        ("detections", (10, 100)),
+        ("patient_info", (None,)),
+        ("image_info", (None,)),
+        ("prompt", (10, 100)),
+    ):
+        for count in counts:
+            suffix = f"[n={count}]" if count else ""
+            benchmarks.append(
+                Benchmark(
+                    f"report.format_{formatter}{suffix}",
+                    "report",
+                    micro.report_formatter,
+                    (formatter, count or 10),
+                )
+            )
+    benchmarks.append(
+        Benchmark("report.rules[n=1]", "report", micro.report_rules, (1,))
+    )
+    benchmarks += [
+        Benchmark(f"e2e.detect_dicom[{case['name']}]", "e2e", e2e.detect_dicom, (path,))
+        for case in cases
+        for path in [case.get("path")]
+    ]
+    benchmarks.append(
+        Benchmark("e2e.generate_report[n=10]", "e2e", e2e.generate_report, (10,))
+    )
+    return benchmarks
+
+
+def _peak_rss(pid: Any = "self") -> Optional[int]:
+    """
+    Peak resident set size of a process in bytes
+
+    Read from /proc where available: `ru_maxrss` carries over the parent's
+    peak into processes it spawns, which would hide the benchmark's own.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid != "self":
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _measure(run: micro.BenchmarkFunction, options: Dict[str, Any]) -> Dict[str, Any]:
+    for _ in range(options["warmup"]):
+        run()
+
+    samples: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    started = time.perf_counter()
+    while len(samples) < options["min_iterations"] or (
+        time.perf_counter() - started < options["min_time"]
+        and len(samples) < options["max_iterations"]
+    ):
+        call_started = time.perf_counter()
+        output = run()
+        samples.append(time.perf_counter() - call_started)
+        # End-to-end benchmarks return their Server-Timing stages
+        if isinstance(output, dict):
+            for stage, seconds in output.items():
+                stages.setdefault(stage, []).append(seconds)
+
+    tracemalloc.start()
+    traced_before, _ = tracemalloc.get_traced_memory()
+    run()
+    traced_after, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ordered = sorted(samples)
+    result = {
+        "iterations": len(samples),
+        "time_ms": {
+            "min": ordered[0] * 1000,
+            "median": statistics.median(ordered) * 1000,
+            "mean": statistics.fmean(ordered) * 1000,
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            "stdev": statistics.stdev(ordered) * 1000 if len(ordered) > 1 else 0.0,
+        },
+        "alloc_peak_bytes": traced_peak - traced_before,
+        "alloc_retained_bytes": traced_after - traced_before,
+    }
+    if stages:
+        result["stages_median_ms"] = {
+            stage: statistics.median(values) * 1000 for stage, values in stages.items()
+        }
+    return result
+
+
+def _init_worker(environment: Dict[str, str]) -> None:
+    os.environ.update(environment)
+
+
+def _run_benchmark(
+    name: str, manifest: List[Dict[str, Any]], options: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Run one benchmark; called in its own worker process"""
+    benchmark = next(b for b in collect(manifest) if b.name == name)
+    with benchmark.factory(*benchmark.args) as run:
+        setup_rss = _peak_rss()
+        result = _measure(run, options)
+        # Worker pool processes of end-to-end benchmarks, before they exit
+        children_rss = [
+            _peak_rss(child.pid) for child in multiprocessing.active_children()
+        ]
+    peak_rss = _peak_rss()
+    return {
+        **result,
+        "peak_rss_bytes": peak_rss,
+        "rss_growth_bytes": peak_rss - setup_rss,
+        "children_peak_rss_bytes": sum(rss for rss in children_rss if rss),
+    }
+
+
+def environment_info() -> Dict[str, Any]:
+    """Python, platform and package versions, and the checked out commit"""
+    packages = {}
+    for package in REPORTED_PACKAGES:
+        try:
+            packages[package] = package_metadata.version(package)
+        except package_metadata.PackageNotFoundError:
+            packages[package] = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit or None,
+        "packages": packages,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Generate the corpus, run the selected benchmarks and collect results"""
+    options = {
+        "warmup": args.warmup,
+        "min_iterations": args.min_iterations,
+        "min_time": args.min_time,
+        "max_iterations": args.max_iterations,
+        "roboflow_latency_ms": args.roboflow_latency_ms,
+        "openai_latency_ms": args.openai_latency_ms,
+    }
+    results: Dict[str, Any] = {}
+
+    with ExitStack() as stack:
+        scratch = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        corpus_dir = Path(args.corpus_dir) if args.corpus_dir else scratch / "corpus"
+        print(f"Generating corpus in {corpus_dir}", file=sys.stderr)
+        manifest = write_corpus(corpus_dir)
+        for entry in manifest:
+            if "skipped" in entry:
+                print(f"  skipped {entry['name']}: {entry['skipped']}", file=sys.stderr)
+
+        benchmarks = [
+            b
+            for b in collect(manifest)
+            if not args.filter or args.filter.search(b.name)
+        ]
+        stubs = stack.enter_context(
+            StubServers(
+                roboflow=UpstreamBehaviour(Latency(args.roboflow_latency_ms / 1000)),
+                openai=UpstreamBehaviour(Latency(args.openai_latency_ms / 1000)),
+            )
+        )
+        environment = {
+            **BENCH_ENVIRONMENT,
+            "CACHE_DIR": str(scratch / "cache"),
+            **stubs.environment(),
+        }
+
+        context = multiprocessing.get_context("spawn")
+        for i, benchmark in enumerate(benchmarks, 1):
+            print(f"[{i}/{len(benchmarks)}] {benchmark.name}", file=sys.stderr)
+            with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(environment,),
+            ) as pool:
+                try:
+                    result = pool.submit(
+                        _run_benchmark, benchmark.name, manifest, options
+                    ).result()
+                except Exception as e:
+                    result = {"error": f"{type(e).__name__}: {e}"}
+                    print(f"  failed: {result['error']}", file=sys.stderr)
+            results[benchmark.name] = {"group": benchmark.group, **result}
+
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment_info(),
+        "options": options,
+        "corpus": [
+            {key: value for key, value in entry.items() if key != "path"}
+            for entry in manifest
+        ],
+        "results": results,
+    }
+
+
+def _mib(value: Optional[int]) -> str:
+    return f"{value / 2**20:.2f}" if value is not None else "-"
+
+
+def summarize(report: Dict[str, Any]) -> List[str]:
+    """One table row per benchmark"""
+    width = max([len(name) for name in report["results"]] + [9])
+    lines = [
+        f"{'benchmark':<{width}}  {'median ms':>10}  {'p95 ms':>10}  "
+        f"{'iters':>6}  {'alloc MiB':>9}  {'RSS MiB':>8}"
+    ]
+    for name, result in report["results"].items():
+        if "error" in result:
+            lines.append(f"{name:<{width}}  error: {result['error']}")
+            continue
+        lines.append(
+            f"{name:<{width}}  {result['time_ms']['median']:>10.2f}  "
+            f"{result['time_ms']['p95']:>10.2f}  {result['iterations']:>6}  "
+            f"{_mib(result['alloc_peak_bytes']):>9}  "
+            f"{_mib(result['peak_rss_bytes']):>8}"
+        )
+    return lines
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> Tuple[List[str], int]:
+    """
+    Compare median times and allocation peaks with a baseline
+
+    Returns:
+        Tuple of (report lines, number of regressions)
+    """
+    lines = []
+    for key in ("python", "machine", "cpu_count", "packages"):
+        if baseline["environment"].get(key) != current["environment"].get(key):
+            lines.append(
+                f"warning: {key} differs from the baseline "
+                f"({baseline['environment'].get(key)} -> "
+                f"{current['environment'].get(key)})"
+            )
+    baseline_corpus = {c["name"]: c.get("sha256") for c in baseline["corpus"]}
+    for case in current["corpus"]:
+        if case.get("sha256") != baseline_corpus.get(case["name"], case.get("sha256")):
+            lines.append(
+                f"warning: corpus file {case['name']} differs from the baseline"
+            )
+
+    names = list(baseline["results"]) + [
+        name for name in current["results"] if name not in baseline["results"]
+    ]
+    width = max([len(name) for name in names] + [9])
+    lines.append(
+        f"{'benchmark':<{width}}  {'base ms':>10}  {'now ms':>10}  "
+        f"{'time':>8}  {'alloc':>8}  status"
+    )
+    regressions = 0
+    for name in names:
+        old = baseline["results"].get(name)
+        new = current["results"].get(name)
+        if old is None or new is None:
+            status = "new" if old is None else "missing"
+            lines.append(f"{name:<{width}}  {status}")
+            continue
+        if "error" in old or "error" in new:
+            lines.append(f"{name:<{width}}  error")
+            continue
+
+        old_ms, new_ms = old["time_ms"]["median"], new["time_ms"]["median"]
+        change = new_ms / old_ms - 1 if old_ms else 0.0
+        old_alloc, new_alloc = old["alloc_peak_bytes"], new["alloc_peak_bytes"]
+        alloc_change = new_alloc / old_alloc - 1 if old_alloc else 0.0
+        if change > threshold:
+            status = "REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            status = "improved"
+        else:
+            status = ""
+        lines.append(
+            f"{name:<{width}}  {old_ms:>10.2f}  {new_ms:>10.2f}  "
+            f"{change:>+8.1%}  {alloc_change:>+8.1%}  {status}"
+        )
+    return lines, regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark DICOM processing, report prompts and the API",
+    )
+    parser.add_argument(
+        "-k",
+        "--filter",
+        type=re.compile,
+        help="Only run benchmarks whose name matches this regular expression",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=DEFAULT_OUTPUT,
+        help=f"Where to write the JSON results (default: {DEFAULT_OUTPUT.name} "
+        "in benchmarks/results)",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="Compare the results with this earlier results file",
+    )
+    parser.add_argument(
+        "--results",
+        type=Path,
+        help="Compare this results file with --baseline instead of running",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Relative median time change reported as a regression or "
+        "improvement (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--corpus-dir", help="Keep the generated corpus in this directory"
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="List the benchmarks and exit"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Fewer iterations, for a smoke run"
+    )
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--min-iterations", type=int, default=5)
+    parser.add_argument("--max-iterations", type=int, default=1000)
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=1.0,
+        help="Seconds to keep repeating each benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--roboflow-latency-ms",
+        type=float,
+        default=0.0,
+        help="Delay of the stub inference API (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--openai-latency-ms",
+        type=float,
+        default=0.0,
+        help="Delay of the stub OpenAI API (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    if args.results and not args.baseline:
+        parser.error("--results needs --baseline")
+    if args.quick:
+        args.warmup, args.min_iterations, args.min_time = 1, 3, 0.2
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if args.list:
+        manifest = [manifest_entry(case) for case in CASES]
+        for benchmark in collect(manifest):
+            if not args.filter or args.filter.search(benchmark.name):
+                print(benchmark.name)
+        return 0
+
+    if args.results:
+        report = json.loads(args.results.read_text())
+    else:
+        report = run(args)
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print("\n".join(summarize(report)))
+        print(f"\nResults written to {args.output}")
+
+    failed = any("error" in result for result in report["results"].values())
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        lines, regressions = compare(baseline, report, args.threshold)
+        print("\n" + "\n".join(lines))
+        if regressions:
+            print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+            return 1
+    return 1 if failed else 0
@@ -0,0 +1,207 @@
+"""
+Cold-start benchmark
+
+Starts the backend under uvicorn against the stand-in upstreams several
+times, with startup warm-up on and off, and measures how long a new replica
+takes to listen, to report ready on `/ready` and to answer its first DICOM
+detection and report requests. The import time of the application is broken
+down by top-level package with `python -X importtime`.
+
+Run from the backend directory with `python -m benchmarks.startup`.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from .corpus import CASES, build_case
+from .load import LOAD_ENVIRONMENT, RESULTS_DIR, start_backend, stop_backend
+from .runner import BENCH_ENVIRONMENT, environment_info
+from .stubs import Latency, StubServers, UpstreamBehaviour
+
+DEFAULT_OUTPUT = RESULTS_DIR / "startup-latest.json"
+# Compressed, so the first request decodes with a pixel data handler
+DEFAULT_CASE = "j2k-12bit-mono2-window-bitewing"
+MEASURES = ("listening", "ready", "first_detect", "second_detect", "first_report")
+
+
+def import_times(runs: int) -> Dict[str, Any]:
+    """
+    Seconds to import the application, in total and by top-level package
+
+    Package times are the imports' own time, excluding nested imports of
+    other packages, averaged over the runs.
+    """
+    totals = []
+    packages: Dict[str, float] = defaultdict(float)
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app.main"],
+            cwd=Path(__file__).parent.parent,
+            env={**os.environ, **BENCH_ENVIRONMENT},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        total = 0.0
+        for line in completed.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            own, _, name = line[len("import time:") :].split("|")
+            seconds = int(own) / 1e6
+            total += seconds
+            packages[name.strip().split(".")[0]] += seconds / runs
+        totals.append(total)
+    ordered = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return {"total": statistics.median(totals), "packages": dict(ordered)}
+
+
+def cold_start(
+    environment: Dict[str, str], payload: bytes, log_path: Path
+) -> Dict[str, Any]:
+    """Start the backend once and time it up to its first requests"""
+    started = time.perf_counter()
+    server, url = start_backend(environment, 1, log_path, wait_for="/api/v1/health")
+    try:
+        timings = {"listening": time.perf_counter() - started}
+        with httpx.Client(base_url=f"{url}/api/v1", timeout=120) as client:
+            while client.get("/ready").status_code != 200:
+                time.sleep(0.05)
+            timings["ready"] = time.perf_counter() - started
+
+            for name in ("first_detect", "second_detect"):
+                requested = time.perf_counter()
+                response = client.post(
+                    "/detect-dicom", files={"file": ("case.dcm", payload)}
+                )
+                response.raise_for_status()
+                timings[name] = time.perf_counter() - requested
+
+            detections = response.json()
+            requested = time.perf_counter()
+            client.post(
+                "/generate-diagnostic-report",
+                json={
+                    "predictions": detections["predictions"],
+                    "metadata": detections["metadata"],
+                    "image_info": detections["image_info"],
+                },
+            ).raise_for_status()
+            timings["first_report"] = time.perf_counter() - requested
+            startup = client.get("/ready").json()
+    finally:
+        stop_backend(server)
+    return {"seconds": timings, "startup": startup}
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Median of each measure over the runs, in seconds"""
+    return {
+        measure: statistics.median(run["seconds"][measure] for run in runs)
+        for measure in MEASURES
+    }
+
+
+def format_report(report: Dict[str, Any]) -> List[str]:
+    imports = report["imports"]
+    lines = [f"Import of app.main: {imports['total'] * 1000:.0f} ms"]
+    for package, seconds in list(imports["packages"].items())[:10]:
+        lines.append(f"  {package:<24} {seconds * 1000:8.0f} ms")
+    lines.append("")
+    lines.append(
+        f"{'warm-up':<10}"
+        + "".join(f"{measure:>15}" for measure in MEASURES)
+        + "   (median ms)"
+    )
+    for mode, result in report["modes"].items():
+        lines.append(
+            f"{mode:<10}"
+            + "".join(
+                f"{result['median'][measure] * 1000:15.0f}" for measure in MEASURES
+            )
+        )
+    return lines
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.startup",
+        description="Measure backend cold starts with and without warm-up",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Cold starts per warm-up mode"
+    )
+    parser.add_argument(
+        "--case",
+        default=DEFAULT_CASE,
+        choices=[case.name for case in CASES],
+        help="DICOM case uploaded by the first requests",
+    )
+    parser.add_argument(
+        "--roboflow-latency",
+        type=Latency.parse,
+        default=Latency.parse("100"),
+        help="Inference stub latency in ms, as for benchmarks.load",
+    )
+    parser.add_argument(
+        "--openai-latency",
+        type=Latency.parse,
+        default=Latency.parse("500"),
+        help="Chat completions stub latency in ms, as for benchmarks.load",
+    )
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    payload = build_case(next(case for case in CASES if case.name == args.case))
+
+    report: Dict[str, Any] = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment_info(),
+        "options": {"runs": args.runs, "case": args.case},
+        "imports": import_times(args.runs),
+        "modes": {},
+    }
+    with StubServers(
+        roboflow=UpstreamBehaviour(args.roboflow_latency),
+        openai=UpstreamBehaviour(args.openai_latency),
+    ) as stubs:
+        for mode, enabled in (("on", "true"), ("off", "false")):
+            runs = []
+            for i in range(args.runs):
+                # A fresh cache directory, so no run resumes another's jobs
+                with tempfile.TemporaryDirectory() as cache_dir:
+                    environment = {
+                        **LOAD_ENVIRONMENT,
+                        **stubs.environment(),
+                        "CACHE_DIR": cache_dir,
+                        "WARMUP_ENABLED": enabled,
+                    }
+                    log_path = args.output.with_suffix(f".{mode}-{i}.server.log")
+                    runs.append(cold_start(environment, payload, log_path))
+                print(f"warm-up {mode}, run {i + 1}/{args.runs} done", file=sys.stderr)
+            report["modes"][mode] = {"median": summarize(runs), "runs": runs}
+
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print("\n".join(format_report(report)))
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+# Guarded, as the spawned stub server process imports this module again
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,372 @@
+"""
+Stand-in servers for the hosted upstreams
+
+A single local server answers both Roboflow inference requests
+(`POST /{project}/{version}`) and OpenAI chat completions
+(`POST /v1/chat/completions`, streamed or not) with responses in the
+shape of the real APIs. How each upstream behaves is configurable: its latency
+distribution, the share of requests failing with a 500, a number of first
+requests failing with a 500 as in a brief outage, and a request rate above
+which it answers 429 with `Retry-After`, as the hosted services do. Images
+the inference stand-in cannot decode get a 400, as from the hosted API.
+The server runs in its own process, so its work does not show up in the
+measurements of the process under test; `GET /stats` reports what each
+upstream has served.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import io
+import json
+import math
+import multiprocessing
+import random
+import socket
+import time
+
+import httpx
+
+# Detections returned for every image, in fractions of its width and height
+STUB_DETECTIONS = [
+    ("caries", 0, 0.30, 0.45, 0.04, 0.05, 0.91),
+    ("caries", 0, 0.62, 0.48, 0.03, 0.04, 0.74),
+    ("periapical lesion", 1, 0.45, 0.80, 0.06, 0.05, 0.66),
+]
+
+# In the field order the report prompt asks for
+STUB_REPORT = {
+    "summary": "Findings consistent with caries and a periapical lesion.",
+    "severity_level": "moderate",
+    "recommendations": ["Clinical examination", "Periapical radiograph follow-up"],
+    "report": "Synthetic report: two carious lesions and one periapical radiolucency.",
+}
+
+# Streamed completions: share of the latency before the first chunk, and
+# characters per chunk
+STREAM_FIRST_CHUNK_SHARE = 0.1
+STREAM_CHUNK_CHARS = 4
+
+# z-score of the 99th percentile of a normal distribution
+Z_99 = 2.326
+
+
+@dataclass(frozen=True)
+class Latency:
+    """
+    A response delay distribution, in seconds
+
+    Fixed when only `low` is set, uniform between `low` and `high`, or
+    log-normal with median `low` and 99th percentile `high` when
+    `lognormal` is set.
+    """
+
+    low: float = 0.0
+    high: Optional[float] = None
+    lognormal: bool = False
+
+    @classmethod
+    def parse(cls, text: str) -> "Latency":
+        """
+        Parse milliseconds as `300` (fixed), `300-3000` (uniform) or
+        `lognormal:800:3000` (median and 99th percentile)
+
+        Raises:
+            ValueError: If the text is not in one of these forms
+        """
+        if text.startswith("lognormal:"):
+            median, p99 = (float(v) / 1000 for v in text.split(":")[1:])
+            if not 0 < median <= p99:
+                raise ValueError("lognormal latency needs 0 < median <= p99")
+            return cls(median, p99, lognormal=True)
+        low, _, high = text.partition("-")
+        return cls(float(low) / 1000, float(high) / 1000 if high else None)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.high is None:
+            return self.low
+        if self.lognormal:
+            sigma = math.log(self.high / self.low) / Z_99
+            return rng.lognormvariate(math.log(self.low), sigma)
+        return rng.uniform(self.low, self.high)
+
+
+@dataclass(frozen=True)
+class UpstreamBehaviour:
+    """How a stand-in upstream answers"""
+
+    latency: Latency = field(default_factory=Latency)
+    # Share of requests answered with a 500
+    error_rate: float = 0.0
+    # Requests answered with a 500 before any other is served
+    fail_first: int = 0
+    # Requests per second above which requests are answered with a 429
+    rate_limit: Optional[float] = None
+
+
+class _Upstream:
+    """Counters and a token-bucket rate limiter for one stand-in upstream"""
+
+    def __init__(self, behaviour: UpstreamBehaviour, rng: random.Random):
+        self.behaviour = behaviour
+        self.rng = rng
+        self.counters = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0}
+        self._tokens = behaviour.rate_limit or 0.0
+        self._refilled = time.monotonic()
+
+    def _rate_limited(self) -> Optional[float]:
+        """Seconds until a request would be allowed, or None if it is now"""
+        rate = self.behaviour.rate_limit
+        if rate is None:
+            return None
+        now = time.monotonic()
+        self._tokens = min(rate, self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return None
+        return (1 - self._tokens) / rate
+
+    async def respond(self, hold: float = 1.0) -> Tuple[Optional[Any], float]:
+        """
+        Hold the request for a share of its sampled latency
+
+        Returns:
+            Tuple of (error response, or None to answer; seconds of latency
+            left for the caller to spend, such as between streamed chunks)
+        """
+        from fastapi.responses import JSONResponse
+
+        self.counters["requests"] += 1
+        retry_after = self._rate_limited()
+        if retry_after is not None:
+            self.counters["rate_limited"] += 1
+            response = JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            return response, 0.0
+
+        latency = self.behaviour.latency.sample(self.rng)
+        await asyncio.sleep(latency * hold)
+        outage = self.counters["requests"] <= self.behaviour.fail_first
+        if outage or self.rng.random() < self.behaviour.error_rate:
+            self.counters["errors"] += 1
+            response = JSONResponse(
+                {"error": {"message": "Stub upstream error", "type": "server_error"}},
+                status_code=500,
+            )
+            return response, 0.0
+        self.counters["ok"] += 1
+        return None, latency * (1 - hold)
+
+
+def create_stub_app(
+    roboflow: Optional[UpstreamBehaviour] = None,
+    openai: Optional[UpstreamBehaviour] = None,
+    seed: int = 0,
+):
+    """The stand-in upstream application"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+    from PIL import Image
+
+    rng = random.Random(seed)
+    upstreams = {
+        "roboflow": _Upstream(roboflow or UpstreamBehaviour(), rng),
+        "openai": _Upstream(openai or UpstreamBehaviour(), rng),
+    }
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health() -> Dict[str, str]:
+        return {"status": "ok"}
+
+    @app.get("/stats")
+    async def stats() -> Dict[str, Dict[str, int]]:
+        return {name: upstream.counters for name, upstream in upstreams.items()}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> Any:
+        body = await request.json()
+        stream = body.get("stream", False)
+        # Streamed completions send their first chunk early, then the rest
+        error, remaining = await upstreams["openai"].respond(
+            hold=STREAM_FIRST_CHUNK_SHARE if stream else 1.0
+        )
+        if error is not None:
+            return error
+
+        prompt_tokens = sum(
+            len(str(message.get("content", ""))) // 4
+            for message in body.get("messages", [])
+        )
+        content = json.dumps(STUB_REPORT)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+        }
+        completion = {
+            "id": "chatcmpl-stub",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+        }
+        if not stream:
+            return {
+                **completion,
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+
+        pieces = [
+            content[i : i + STREAM_CHUNK_CHARS]
+            for i in range(0, len(content), STREAM_CHUNK_CHARS)
+        ]
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        def chunk(choices: List[Dict[str, Any]], **extra: Any) -> str:
+            data = {
+                **completion,
+                "object": "chat.completion.chunk",
+                "choices": choices,
+                **extra,
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def chunks():
+            yield chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}}])
+            for piece in pieces:
+                yield chunk([{"index": 0, "delta": {"content": piece}}])
+                await asyncio.sleep(remaining / len(pieces))
+            yield chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                yield chunk([], usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.post("/{project}/{version}")
+    async def infer(project: str, version: str, request: Request) -> Any:
+        body = await request.body()
+        started = time.perf_counter()
+        error, _ = await upstreams["roboflow"].respond()
+        if error is not None:
+            return error
+        # Only the image header is parsed, for its size
+        try:
+            width, height = Image.open(io.BytesIO(base64.b64decode(body))).size
+        except (ValueError, OSError):
+            return JSONResponse({"message": "Could not decode image"}, status_code=400)
+        return {
+            "inference_id": "stub",
+            "time": time.perf_counter() - started,
+            "image": {"width": width, "height": height},
+            "predictions": [
+                {
+                    "x": x * width,
+                    "y": y * height,
+                    "width": round(w * width),
+                    "height": round(h * height),
+                    "confidence": confidence,
+                    "class": name,
+                    "class_id": class_id,
+                    "detection_id": f"stub-{i}",
+                }
+                for i, (name, class_id, x, y, w, h, confidence) in enumerate(
+                    STUB_DETECTIONS
+                )
+            ],
+        }
+
+    return app
+
+
+def _serve(
+    sock: socket.socket,
+    roboflow: UpstreamBehaviour,
+    openai: UpstreamBehaviour,
+    seed: int,
+) -> None:
+    import uvicorn
+
+    app = create_stub_app(roboflow, openai, seed)
+    config = uvicorn.Config(app, log_level="warning", access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class StubServers:
+    """
+    Run the stand-in upstreams on a free local port for the enclosed block
+
+    Args:
+        roboflow: Behaviour of the inference API
+        openai: Behaviour of the chat completions API
+        seed: Seed for sampled latencies and errors
+    """
+
+    def __init__(
+        self,
+        roboflow: Optional[UpstreamBehaviour] = None,
+        openai: Optional[UpstreamBehaviour] = None,
+        seed: int = 0,
+    ):
+        self.roboflow = roboflow or UpstreamBehaviour()
+        self.openai = openai or UpstreamBehaviour()
+        self.seed = seed
+        self.url: Optional[str] = None
+        self._process: Optional[multiprocessing.process.BaseProcess] = None
+
+    def environment(self) -> Dict[str, str]:
+        """Environment pointing the app's upstream clients at the stubs"""
+        return {
+            "ROBOFLOW_API_URL": self.url,
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "OPENAI_API_BASE": f"{self.url}/v1",
+        }
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Requests served by each upstream, by outcome"""
+        return httpx.get(f"{self.url}/stats", timeout=5).json()
+
+    def __enter__(self) -> "StubServers":
+        # Bound and listening before the child starts, so no request is lost
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(1024)
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+        context = multiprocessing.get_context("spawn")
+        self._process = context.Process(
+            target=_serve,
+            args=(sock, self.roboflow, self.openai, self.seed),
+            daemon=True,
+        )
+        self._process.start()
+        sock.close()
+
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(f"{self.url}/health", timeout=1).raise_for_status()
+                return self
+            except httpx.HTTPError:
+                if not self._process.is_alive() or time.monotonic() > deadline:
+                    self.__exit__(None, None, None)
+                    raise RuntimeError("Stub upstream server failed to start")
+                time.sleep(0.1)
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(timeout=10)
+            self._process = None
@@ -0,0 +1,22 @@
+"""
+Shared test setup
+
+Settings need API keys, which the tests never use against a real upstream.
+"""
+
+from pathlib import Path
+import os
+import sys
+
+import pytest
+
+# The backend directory, so `app` and `benchmarks` import however pytest is run
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+os.environ.setdefault("ROBOFLOW_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
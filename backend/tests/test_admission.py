@@ -0,0 +1,77 @@
+"""Admission lanes: concurrency limit, bounded FIFO queue and shedding"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.admission import AdmissionLane
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_slots_are_handed_to_waiters_in_arrival_order():
+    lane = AdmissionLane("test", max_concurrency=1, max_queue=2, max_wait=5)
+    await lane.acquire()
+
+    admitted = []
+
+    async def wait(name: str) -> None:
+        await lane.acquire()
+        admitted.append(name)
+
+    waiters = [asyncio.create_task(wait(name)) for name in ("first", "second")]
+    await asyncio.sleep(0)
+    assert lane.stats()["queued"] == 2
+
+    lane.release()
+    await asyncio.sleep(0)
+    assert admitted == ["first"]
+    lane.release()
+    await asyncio.gather(*waiters)
+    assert admitted == ["first", "second"]
+    assert lane.stats()["active"] == 1
+
+
+async def test_requests_beyond_the_queue_are_shed():
+    lane = AdmissionLane("test", max_concurrency=1, max_queue=1, max_wait=5)
+    await lane.acquire()
+    waiter = asyncio.create_task(lane.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as raised:
+        await lane.acquire()
+
+    assert raised.value.status_code == 503
+    assert int(raised.value.headers["Retry-After"]) >= 1
+    assert lane.stats()["shed_queue_full"] == 1
+    waiter.cancel()
+
+
+async def test_waits_longer_than_the_limit_are_shed():
+    lane = AdmissionLane("test", max_concurrency=1, max_queue=1, max_wait=0.01)
+    await lane.acquire()
+
+    with pytest.raises(HTTPException) as raised:
+        await lane.acquire()
+
+    assert raised.value.status_code == 503
+    stats = lane.stats()
+    assert (stats["shed_timeout"], stats["queued"]) == (1, 0)
+
+
+async def test_cancelled_waiters_do_not_hold_a_slot():
+    lane = AdmissionLane("test", max_concurrency=1, max_queue=2, max_wait=5)
+    await lane.acquire()
+    cancelled = asyncio.create_task(lane.acquire())
+    waiting = asyncio.create_task(lane.acquire())
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    lane.release()
+    await waiting
+    lane.release()
+
+    stats = lane.stats()
+    assert (stats["active"], stats["queued"]) == (0, 0)
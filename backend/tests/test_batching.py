@@ -0,0 +1,98 @@
+"""Micro-batching of concurrent inference calls"""
+
+from typing import Any, Dict, List
+import asyncio
+
+import pytest
+
+from app.services.batching import MicroBatcher
+
+MODEL_ID = "teeth/1"
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeBackend:
+    """Echoes each image back, recording the size of every batch it runs"""
+
+    def __init__(self, supports_batching: bool = True, error: Exception = None):
+        self.supports_batching = supports_batching
+        self.error = error
+        self.batches: List[int] = []
+        self.single_calls = 0
+
+    async def infer(self, image: Any, model_id: str) -> Dict[str, Any]:
+        self.single_calls += 1
+        return {"image": image}
+
+    async def infer_batch(
+        self, images: List[Any], model_id: str
+    ) -> List[Dict[str, Any]]:
+        self.batches.append(len(images))
+        await asyncio.sleep(0.02)
+        if self.error is not None:
+            raise self.error
+        return [{"image": image} for image in images]
+
+
+class FakeBackends:
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+
+    def get(self, model_id: str) -> FakeBackend:
+        return self.backend
+
+
+def _batcher(backend: FakeBackend, max_batch_size: int = 8) -> MicroBatcher:
+    return MicroBatcher(FakeBackends(backend), max_batch_size, window_seconds=0.005)
+
+
+async def test_calls_arriving_during_a_batch_form_the_next_one():
+    backend = FakeBackend()
+    batcher = _batcher(backend)
+
+    first = asyncio.create_task(batcher.submit("first", MODEL_ID))
+    await asyncio.sleep(0)
+    queued = [
+        asyncio.create_task(batcher.submit(f"image-{i}", MODEL_ID)) for i in range(3)
+    ]
+
+    assert await first == {"image": "first"}
+    results = await asyncio.gather(*queued)
+    # Each caller gets the result for its own image
+    assert results == [{"image": f"image-{i}"} for i in range(3)]
+    assert backend.batches == [1, 3]
+
+
+async def test_batches_are_capped_at_the_maximum_size():
+    backend = FakeBackend()
+    batcher = _batcher(backend, max_batch_size=2)
+
+    results = await asyncio.gather(*(batcher.submit(i, MODEL_ID) for i in range(7)))
+
+    assert results == [{"image": i} for i in range(7)]
+    assert max(backend.batches) == 2
+    assert sum(backend.batches) == 7
+
+
+async def test_batch_errors_reach_every_caller():
+    backend = FakeBackend(error=RuntimeError("backend down"))
+    batcher = _batcher(backend)
+
+    results = await asyncio.gather(
+        *(batcher.submit(i, MODEL_ID) for i in range(3)), return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert batcher.stats()["batches_in_flight"] == 0
+
+
+async def test_backends_without_batching_are_called_directly():
+    backend = FakeBackend(supports_batching=False)
+    batcher = _batcher(backend)
+
+    results = await asyncio.gather(*(batcher.submit(i, MODEL_ID) for i in range(3)))
+
+    assert results == [{"image": i} for i in range(3)]
+    assert backend.single_calls == 3
+    assert backend.batches == []
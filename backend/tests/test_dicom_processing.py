@@ -0,0 +1,111 @@
+"""Lookup table conversion of integer pixel data"""
+
+from typing import Optional
+
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset
+
+from app.services.dicom_processing import (
+    _apply_value_transforms,
+    _convert_array,
+    _convert_with_lut,
+    _decoded,
+)
+
+SHAPE = (48, 64)
+
+
+def _pixels(dtype: str, low: int, high: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(low, high, SHAPE, endpoint=True).astype(dtype)
+
+
+def _dataset(
+    photometric: str = "MONOCHROME2",
+    window: Optional[tuple] = None,
+    voi_lut: Optional[np.ndarray] = None,
+    modality_lut: Optional[np.ndarray] = None,
+    first_mapped: int = 0,
+) -> Dataset:
+    ds = Dataset()
+    ds.PhotometricInterpretation = photometric
+    ds.PixelRepresentation = 0
+    ds.BitsStored = 16
+    if window is not None:
+        ds.WindowCenter, ds.WindowWidth = window
+    for keyword, lut in (
+        ("VOILUTSequence", voi_lut),
+        ("ModalityLUTSequence", modality_lut),
+    ):
+        if lut is None:
+            continue
+        item = Dataset()
+        item.LUTDescriptor = [len(lut), first_mapped, 16]
+        item.LUTData = [int(value) for value in lut]
+        if keyword == "ModalityLUTSequence":
+            item.ModalityLUTType = "US"
+        setattr(ds, keyword, [item])
+    return ds
+
+
+def _assert_equivalent(pixels: np.ndarray, ds: Dataset) -> None:
+    decoded = _decoded(ds, pixels, {})
+    converted = _convert_with_lut(decoded)
+    assert converted is not None
+    np.testing.assert_array_equal(converted, _convert_array(decoded)[..., 0])
+
+
+@pytest.mark.parametrize(
+    "dtype, low, high",
+    [
+        ("uint8", 0, 255),
+        ("uint16", 0, 4095),
+        ("uint16", 100, 16383),
+        ("uint16", 0, 65535),
+    ],
+)
+@pytest.mark.parametrize("photometric", ["MONOCHROME2", "MONOCHROME1"])
+def test_unsigned_data_matches_per_pixel_conversion(dtype, low, high, photometric):
+    _assert_equivalent(_pixels(dtype, low, high), _dataset(photometric))
+
+
+@pytest.mark.parametrize("photometric", ["MONOCHROME2", "MONOCHROME1"])
+@pytest.mark.parametrize("window", [(2048, 4096), (600, 300), (40, 1)])
+def test_windowed_data_matches_per_pixel_conversion(photometric, window):
+    _assert_equivalent(_pixels("uint16", 0, 4095), _dataset(photometric, window))
+
+
+@pytest.mark.parametrize("monotonic", [True, False])
+def test_lut_sequences_match_per_pixel_conversion(monotonic):
+    rng = np.random.default_rng(1)
+    lut = rng.integers(0, 65535, 4096)
+    if monotonic:
+        lut = np.sort(lut)
+    pixels = _pixels("uint16", 0, 4095)
+
+    for ds in (_dataset(voi_lut=lut), _dataset(modality_lut=lut)):
+        # A LUT that fails to apply is skipped with a warning
+        assert _apply_value_transforms(pixels, ds)[1]
+        _assert_equivalent(pixels, ds)
+
+
+def test_signed_data_within_range_matches_per_pixel_conversion():
+    ds = _dataset()
+    ds.PixelRepresentation = 1
+    _assert_equivalent(_pixels("int16", -1024, 3071), ds)
+    _assert_equivalent(_pixels("int16", -1024, 3071), _dataset(window=(40, 400)))
+
+
+def test_constant_images_are_mid_grey():
+    pixels = np.full(SHAPE, 700, dtype="uint16")
+    decoded = _decoded(_dataset(), pixels, {})
+
+    assert (_convert_with_lut(decoded) == 128).all()
+    assert (_convert_array(decoded) == 128).all()
+
+
+def test_unsupported_data_uses_per_pixel_conversion():
+    pixels = np.zeros(SHAPE, dtype="float32")
+
+    assert _convert_with_lut(_decoded(_dataset(), pixels, {})) is None
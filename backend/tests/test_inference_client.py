@@ -0,0 +1,123 @@
+"""AsyncInferenceClient against the stand-in inference API"""
+
+from typing import Any, AsyncIterator, Callable, Iterator
+import base64
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from app.core.config import Settings
+from app.core.exceptions import InferenceException
+from app.services.inference_client import AsyncInferenceClient
+from benchmarks.stubs import Latency, StubServers, UpstreamBehaviour
+
+MODEL_ID = "teeth/1"
+
+pytestmark = pytest.mark.anyio
+
+
+def _image() -> str:
+    encoded = io.BytesIO()
+    Image.new("L", (32, 24)).save(encoded, format="PNG")
+    return base64.b64encode(encoded.getvalue()).decode()
+
+
+@pytest.fixture
+def stub() -> Iterator[Callable[..., StubServers]]:
+    """Starts the stand-in upstreams with the given inference behaviour"""
+    started = []
+
+    def start(**behaviour: Any) -> StubServers:
+        servers = StubServers(roboflow=UpstreamBehaviour(**behaviour)).__enter__()
+        started.append(servers)
+        return servers
+
+    yield start
+    for servers in started:
+        servers.__exit__(None, None, None)
+
+
+@pytest.fixture
+async def make_client() -> AsyncIterator[Callable[..., AsyncInferenceClient]]:
+    """Builds clients for a stand-in server, closing them afterwards"""
+    clients = []
+
+    def make(servers: StubServers, **settings: Any) -> AsyncInferenceClient:
+        client = AsyncInferenceClient(
+            Settings(
+                roboflow_api_url=servers.url,
+                inference_retry_backoff_seconds=0.01,
+                **settings,
+            )
+        )
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        await client.aclose()
+
+
+async def test_retries_until_the_upstream_recovers(stub, make_client):
+    servers = stub(fail_first=2)
+    client = make_client(servers, inference_max_retries=2)
+
+    result = await client.infer(_image(), MODEL_ID)
+
+    assert result["image"] == {"width": 32, "height": 24}
+    assert client.stats()["retries"] == 2
+    assert servers.stats()["roboflow"]["requests"] == 3
+
+
+async def test_fails_once_retries_are_exhausted(stub, make_client):
+    servers = stub(error_rate=1.0)
+    client = make_client(servers, inference_max_retries=2)
+
+    with pytest.raises(InferenceException, match="500"):
+        await client.infer(_image(), MODEL_ID)
+
+    assert servers.stats()["roboflow"]["requests"] == 3
+    assert client.stats()["errors"] == 1
+
+
+async def test_client_errors_are_not_retried(stub, make_client):
+    servers = stub()
+    client = make_client(servers, inference_max_retries=2)
+
+    with pytest.raises(InferenceException, match="400"):
+        await client.infer("not an image", MODEL_ID)
+
+    assert servers.stats()["roboflow"]["requests"] == 1
+    assert client.stats()["retries"] == 0
+
+
+async def test_read_timeouts_become_504(stub, make_client):
+    servers = stub(latency=Latency(0.5))
+    client = make_client(servers, inference_read_timeout=0.05, inference_max_retries=1)
+
+    with pytest.raises(HTTPException) as raised:
+        await client.infer(_image(), MODEL_ID)
+
+    assert raised.value.status_code == 504
+    assert client.stats()["timeouts"] == 2
+
+
+async def test_hedged_request_can_win(stub, make_client):
+    # A long tail: calls slower than the median are hedged, and the hedge
+    # usually finishes before a primary from the tail
+    servers = stub(latency=Latency(0.01, 0.5, lognormal=True))
+    client = make_client(
+        servers,
+        inference_hedge_enabled=True,
+        inference_hedge_percentile=50,
+        inference_hedge_min_samples=5,
+    )
+
+    for _ in range(40):
+        await client.infer(_image(), MODEL_ID)
+
+    stats = client.stats()
+    assert stats["hedged"] > 0
+    assert stats["hedge_wins"] > 0
@@ -0,0 +1,114 @@
+"""Coalescing of concurrent identical calls"""
+
+import asyncio
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Computation:
+    """A computation that runs until released, counting how often it starts"""
+
+    def __init__(self, result: str = "result"):
+        self.result = result
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.cancelled = False
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+async def test_concurrent_calls_share_one_computation():
+    flights = SingleFlight("test")
+    computation = Computation()
+
+    callers = [asyncio.create_task(flights.run("key", computation)) for _ in range(3)]
+    await asyncio.sleep(0)
+    computation.release.set()
+
+    assert await asyncio.gather(*callers) == ["result"] * 3
+    assert computation.calls == 1
+    stats = flights.stats()
+    assert (stats["leaders"], stats["coalesced"], stats["max_waiters"]) == (1, 2, 3)
+    assert stats["in_flight"] == 0
+
+
+async def test_different_keys_are_not_coalesced():
+    flights = SingleFlight("test")
+    first, second = Computation("first"), Computation("second")
+
+    callers = [
+        asyncio.create_task(flights.run("a", first)),
+        asyncio.create_task(flights.run("b", second)),
+    ]
+    first.release.set()
+    second.release.set()
+
+    assert await asyncio.gather(*callers) == ["first", "second"]
+    assert (first.calls, second.calls) == (1, 1)
+
+
+async def test_errors_reach_every_caller():
+    flights = SingleFlight("test")
+    computation = Computation(ValueError("failed"))
+
+    callers = [asyncio.create_task(flights.run("key", computation)) for _ in range(2)]
+    await asyncio.sleep(0)
+    computation.release.set()
+
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert computation.calls == 1
+
+
+async def test_leader_leaving_does_not_cancel_the_computation():
+    flights = SingleFlight("test")
+    computation = Computation()
+
+    leader = asyncio.create_task(flights.run("key", computation))
+    follower = asyncio.create_task(flights.run("key", computation))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    computation.release.set()
+
+    assert await follower == "result"
+    assert leader.cancelled()
+    assert not computation.cancelled
+
+
+async def test_computation_is_cancelled_once_every_caller_left():
+    flights = SingleFlight("test")
+    computation = Computation()
+
+    callers = [asyncio.create_task(flights.run("key", computation)) for _ in range(2)]
+    await asyncio.sleep(0)
+    for caller in callers:
+        caller.cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert computation.cancelled
+    assert flights.stats()["in_flight"] == 0
+
+
+async def test_finished_computations_are_not_reused():
+    flights = SingleFlight("test")
+    computation = Computation()
+    computation.release.set()
+
+    assert await flights.run("key", computation) == "result"
+    assert await flights.run("key", computation) == "result"
+    assert computation.calls == 2
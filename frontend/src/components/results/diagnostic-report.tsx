@@ -5,7 +5,7 @@ import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { Separator } from "@/components/ui/separator";
-import { useGenerateDiagnosticReport } from "@/hooks/use-diagnostic-report";
+import { useStreamDiagnosticReport } from "@/hooks/use-diagnostic-report";
 import { exportToPDF, type PDFExportData } from "@/lib/pdf-export";
 import type {
   Detection,
@@ -28,6 +28,8 @@ interface DiagnosticReportComponentProps {
   metadata: DicomMetadata;
   imageInfo: ImageInfo;
   report?: DiagnosticReport;
+  // A report started with the detections is still being generated
+  reportPending?: boolean;
   onReportGenerated?: (report: DiagnosticReport) => void;
   originalImageSrc?: string; // Add original image source for PDF annotation
 }
@@ -63,6 +65,7 @@ export function DiagnosticReportComponent({
   metadata,
   imageInfo,
   report: externalReport,
+  reportPending = false,
   onReportGenerated,
   originalImageSrc, // Destructure originalImageSrc prop
 }: DiagnosticReportComponentProps) {
@@ -70,7 +73,11 @@ export function DiagnosticReportComponent({
     externalReport || null
   );
   const [isExporting, setIsExporting] = useState(false);
-  const generateReport = useGenerateDiagnosticReport();
+  // Streamed, so sections show while the rest of the report is written
+  const generateReport = useStreamDiagnosticReport();
+  const partialReport = generateReport.partialReport;
+  const isStreaming =
+    generateReport.isPending && Object.keys(partialReport).length > 0;
 
   // Update local state when external report changes
   useEffect(() => {
@@ -123,7 +130,48 @@ export function DiagnosticReportComponent({
         </CardTitle>
       </CardHeader>
       <CardContent className="space-y-4">
-        {!report ? (
+        {!report && isStreaming ? (
+          <div className="space-y-6">
+            <div className="flex items-center gap-2 text-sm text-gray-500">
+              <div className="h-4 w-4 animate-spin rounded-full border-2 border-current border-t-transparent" />
+              Generating Report...
+            </div>
+            {partialReport.summary && (
+              <div className="flex items-start justify-between">
+                <div className="flex-1">
+                  <h3 className="text-lg font-semibold mb-2">Summary</h3>
+                  <p className="text-gray-700">{partialReport.summary}</p>
+                </div>
+                {partialReport.severity_level && (
+                  <Badge
+                    className={`ml-4 flex items-center gap-1 ${getSeverityColor(
+                      partialReport.severity_level
+                    )}`}
+                  >
+                    {getSeverityIcon(partialReport.severity_level)}
+                    {partialReport.severity_level.charAt(0).toUpperCase() +
+                      partialReport.severity_level.slice(1)}
+                  </Badge>
+                )}
+              </div>
+            )}
+            {partialReport.recommendations && (
+              <div>
+                <h3 className="text-lg font-semibold mb-3">Recommendations</h3>
+                <ul className="space-y-2">
+                  {partialReport.recommendations.map(
+                    (recommendation, index) => (
+                      <li key={index} className="flex items-start gap-2">
+                        <CheckCircle className="h-4 w-4 text-green-600 mt-0.5 flex-shrink-0" />
+                        <span className="text-gray-700">{recommendation}</span>
+                      </li>
+                    )
+                  )}
+                </ul>
+              </div>
+            )}
+          </div>
+        ) : !report ? (
           <div className="flex flex-col items-center text-center">
             <FileText className="h-12 w-12 text-gray-400 mb-4" />
             <p className="text-gray-600 mb-4 max-w-sm">
@@ -132,10 +180,14 @@ export function DiagnosticReportComponent({
             </p>
             <Button
               onClick={handleGenerateReport}
-              disabled={generateReport.isPending || predictions.length === 0}
+              disabled={
+                generateReport.isPending ||
+                reportPending ||
+                predictions.length === 0
+              }
               className="flex items-center gap-2"
             >
-              {generateReport.isPending ? (
+              {generateReport.isPending || reportPending ? (
                 <>
                   <div className="h-4 w-4 animate-spin rounded-full border-2 border-white border-t-transparent" />
                   Generating Report...
@@ -211,6 +263,9 @@ export function DiagnosticReportComponent({
                 Based on {predictions.length} detection
                 {predictions.length !== 1 ? "s" : ""}
               </p>
+              {report.generated_by === "rules" && (
+                <p>Templated report for a routine study</p>
+              )}
             </div>
 
             <div className="flex gap-4">
@@ -192,6 +192,7 @@ export function ResultCard({
                   metadata={fileState.result.metadata}
                   imageInfo={fileState.result.image_info}
                   report={fileState.diagnosticReport}
+                  reportPending={fileState.reportPending}
                   onReportGenerated={handleReportGenerated}
                   originalImageSrc={fileData?.dataUrl} // Pass the original image source
                 />
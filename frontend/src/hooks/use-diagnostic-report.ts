@@ -1,25 +1,118 @@
+import { useState } from "react";
 import { useMutation } from "@tanstack/react-query";
 import apiClient from "@/lib/axios";
 import type {
+  DiagnosticReport,
   DiagnosticReportRequest,
   DiagnosticReportResponse,
+  ReportJob,
+  ReportSectionEvent,
 } from "@/lib/types";
 
+// Seconds the server holds each report job request before answering
+const REPORT_JOB_WAIT_SECONDS = 25;
+
+// Ensure the data structure matches backend expectations
+const toRequestBody = (data: DiagnosticReportRequest) => ({
+  predictions: data.predictions,
+  metadata: data.metadata || null,
+  image_info: data.image_info || null,
+});
+
 export const useGenerateDiagnosticReport = () => {
   return useMutation<DiagnosticReportResponse, Error, DiagnosticReportRequest>({
     mutationFn: async (data: DiagnosticReportRequest) => {
-      // Ensure the data structure matches backend expectations
-      const requestBody = {
-        predictions: data.predictions,
-        metadata: data.metadata || null,
-        image_info: data.image_info || null,
-      };
-
       const response = await apiClient.post<DiagnosticReportResponse>(
         "/generate-diagnostic-report",
-        requestBody
+        toRequestBody(data)
       );
       return response.data;
     },
   });
 };
+
+// Long-poll a report job until it has completed or failed
+export const waitForReportJob = async (jobId: string): Promise<ReportJob> => {
+  for (;;) {
+    const response = await apiClient.get<ReportJob>(`/report-jobs/${jobId}`, {
+      params: { wait: REPORT_JOB_WAIT_SECONDS },
+    });
+    const { status } = response.data;
+    if (status === "completed" || status === "failed") {
+      return response.data;
+    }
+  }
+};
+
+// Parse one Server-Sent Event block into its event name and JSON data
+const parseEvent = (block: string) => {
+  let event = "message";
+  const data: string[] = [];
+  for (const line of block.split("\n")) {
+    if (line.startsWith("event:")) event = line.slice(6).trim();
+    else if (line.startsWith("data:")) data.push(line.slice(5).trimStart());
+  }
+  return { event, data: data.length ? JSON.parse(data.join("\n")) : null };
+};
+
+// Generate a report over the streaming endpoint, exposing each section as
+// soon as it is complete in `partialReport`
+export const useStreamDiagnosticReport = () => {
+  const [partialReport, setPartialReport] = useState<
+    Partial<DiagnosticReport>
+  >({});
+
+  const mutation = useMutation<
+    DiagnosticReportResponse,
+    Error,
+    DiagnosticReportRequest
+  >({
+    mutationFn: async (data: DiagnosticReportRequest) => {
+      setPartialReport({});
+      // axios cannot read a response body as it arrives in the browser
+      const response = await fetch(
+        `${apiClient.defaults.baseURL}/generate-diagnostic-report/stream`,
+        {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            Accept: "text/event-stream",
+          },
+          body: JSON.stringify(toRequestBody(data)),
+        }
+      );
+      if (!response.ok || !response.body) {
+        throw new Error(`Report generation failed (${response.status})`);
+      }
+
+      const reader = response.body
+        .pipeThrough(new TextDecoderStream())
+        .getReader();
+      let buffer = "";
+      let result: DiagnosticReportResponse | null = null;
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) >= 0) {
+          const { event, data } = parseEvent(buffer.slice(0, boundary));
+          buffer = buffer.slice(boundary + 2);
+          if (event === "section") {
+            const { name, value } = data as ReportSectionEvent;
+            setPartialReport((current) => ({ ...current, [name]: value }));
+          } else if (event === "report") {
+            result = data as DiagnosticReportResponse;
+          }
+        }
+      }
+
+      if (!result) {
+        throw new Error("Report stream ended before the report was complete");
+      }
+      return result;
+    },
+  });
+
+  return { ...mutation, partialReport };
+};
@@ -1,6 +1,8 @@
 import { useMutation } from "@tanstack/react-query";
 import { useState, useCallback } from "react";
 import apiClient from "@/lib/axios";
+import { parseServerTiming } from "@/lib/utils";
+import { waitForReportJob } from "@/hooks/use-diagnostic-report";
 import {
   ConvertedDicomData,
   DicomDetectionResponse,
@@ -84,6 +86,7 @@ export function useDicomDetection() {
           const formData = new FormData();
           formData.append("file", file.originalFile);
 
+          // The report is generated on the server while the detections show
           const response = await apiClient.post<DicomDetectionResponse>(
             "/detect-dicom",
             formData,
@@ -91,6 +94,7 @@ export function useDicomDetection() {
               headers: {
                 "Content-Type": "multipart/form-data",
               },
+              params: { report: true },
             }
           );
 
@@ -98,14 +102,34 @@ export function useDicomDetection() {
             ...response.data,
             fileId: file.id,
             fileName: file.fileName,
+            serverTimings: parseServerTiming(response.headers["server-timing"]),
           };
 
           // Update to success state
+          const reportJob = response.data.report_job;
           updateFileStatus(file.id, {
             status: "success",
             result,
+            reportPending: Boolean(reportJob),
           });
 
+          // Without a finished job the report can still be generated by hand
+          if (reportJob) {
+            waitForReportJob(reportJob.job_id)
+              .then((job) =>
+                updateFileStatus(file.id, {
+                  reportPending: false,
+                  ...(job.result && {
+                    diagnosticReport: job.result.diagnostic_report,
+                  }),
+                })
+              )
+              .catch((error) => {
+                console.error("Report job failed:", error);
+                updateFileStatus(file.id, { reportPending: false });
+              });
+          }
+
           return result;
         } catch (error) {
           const errorObj =
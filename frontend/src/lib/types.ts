@@ -24,6 +24,7 @@ export interface DicomMetadata {
   manufacturer_model_name?: string;
   rows?: number;
   columns?: number;
+  number_of_frames?: number;
   pixel_spacing?: number[];
   bits_allocated?: number;
   bits_stored?: number;
@@ -43,17 +44,22 @@ export interface ImageInfo {
   pixel_array_max: number;
   photometric_interpretation?: string;
   transfer_syntax?: string;
+  inference_size?: number[];
 }
 
 export interface DicomDetectionResponse {
   predictions: Detection[];
   metadata: DicomMetadata;
   image_info: ImageInfo;
+  // Report job started with the detections, with /detect-dicom?report=true
+  report_job?: ReportJob | null;
 }
 
 export interface DicomDetectionResult extends DicomDetectionResponse {
   fileId: string;
   fileName: string;
+  // Backend processing time per stage in milliseconds, from Server-Timing
+  serverTimings?: Record<string, number>;
 }
 
 // Type for the converted DICOM data
@@ -75,6 +81,8 @@ export interface FileDetectionState {
   result?: DicomDetectionResult;
   error?: Error;
   diagnosticReport?: DiagnosticReport;
+  // A report job started with the detections has not finished yet
+  reportPending?: boolean;
 }
 
 export interface DetectionProgress {
@@ -91,6 +99,9 @@ export interface DiagnosticReport {
   recommendations: string[];
   severity_level: "low" | "moderate" | "high";
   generated_at: string;
+  cache_hit: boolean;
+  generated_by: "rules" | "llm" | "fallback";
+  prompt_tokens?: number;
 }
 
 export type DiagnosticReportRequest = DicomDetectionResponse;
@@ -100,3 +111,33 @@ export interface DiagnosticReportResponse {
   detections_used: Detection[];
   metadata?: DicomMetadata;
 }
+
+// Events of /generate-diagnostic-report/stream: `token` carries a
+// ReportTokenEvent, `section` a ReportSectionEvent and the final `report`
+// a DiagnosticReportResponse
+export interface ReportTokenEvent {
+  text: string;
+}
+
+export type ReportSectionName =
+  | "summary"
+  | "severity_level"
+  | "recommendations"
+  | "report";
+
+export type ReportSectionEvent = {
+  [K in ReportSectionName]: { name: K; value: DiagnosticReport[K] };
+}[ReportSectionName];
+
+// Queued report generation, /report-jobs
+export interface ReportJob {
+  job_id: string;
+  status: "queued" | "running" | "completed" | "failed";
+  created_at: string;
+  started_at?: string;
+  finished_at?: string;
+  attempts: number;
+  result?: DiagnosticReportResponse;
+  error?: string;
+  webhook_status?: "pending" | "delivered" | "failed";
+}
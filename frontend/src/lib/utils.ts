@@ -6,6 +6,25 @@ export function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs));
 }
 
+/**
+ * Parse a Server-Timing header into durations per stage
+ * @param header - Header value, e.g. "decode;dur=12.3, total;dur=40.1"
+ * @returns Record<string, number> - Duration in milliseconds per stage name
+ */
+export function parseServerTiming(
+  header?: string | null
+): Record<string, number> {
+  const timings: Record<string, number> = {};
+  for (const entry of (header ?? "").split(",")) {
+    const [name, ...params] = entry.trim().split(";");
+    const duration = params.find((param) => param.trim().startsWith("dur="));
+    if (name && duration) {
+      timings[name] = Number(duration.trim().slice(4));
+    }
+  }
+  return timings;
+}
+
 /**
  * Convert a DICOM file to a JPG/PNG data URL for display
  * @param file - The DICOM file to convert